@@ -0,0 +1,389 @@
+"""
+Benchmarks of model hot paths across data sizes.
+
+Every benchmark result is seconds per operation, the best of several
+repeats, or bytes per stock for memory_* results, so lower is better.
+Results are written as JSON and compared with a saved baseline:
+
+    $ python -m benchmarks.bench --output results.json
+    $ python -m benchmarks.bench --baseline results.json
+"""
+import argparse
+import array
+import collections
+import gc
+import itertools
+import json
+import platform
+import re
+import string
+import sys
+import time
+
+from sss import bars
+from sss import model
+
+
+REPEAT = 5
+# Result slower than baseline by more than this fraction is a regression
+DEFAULT_TOLERANCE = 0.25
+
+WINDOW_SIZES = (10, 100, 1000, 10 ** 4, 10 ** 5, 10 ** 6)
+UNIVERSE_SIZES = (5, 50, 500, 5000, 50000)
+MEMORY_UNIVERSE_SIZE = 10 ** 5
+QUICK_WINDOW_SIZES = (10, 1000)
+QUICK_UNIVERSE_SIZES = (5, 500)
+QUICK_MEMORY_UNIVERSE_SIZE = 10 ** 4
+SUBSCRIPTIONS_PER_STOCK = 10
+
+
+class _BenchmarkStock(model.Stock):
+    __slots__ = ()
+
+    # Three letter symbols are not enough for the largest universes
+    _SYMBOL_PATTERN = re.compile(r'^[A-Z]{3,4}$')
+
+
+def _symbols(count):
+    symbols = itertools.chain(
+        itertools.product(string.ascii_uppercase, repeat=3),
+        itertools.product(string.ascii_uppercase, repeat=4)
+    )
+    return [''.join(symbol) for symbol in itertools.islice(symbols, count)]
+
+
+def _build_stock(symbol='TEA', trades=0, **kwargs):
+    """
+    Stock with the given number of trades during the last minute.
+    """
+    stock = _BenchmarkStock(symbol, model.TYPE_COMMON, 8, None, 100,
+                            **kwargs)
+    if trades:
+        now = time.time()
+        step = 60.0 / trades
+        stock.record_trade_columns(
+            array.array('d', (now - 60.0 + i * step for i in xrange(trades))),
+            array.array('l', (1 + i % 100 for i in xrange(trades))),
+            [model.TRADE_BUY] * trades,
+            array.array('d', (1.0 + i % 7 for i in xrange(trades)))
+        )
+    return stock
+
+
+def _best(function, number, setup=None):
+    """
+    Best time per call of function over REPEAT runs of number calls. setup
+    returns the argument of function and is not timed.
+    """
+    times = []
+    for _ in xrange(REPEAT):
+        argument = setup() if setup is not None else None
+        started_at = time.time()
+        for _ in xrange(number):
+            function(argument)
+        times.append((time.time() - started_at) / number)
+    return min(times)
+
+
+def _deep_size(objects):
+    """
+    Bytes taken by objects and everything they refer to, except classes and
+    modules. Shared objects are counted once.
+    """
+    seen = set()
+    pending = list(objects)
+    size = 0
+    while pending:
+        value = pending.pop()
+        if id(value) in seen or isinstance(value, (type, type(sys))):
+            continue
+        seen.add(id(value))
+        size += sys.getsizeof(value)
+        pending.extend(gc.get_referents(value))
+    return size
+
+
+def bench_record_trade(quick):
+    count = 10 ** 4 if quick else 10 ** 5
+    timestamps = iter(itertools.count(time.time(), 1e-6))
+
+    def record(stock):
+        stock.record_trade(next(timestamps), 10, model.TRADE_BUY, 1.5)
+
+    def record_columns(stock):
+        now = next(timestamps)
+        stock.record_trade_columns(
+            array.array('d', [now] * 1000), array.array('l', [10] * 1000),
+            [model.TRADE_BUY] * 1000, array.array('d', [1.5] * 1000)
+        )
+
+    def build_trusted_stock():
+        return _build_stock(trusted=True)
+
+    return collections.OrderedDict([
+        ('record_trade', _best(record, count, _build_stock)),
+        ('record_trade_trusted', _best(record, count, build_trusted_stock)),
+        ('record_trade_columns[1000]',
+         _best(record_columns, count // 1000, _build_stock) / 1000),
+        ('record_trade_columns_trusted[1000]',
+         _best(record_columns, count // 1000, build_trusted_stock) / 1000),
+    ])
+
+
+def bench_stock_price(quick):
+    calls = 1000 if quick else 10000
+    results = collections.OrderedDict()
+    for size in QUICK_WINDOW_SIZES if quick else WINDOW_SIZES:
+        stock = _build_stock(trades=size)
+        results['stock_price[{}]'.format(size)] = _best(
+            lambda _: stock.stock_price, calls
+        )
+        results['pe_ratio[{}]'.format(size)] = _best(
+            lambda _: stock.pe_ratio, calls
+        )
+
+        def record_and_price(_):
+            stock.record_trade(time.time(), 10, model.TRADE_BUY, 1.5)
+            stock.stock_price
+
+        results['record_trade_and_stock_price[{}]'.format(size)] = _best(
+            record_and_price, calls
+        )
+    return results
+
+
+def bench_all_share_index(quick):
+    calls = 1000 if quick else 10000
+    results = collections.OrderedDict()
+    for size in QUICK_UNIVERSE_SIZES if quick else UNIVERSE_SIZES:
+        stock_manager = model.StockManager()
+        stocks = [_build_stock(symbol, trades=2) for symbol in _symbols(size)]
+        for stock in stocks:
+            stock_manager.add_stock(stock)
+
+        def index_of_changed_stock(_, stocks=itertools.cycle(stocks)):
+            next(stocks).record_trade(time.time(), 10, model.TRADE_BUY, 1.5)
+            stock_manager.all_share_index
+
+        results['all_share_index[{}]'.format(size)] = _best(
+            lambda _: stock_manager.all_share_index, calls
+        )
+        results['all_share_index_after_trade[{}]'.format(size)] = _best(
+            index_of_changed_stock, calls
+        )
+
+        def all_stocks_changed():
+            now = time.time()
+            for stock in stocks:
+                stock.record_trade(now, 10, model.TRADE_BUY, 1.5)
+
+        results['all_share_index_full[{}]'.format(size)] = _best(
+            lambda _: stock_manager.all_share_index, 1, all_stocks_changed
+        )
+    return results
+
+
+def bench_eviction(quick):
+    count = 10 ** 4 if quick else 10 ** 5
+
+    def record_and_price(stock):
+        # Every trade outlives the window almost at once, so reads evict
+        stock.record_trade(time.time(), 10, model.TRADE_BUY, 1.5)
+        stock.stock_price
+
+    results = collections.OrderedDict()
+    results['eviction_record_trade_and_stock_price'] = _best(
+        record_and_price, count,
+        lambda: _build_stock(trades_cache_decay_time=0.0001)
+    )
+
+    stock_manager = model.StockManager()
+    stocks = [_build_stock(symbol, trades_cache_decay_time=0.001)
+              for symbol in _symbols(500)]
+    for stock in stocks:
+        stock_manager.add_stock(stock)
+
+    def record_and_index(_, stocks=itertools.cycle(stocks)):
+        next(stocks).record_trade(time.time(), 10, model.TRADE_BUY, 1.5)
+        stock_manager.all_share_index
+
+    results['eviction_all_share_index[500]'] = _best(record_and_index,
+                                                     count // 10)
+    return results
+
+
+def bench_bars(quick):
+    count = 10 ** 4 if quick else 10 ** 5
+    timestamps = iter(itertools.count(time.time(), 0.01))
+
+    def record(stock):
+        stock.record_trade(next(timestamps), 10, model.TRADE_BUY, 1.5)
+
+    results = collections.OrderedDict()
+    results['record_trade_with_bars'] = _best(
+        record, count,
+        lambda: _build_stock(bar_lengths=bars.DEFAULT_BAR_LENGTHS)
+    )
+
+    size = QUICK_UNIVERSE_SIZES[-1] if quick else UNIVERSE_SIZES[-2]
+    stock_manager = model.StockManager()
+    for symbol in _symbols(size):
+        stock = _build_stock(symbol, bar_lengths=(bars.BAR_1S,))
+        now = time.time()
+        stock.record_trade_columns(
+            array.array('d', (now - 100.0 + i for i in xrange(100))),
+            array.array('l', [10] * 100), [model.TRADE_BUY] * 100,
+            array.array('d', (1.0 + i % 7 for i in xrange(100)))
+        )
+        stock_manager.add_stock(stock)
+    results['last_10_bars[{}]'.format(size)] = _best(
+        lambda _: stock_manager.bars(bars.BAR_1S, 10), 10
+    )
+    return results
+
+
+def bench_subscriptions(quick):
+    calls = 1000 if quick else 10000
+    size = QUICK_UNIVERSE_SIZES[-1] if quick else UNIVERSE_SIZES[-2]
+    stock_manager = model.StockManager()
+    stocks = [_build_stock(symbol, trades=2) for symbol in _symbols(size)]
+    notifications = []
+    for stock in stocks:
+        stock_manager.add_stock(stock)
+        for threshold in xrange(SUBSCRIPTIONS_PER_STOCK):
+            stock_manager.subscribe_price(stock.symbol, notifications.append,
+                                          threshold=threshold * 0.01)
+    stock_manager.subscribe_index(notifications.append)
+    stock_manager.publish()
+
+    def publish_after_burst(_, stocks=itertools.cycle(stocks)):
+        stock = next(stocks)
+        now = time.time()
+        for index in xrange(100):
+            stock.record_trade(now, 10, model.TRADE_BUY, 1.0 + index % 7)
+        stock_manager.publish()
+
+    results = collections.OrderedDict()
+    name = '[{}x{}]'.format(size, SUBSCRIPTIONS_PER_STOCK)
+    results['publish_unchanged' + name] = _best(
+        lambda _: stock_manager.publish(), calls
+    )
+    results['publish_after_burst' + name] = _best(publish_after_burst,
+                                                  calls // 10)
+    return results
+
+
+def bench_memory(quick):
+    size = QUICK_MEMORY_UNIVERSE_SIZE if quick else MEMORY_UNIVERSE_SIZE
+    symbols = _symbols(size)
+    stocks = [_build_stock(symbol) for symbol in symbols]
+    results = collections.OrderedDict()
+    results['memory_idle_stock[{}]'.format(size)] = float(
+        _deep_size([stocks]) - _deep_size([symbols])
+    ) / size
+
+    # Trades are older than the decay time, so the next read evicts them
+    timestamp = time.time() - model.DEFAULT_TRADE_DECAY_TIME - 1.0
+    for stock in stocks:
+        stock.record_trade(timestamp, 10, model.TRADE_BUY, 1.5)
+    results['memory_traded_stock[{}]'.format(size)] = float(
+        _deep_size([stocks]) - _deep_size([symbols])
+    ) / size
+
+    for stock in stocks:
+        stock.stock_price
+    results['memory_evicted_stock[{}]'.format(size)] = float(
+        _deep_size([stocks]) - _deep_size([symbols])
+    ) / size
+    return results
+
+
+BENCHMARKS = (bench_record_trade, bench_stock_price, bench_all_share_index,
+              bench_eviction, bench_bars, bench_subscriptions, bench_memory)
+
+
+def run(quick=False, selected=None):
+    results = collections.OrderedDict()
+    for benchmark in BENCHMARKS:
+        if selected and benchmark.__name__ not in selected:
+            continue
+        results.update(benchmark(quick))
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'created_at': time.time(),
+        'quick': quick,
+        'results': results,
+    }
+
+
+Comparison = collections.namedtuple(
+    'Comparison', ('name', 'baseline', 'current', 'ratio', 'regression')
+)
+
+
+def compare(baseline, current, tolerance=DEFAULT_TOLERANCE):
+    """
+    Comparison of every result present in both runs.
+    """
+    comparisons = []
+    for name, value in current['results'].iteritems():
+        baseline_value = baseline['results'].get(name)
+        if not baseline_value:
+            continue
+        ratio = value / baseline_value
+        comparisons.append(Comparison(name, baseline_value, value, ratio,
+                                      ratio > 1.0 + tolerance))
+    return comparisons
+
+
+def _format_value(name, value):
+    if name.startswith('memory_'):
+        return '{:.1f}B'.format(value)
+    for unit, scale in (('s', 1.0), ('ms', 1e3), ('us', 1e6)):
+        if value * scale >= 1.0:
+            return '{:.3f}{}'.format(value * scale, unit)
+    return '{:.1f}ns'.format(value * 1e9)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Model benchmarks')
+    parser.add_argument('--output', metavar='PATH',
+                        help='write results as JSON')
+    parser.add_argument('--baseline', metavar='PATH',
+                        help='compare results with saved ones')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--quick', action='store_true',
+                        help='smaller data sizes for a quick check')
+    parser.add_argument('benchmarks', nargs='*', metavar='BENCHMARK',
+                        help='names of benchmarks to run, e.g. '
+                        'bench_stock_price')
+    args = parser.parse_args(argv)
+
+    current = run(args.quick, args.benchmarks)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(current, output, indent=2)
+
+    if not args.baseline:
+        for name, value in current['results'].iteritems():
+            print '{:<50}{:>12}'.format(name, _format_value(name, value))
+        return 0
+
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    comparisons = compare(baseline, current, args.tolerance)
+    for comparison in comparisons:
+        print '{:<50}{:>12}{:>12}{:>8.2f}x{}'.format(
+            comparison.name,
+            _format_value(comparison.name, comparison.baseline),
+            _format_value(comparison.name, comparison.current),
+            comparison.ratio,
+            '  REGRESSION' if comparison.regression else ''
+        )
+    return 1 if any(comparison.regression
+                    for comparison in comparisons) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,200 @@
+"""
+Incremental OHLCV time bars of recorded trades.
+"""
+import array
+import collections
+import math
+
+
+BAR_1S = 1.0
+BAR_1M = 60.0
+BAR_5M = 5 * 60.0
+DEFAULT_BAR_LENGTHS = (BAR_1S, BAR_1M, BAR_5M)
+
+# Number of completed bars kept by a bar builder
+DEFAULT_BAR_HISTORY = 512
+
+
+Bar = collections.namedtuple(
+    'Bar', ('start', 'open', 'high', 'low', 'close', 'volume', 'vwap',
+            'trade_count')
+)
+
+
+class BarBuilder(object):
+    """
+    Bars of trades over buckets of length seconds, aligned to multiples of
+    length since epoch.
+
+    The current bar is updated in place by every trade and moved to the
+    history when a trade of a later bucket arrives, so a trade costs O(1).
+    Buckets without trades have no bars. Completed bars are kept column-wise
+    in typed arrays used as a ring buffer of at most history bars.
+    """
+
+    __slots__ = ('_length', '_history', '_starts', '_opens', '_highs',
+                 '_lows', '_closes', '_volumes', '_values', '_trade_counts',
+                 '_next', '_start', '_end', '_open_timestamp', '_open',
+                 '_high', '_low', '_close', '_volume', '_value',
+                 '_trade_count')
+
+    def __init__(self, length, history=DEFAULT_BAR_HISTORY):
+        if not length > 0.0:
+            raise ValueError('bar length should be a positive number')
+        if history < 1:
+            raise ValueError('bar history should be a positive number')
+        self._length = float(length)
+        self._history = history
+        # Columns grow up to history bars, then the oldest bar is replaced
+        self._starts = array.array('d')
+        self._opens = array.array('d')
+        self._highs = array.array('d')
+        self._lows = array.array('d')
+        self._closes = array.array('d')
+        self._volumes = array.array('d')
+        self._values = array.array('d')
+        self._trade_counts = array.array('l')
+        # Position of the next completed bar
+        self._next = 0
+
+        # Current bar, there is none while _trade_count is 0
+        self._start = self._end = self._open_timestamp = 0.0
+        self._open = self._high = self._low = self._close = 0.0
+        self._volume = self._value = 0.0
+        self._trade_count = 0
+
+    @property
+    def length(self):
+        return self._length
+
+    def __len__(self):
+        """
+        Number of bars, including the current one.
+        """
+        return len(self._starts) + (1 if self._trade_count else 0)
+
+    def add(self, timestamp, quantity, price):
+        """
+        Add a trade. Trades should be added in time order.
+        """
+        if timestamp >= self._end or not self._trade_count:
+            if self._trade_count:
+                self._complete((self._start, self._open, self._high,
+                                self._low, self._close, self._volume,
+                                self._value, self._trade_count))
+            length = self._length
+            self._start = math.floor(timestamp / length) * length
+            self._end = self._start + length
+            self._open_timestamp = timestamp
+            self._open = self._high = self._low = price
+            self._volume = self._value = 0.0
+            self._trade_count = 0
+        elif price > self._high:
+            self._high = price
+        elif price < self._low:
+            self._low = price
+        self._close = price
+        self._volume += quantity
+        self._value += quantity * price
+        self._trade_count += 1
+
+    def insert(self, timestamp, quantity, price):
+        """
+        Add a trade older than the latest added one. A trade of the current
+        bar updates it in full. A trade of a completed bar in the history
+        updates its high, low, volume, VWAP and trade count only, its open
+        and close stay of the trades added in time order. A trade of a
+        bucket without a bar, later than all completed bars, completes a bar
+        of its own. Returns False if there is no bar for the trade in the
+        history.
+        """
+        if timestamp >= self._start and self._trade_count:
+            if timestamp < self._open_timestamp:
+                self._open_timestamp = timestamp
+                self._open = price
+            self._high = max(self._high, price)
+            self._low = min(self._low, price)
+            self._volume += quantity
+            self._value += quantity * price
+            self._trade_count += 1
+            return True
+
+        start = math.floor(timestamp / self._length) * self._length
+        completed = len(self._starts)
+        if not completed or self._starts[self._next - 1] < start:
+            self._complete((start, price, price, price, price, quantity,
+                            quantity * price, 1))
+            return True
+        for offset in xrange(1, completed + 1):
+            position = (self._next - offset) % completed
+            if self._starts[position] <= start:
+                break
+        else:
+            return False
+        if self._starts[position] != start:
+            return False
+        self._highs[position] = max(self._highs[position], price)
+        self._lows[position] = min(self._lows[position], price)
+        self._volumes[position] += quantity
+        self._values[position] += quantity * price
+        self._trade_counts[position] += 1
+        return True
+
+    def extend(self, timestamps, quantities, prices):
+        add = self.add
+        for index in xrange(len(timestamps)):
+            add(timestamps[index], quantities[index], prices[index])
+
+    def _complete(self, bar):
+        columns = (self._starts, self._opens, self._highs, self._lows,
+                   self._closes, self._volumes, self._values,
+                   self._trade_counts)
+        if len(self._starts) < self._history:
+            for column, value in zip(columns, bar):
+                column.append(value)
+        else:
+            position = self._next
+            for column, value in zip(columns, bar):
+                column[position] = value
+        self._next = (self._next + 1) % self._history
+
+    def current_bar(self):
+        """
+        Bar of the latest bucket with trades, None if there are no trades.
+        """
+        if not self._trade_count:
+            return None
+        return Bar(self._start, self._open, self._high, self._low,
+                   self._close, int(self._volume),
+                   self._value / self._volume, self._trade_count)
+
+    def last_bars(self, count):
+        """
+        List of at most count latest bars in time order, the last one is the
+        current bar.
+        """
+        current_bar = self.current_bar()
+        if current_bar is not None:
+            count -= 1
+        completed = min(max(count, 0), len(self._starts))
+        # Completed bars are one or two slices of the ring
+        first = (self._next - completed) % max(len(self._starts), 1)
+        if first + completed <= len(self._starts):
+            segments = [(first, first + completed)]
+        else:
+            segments = [(first, len(self._starts)),
+                        (0, first + completed - len(self._starts))]
+
+        bars = []
+        for start, stop in segments:
+            for (bar_start, open_price, high, low, close, volume, value,
+                 trade_count) in zip(
+                    self._starts[start:stop], self._opens[start:stop],
+                    self._highs[start:stop], self._lows[start:stop],
+                    self._closes[start:stop], self._volumes[start:stop],
+                    self._values[start:stop], self._trade_counts[start:stop]):
+                bars.append(Bar(bar_start, open_price, high, low, close,
+                                int(volume), value / volume, trade_count))
+        if current_bar is not None and count >= 0:
+            bars.append(current_bar)
+        return bars
@@ -1,7 +1,7 @@
 import cmd
-import time
 
 import model
+import stats
 
 
 class ExitSubcommand(Exception):
@@ -21,8 +21,8 @@ class SingleStockShell(cmd.Cmd):
         Calculate the dividend yeild.
         """
         try:
-            print 'Dividend yield:', self._stock.dividend_yield
-        except model.NoTradesError as e:
+            print 'Dividend yield:', self._stock.snapshot().dividend_yield
+        except model.StockError as e:
             print e.message
 
     def do_pe_ratio(self, args):
@@ -30,7 +30,7 @@ class SingleStockShell(cmd.Cmd):
         Calculate the P/E ratio.
         """
         try:
-            print 'P/E ratio:', self._stock.pe_ratio
+            print 'P/E ratio:', self._stock.snapshot().pe_ratio
         except model.StockError as e:
             print e.message
 
@@ -48,7 +48,7 @@ class SingleStockShell(cmd.Cmd):
             return
 
         try:
-            self._stock.record_trade(time.time(), *args)
+            self._stock.record_trade(self._stock.clock.now(), *args)
         except model.ValidationError as e:
             print e.message
         else:
@@ -111,6 +111,47 @@ class SuperSimpleStocksShell(cmd.Cmd):
         except model.NoTradesError as e:
             print e.message
 
+    def do_stats(self, args):
+        """
+        Show counters and latencies of trades recording and price
+        calculations, enable or disable collecting them or export them as
+        JSON.
+        Usage:
+            stats [on|off|export <path>]
+        """
+        if not hasattr(self._stock_manager, 'stats_snapshot'):
+            # Sharded and compact stock managers are not instrumented
+            print 'Statistics are not supported by this stock manager'
+            return
+
+        args = args.split()
+        if args == ['on']:
+            self._stock_manager.enable_stats()
+            print 'Statistics enabled'
+            return
+        if args == ['off']:
+            self._stock_manager.disable_stats()
+            print 'Statistics disabled'
+            return
+
+        snapshot = self._stock_manager.stats_snapshot()
+        if snapshot is None:
+            print 'Statistics are disabled, enable them with "stats on"'
+            return
+
+        if len(args) == 2 and args[0] == 'export':
+            try:
+                with open(args[1], 'w') as stats_file:
+                    stats.export(snapshot, stats_file)
+            except IOError as e:
+                print 'Cannot export statistics: {}'.format(e)
+            else:
+                print 'Statistics exported to', args[1]
+        elif not args:
+            print stats.format_snapshot(snapshot)
+        else:
+            print 'Usage: stats [on|off|export <path>]'
+
     def do_quit(self, args):
         """
         Quits the simulation.
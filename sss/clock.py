@@ -0,0 +1,67 @@
+"""
+Clocks telling stocks what time it is now, which decides what trades decay.
+
+Stocks read now() of their clock for prices and notify it of every
+recorded trade timestamp with observe(), so event time can follow trades.
+"""
+import threading
+import time
+
+
+class WallClock(object):
+    """
+    Current system time.
+    """
+
+    def now(self):
+        return time.time()
+
+    def observe(self, timestamp):
+        pass
+
+
+class SimulatedClock(object):
+    """
+    Time which changes only when it is set or advanced, for reproducible
+    tests and backtests.
+    """
+
+    def __init__(self, now=0.0):
+        self._now = float(now)
+
+    def now(self):
+        return self._now
+
+    def set(self, now):
+        self._now = float(now)
+
+    def advance(self, seconds):
+        self._now += seconds
+
+    def observe(self, timestamp):
+        pass
+
+
+class EventClock(object):
+    """
+    Time of the latest trade observed so far, so recorded trades are
+    replayed as fast as they are read, with prices as they were at the time
+    of the trades.
+    """
+
+    def __init__(self, now=0.0):
+        self._now = float(now)
+        self._lock = threading.Lock()
+
+    def now(self):
+        return self._now
+
+    def observe(self, timestamp):
+        if timestamp > self._now:
+            with self._lock:
+                if timestamp > self._now:
+                    self._now = timestamp
+
+
+# Clock of stocks and stock managers created without one
+WALL_CLOCK = WallClock()
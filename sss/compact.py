@@ -0,0 +1,481 @@
+import array
+import collections
+import heapq
+import itertools
+import math
+
+import model
+
+
+# Stock types are stored as indexes of model.STOCK_TYPES
+_STOCK_TYPE_IDS = dict((stock_type, stock_type_id)
+                       for stock_type_id, stock_type
+                       in enumerate(model.STOCK_TYPES))
+
+# Marks an empty trade list and the end of a trade list
+_NO_TRADE = -1
+
+
+class CompactStock(object):
+    """
+    Lightweight view of a stock of a compact stock manager, with the same
+    API as model.Stock for reference data, prices and trade recording.
+    """
+
+    __slots__ = ('_manager', '_stock_id')
+
+    def __init__(self, manager, stock_id):
+        self._manager = manager
+        self._stock_id = stock_id
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, CompactStock) and
+            self._manager is other._manager and
+            self._stock_id == other._stock_id
+        )
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._stock_id)
+
+    @property
+    def symbol(self):
+        return self._manager._symbols[self._stock_id]
+
+    @property
+    def stock_type(self):
+        return model.STOCK_TYPES[self._manager._stock_types[self._stock_id]]
+
+    @property
+    def last_dividend(self):
+        return self._manager._last_dividends[self._stock_id]
+
+    @property
+    def fixed_dividend(self):
+        if self.stock_type == model.TYPE_COMMON:
+            return None
+        return self._manager._fixed_dividends[self._stock_id] / 100.0
+
+    @property
+    def fixed_dividend_percent(self):
+        if self.stock_type == model.TYPE_COMMON:
+            return None
+        return self._manager._fixed_dividends[self._stock_id]
+
+    @property
+    def par_value(self):
+        return self._manager._par_values[self._stock_id]
+
+    @property
+    def clock(self):
+        return self._manager.clock
+
+    @property
+    def trade_count(self):
+        return self._manager._trade_counts[self._stock_id]
+
+    def reference_data(self):
+        return {
+            'symbol': self.symbol,
+            'stock_type': self.stock_type,
+            'last_dividend': self.last_dividend,
+            'fixed_dividend': self.fixed_dividend_percent,
+            'par_value': self.par_value,
+            'trades_cache_decay_time': self._manager.trades_cache_decay_time,
+        }
+
+    @property
+    def stock_price(self):
+        return self._manager._stock_price(self._stock_id,
+                                          self._manager.clock.now())
+
+    @property
+    def dividend_yield(self):
+        return self.snapshot().dividend_yield
+
+    @property
+    def pe_ratio(self):
+        return self.snapshot().pe_ratio
+
+    def snapshot(self):
+        return model._stock_snapshot(self.symbol, self.stock_type,
+                                     self.last_dividend, self.fixed_dividend,
+                                     self.par_value, self.stock_price)
+
+    def record_trade(self, timestamp, quantity, buy_sell, price):
+        self._manager._record_trade(self._stock_id, timestamp, quantity,
+                                    buy_sell, price)
+
+    def record_trades(self, trades):
+        trades = list(trades)
+        if not trades:
+            return []
+        return self.record_trade_columns(*zip(*trades))
+
+    def record_trade_columns(self, timestamps, quantities, buy_sells, prices):
+        return self._manager._record_trade_columns(
+            self._stock_id, timestamps, quantities, buy_sells, prices
+        )
+
+
+class CompactStockManager(object):
+    """
+    Stock manager for very large universes.
+
+    Symbols are interned to dense integer ids and everything else is kept in
+    typed arrays indexed by them: reference data, running VWAP sums over the
+    decay window and the All Share Index terms. Trades of all stocks share
+    one pool of typed arrays, trades of every stock are linked in time order
+    and slots of evicted trades are reused. Stock objects are not kept,
+    get_stock creates a CompactStock view.
+
+    All stocks share the decay time and the clock. Price windows, arbitrary
+    range VWAP, listeners, journaling, stats and thread safety of
+    model.StockManager are not supported in this mode.
+    """
+
+    def __init__(self,
+                 trades_cache_decay_time=model.DEFAULT_TRADE_DECAY_TIME,
+                 clock=None):
+        self._trades_cache_decay_time = trades_cache_decay_time
+        self._clock = clock or model._WALL_CLOCK
+
+        self._symbol_ids = {}
+        self._symbols = []
+        self._stock_types = array.array('b')
+        self._last_dividends = array.array('d')
+        # Fixed dividend in percent, 0.0 for common stocks
+        self._fixed_dividends = array.array('d')
+        self._par_values = array.array('d')
+
+        # Running sums over stored trades of every stock
+        self._value_sums = array.array('d')
+        self._quantity_sums = array.array('d')
+        self._evicted_values = array.array('d')
+        self._trade_counts = array.array('l')
+        self._first_trades = array.array('l')
+        self._last_trades = array.array('l')
+
+        # Trade pool, next trade of the same stock or the next free slot
+        self._trade_timestamps = array.array('d')
+        self._trade_quantities = array.array('l')
+        self._trade_prices = array.array('d')
+        self._next_trades = array.array('l')
+        self._free_trade = _NO_TRADE
+
+        # All Share Index terms, same as of model.StockManager
+        self._log_prices = array.array('d')
+        self._has_log_price = array.array('b')
+        self._log_prices_count = 0
+        self._log_prices_sum = 0.0
+        self._log_prices_updates = 0
+        self._dirty_stocks = set()
+        self._eviction_times = []
+        self._scheduled_evictions = {}
+
+    @property
+    def trades_cache_decay_time(self):
+        return self._trades_cache_decay_time
+
+    @property
+    def clock(self):
+        return self._clock
+
+    def __len__(self):
+        return len(self._symbols)
+
+    def add_stock(self, stock):
+        """
+        Add reference data of a stock, recorded trades of the stock are not
+        copied. Reference data of a stock with the same symbol is replaced,
+        its trades are kept.
+        """
+        reference_data = stock.reference_data()
+        self.add_stock_data(
+            reference_data['symbol'], reference_data['stock_type'],
+            reference_data['last_dividend'], reference_data['fixed_dividend'],
+            reference_data['par_value']
+        )
+
+    def add_stock_data(self, symbol, stock_type, last_dividend,
+                       fixed_dividend, par_value):
+        """
+        Same as add_stock, without creating a model.Stock.
+        """
+        symbol, stock_type, last_dividend, fixed_dividend, par_value = (
+            model.Stock._validate(symbol, stock_type, last_dividend,
+                                  fixed_dividend, par_value)
+        )
+        stock_type_id = _STOCK_TYPE_IDS[stock_type]
+        fixed_dividend = fixed_dividend or 0.0
+
+        stock_id = self._symbol_ids.get(symbol)
+        if stock_id is not None:
+            self._stock_types[stock_id] = stock_type_id
+            self._last_dividends[stock_id] = last_dividend
+            self._fixed_dividends[stock_id] = fixed_dividend
+            self._par_values[stock_id] = par_value
+            return
+
+        self._symbol_ids[symbol] = len(self._symbols)
+        self._symbols.append(symbol)
+        self._stock_types.append(stock_type_id)
+        self._last_dividends.append(last_dividend)
+        self._fixed_dividends.append(fixed_dividend)
+        self._par_values.append(par_value)
+        for column in (self._value_sums, self._quantity_sums,
+                       self._evicted_values, self._log_prices):
+            column.append(0.0)
+        self._trade_counts.append(0)
+        self._first_trades.append(_NO_TRADE)
+        self._last_trades.append(_NO_TRADE)
+        self._has_log_price.append(0)
+
+    def get_stock(self, symbol):
+        return CompactStock(self, self._symbol_ids[symbol])
+
+    def symbols(self):
+        return list(self._symbols)
+
+    def _append_trade(self, stock_id, timestamp, quantity, price):
+        trade = self._free_trade
+        if trade == _NO_TRADE:
+            trade = len(self._trade_timestamps)
+            self._trade_timestamps.append(timestamp)
+            self._trade_quantities.append(quantity)
+            self._trade_prices.append(price)
+            self._next_trades.append(_NO_TRADE)
+        else:
+            self._free_trade = self._next_trades[trade]
+            self._trade_timestamps[trade] = timestamp
+            self._trade_quantities[trade] = quantity
+            self._trade_prices[trade] = price
+            self._next_trades[trade] = _NO_TRADE
+
+        last_trade = self._last_trades[stock_id]
+        if last_trade == _NO_TRADE:
+            self._first_trades[stock_id] = trade
+        else:
+            self._next_trades[last_trade] = trade
+        self._last_trades[stock_id] = trade
+        self._trade_counts[stock_id] += 1
+        self._value_sums[stock_id] += quantity * price
+        self._quantity_sums[stock_id] += quantity
+
+    def _last_timestamp(self, stock_id):
+        trade = self._last_trades[stock_id]
+        if trade == _NO_TRADE:
+            return None
+        return self._trade_timestamps[trade]
+
+    def _record_trade(self, stock_id, timestamp, quantity, buy_sell, price):
+        timestamp, quantity, _, price = model._validate_trade(
+            self._last_timestamp(stock_id), timestamp, quantity, buy_sell,
+            price
+        )
+        self._append_trade(stock_id, timestamp, quantity, price)
+        self._clock.observe(timestamp)
+        self._dirty_stocks.add(stock_id)
+
+    def _record_trade_columns(self, stock_id, timestamps, quantities,
+                              buy_sells, prices):
+        columns, rejected = model._validate_trade_columns(
+            self._last_timestamp(stock_id), timestamps, quantities,
+            buy_sells, prices
+        )
+        timestamps, quantities, _, prices = columns
+        for timestamp, quantity, price in itertools.izip(
+            timestamps, quantities, prices
+        ):
+            self._append_trade(stock_id, timestamp, quantity, price)
+        if len(timestamps):
+            self._clock.observe(timestamps[-1])
+            self._dirty_stocks.add(stock_id)
+        return rejected
+
+    def _evict(self, stock_id, now):
+        relevant_since = now - self._trades_cache_decay_time
+        trade = self._first_trades[stock_id]
+        if (
+            trade == _NO_TRADE or
+            self._trade_timestamps[trade] >= relevant_since
+        ):
+            return
+
+        evicted_value = 0.0
+        evicted_quantity = 0
+        evicted_count = 0
+        while (
+            trade != _NO_TRADE and
+            self._trade_timestamps[trade] < relevant_since
+        ):
+            quantity = self._trade_quantities[trade]
+            evicted_value += quantity * self._trade_prices[trade]
+            evicted_quantity += quantity
+            evicted_count += 1
+            next_trade = self._next_trades[trade]
+            self._next_trades[trade] = self._free_trade
+            self._free_trade = trade
+            trade = next_trade
+
+        self._first_trades[stock_id] = trade
+        self._trade_counts[stock_id] -= evicted_count
+        if trade == _NO_TRADE:
+            self._last_trades[stock_id] = _NO_TRADE
+            self._value_sums[stock_id] = 0.0
+            self._quantity_sums[stock_id] = 0.0
+            self._evicted_values[stock_id] = 0.0
+            return
+
+        self._value_sums[stock_id] -= evicted_value
+        self._quantity_sums[stock_id] -= evicted_quantity
+        self._evicted_values[stock_id] += evicted_value
+        if self._evicted_values[stock_id] > self._value_sums[stock_id]:
+            # Same as for time windows, recalculate the running sum once
+            # more was subtracted than is left, to keep its precision
+            self._resync(stock_id)
+
+    def _resync(self, stock_id):
+        values = []
+        quantity_sum = 0
+        trade = self._first_trades[stock_id]
+        while trade != _NO_TRADE:
+            quantity = self._trade_quantities[trade]
+            values.append(quantity * self._trade_prices[trade])
+            quantity_sum += quantity
+            trade = self._next_trades[trade]
+        self._value_sums[stock_id] = math.fsum(values)
+        self._quantity_sums[stock_id] = quantity_sum
+        self._evicted_values[stock_id] = 0.0
+
+    def _stock_price(self, stock_id, now):
+        self._evict(stock_id, now)
+        quantity_sum = self._quantity_sums[stock_id]
+        if not quantity_sum:
+            return 0.0
+        return self._value_sums[stock_id] / quantity_sum
+
+    def _next_eviction_time(self, stock_id):
+        trade = self._first_trades[stock_id]
+        if trade == _NO_TRADE:
+            return None
+        return self._trade_timestamps[trade] + self._trades_cache_decay_time
+
+    @property
+    def all_share_index(self):
+        log_prices_sum, count = self.all_share_index_terms()
+        if not count:
+            return 0.0
+        return math.exp(log_prices_sum / count)
+
+    def all_share_index_terms(self):
+        """
+        Sum of log-prices of stocks with non-zero price and number of such
+        stocks at the time of the manager clock. Terms of several managers
+        can be added up to get the index over all their stocks.
+        """
+        now = self._clock.now()
+        dirty_stocks = self._dirty_stocks
+        self._dirty_stocks = set()
+
+        eviction_times = self._eviction_times
+        while eviction_times and eviction_times[0][0] <= now:
+            eviction_time, stock_id = heapq.heappop(eviction_times)
+            if self._scheduled_evictions.get(stock_id) == eviction_time:
+                del self._scheduled_evictions[stock_id]
+                dirty_stocks.add(stock_id)
+
+        for stock_id in dirty_stocks:
+            self._update_log_price(stock_id, self._stock_price(stock_id, now))
+            self._schedule_eviction(stock_id,
+                                    self._next_eviction_time(stock_id))
+
+        if self._log_prices_updates >= max(self._log_prices_count,
+                                           model.INDEX_RESYNC_MIN_UPDATES):
+            self._log_prices_sum = math.fsum(
+                log_price for log_price, has_log_price in itertools.izip(
+                    self._log_prices, self._has_log_price
+                ) if has_log_price
+            )
+            self._log_prices_updates = 0
+
+        return self._log_prices_sum, self._log_prices_count
+
+    def _update_log_price(self, stock_id, stock_price):
+        if self._has_log_price[stock_id]:
+            self._log_prices_sum -= self._log_prices[stock_id]
+            self._log_prices_count -= 1
+            self._log_prices_updates += 1
+            self._has_log_price[stock_id] = 0
+
+        if stock_price:
+            log_price = math.log(stock_price)
+            self._log_prices[stock_id] = log_price
+            self._has_log_price[stock_id] = 1
+            self._log_prices_sum += log_price
+            self._log_prices_count += 1
+            self._log_prices_updates += 1
+
+        if not self._log_prices_count:
+            self._log_prices_sum = 0.0
+            self._log_prices_updates = 0
+
+    def _schedule_eviction(self, stock_id, eviction_time):
+        if eviction_time is None:
+            self._scheduled_evictions.pop(stock_id, None)
+            return
+
+        if self._scheduled_evictions.get(stock_id) != eviction_time:
+            self._scheduled_evictions[stock_id] = eviction_time
+            heapq.heappush(self._eviction_times, (eviction_time, stock_id))
+
+    def snapshot_all(self):
+        return dict(
+            (symbol, CompactStock(self, stock_id).snapshot())
+            for stock_id, symbol in enumerate(self._symbols)
+        )
+
+    def record_batch(self, trades):
+        """
+        Record many (symbol, timestamp, quantity, buy_sell, price) trades at
+        once. Valid trades are recorded and a list of RejectedTrade is returned
+        for the rest.
+        """
+        trades = list(trades)
+        if not trades:
+            return []
+        return self.record_batch_columns(*zip(*trades))
+
+    def record_batch_columns(self, symbols, timestamps, quantities, buy_sells,
+                             prices):
+        """
+        Same as record_batch, but trades are given as columns.
+        """
+        indexes_by_symbol = collections.defaultdict(list)
+        for index, symbol in enumerate(symbols):
+            indexes_by_symbol[symbol].append(index)
+
+        rejected = []
+        for symbol, indexes in indexes_by_symbol.iteritems():
+            stock_id = self._symbol_ids.get(symbol)
+            if stock_id is None:
+                error = 'Stock "{}" is not found'.format(symbol)
+                rejected.extend(model.RejectedTrade(index, error)
+                                for index in indexes)
+                continue
+
+            stock_rejected = self._record_trade_columns(
+                stock_id,
+                *[model._take(column, indexes)
+                  for column in (timestamps, quantities, buy_sells, prices)]
+            )
+            rejected.extend(
+                model.RejectedTrade(indexes[trade.index], trade.error)
+                for trade in stock_rejected
+            )
+
+        rejected.sort()
+        return rejected
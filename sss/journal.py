@@ -0,0 +1,282 @@
+"""
+Append-only binary journal of recorded trades.
+
+The file starts with a header of magic, format version and record size,
+followed by fixed-size little-endian records of symbol, timestamp,
+quantity, side and price.
+"""
+import array
+import itertools
+import os
+import struct
+import threading
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+MAGIC = 'SSSJ'
+VERSION = 1
+HEADER = struct.Struct('<4sHH')
+RECORD = struct.Struct('<8sdibd')
+if numpy is not None:
+    RECORD_DTYPE = numpy.dtype([
+        ('symbol', 'S8'), ('timestamp', '<f8'), ('quantity', '<i4'),
+        ('side', 'i1'), ('price', '<f8')
+    ])
+
+# Group commit: journal is synced to disk once this many trades are written
+# or this many seconds passed since the last sync
+DEFAULT_SYNC_EVERY = 1024
+DEFAULT_SYNC_INTERVAL = 0.05
+
+# Number of records read at once while looking for the start of the tail
+REPLAY_CHUNK_SIZE = 65536
+
+
+class JournalError(Exception):
+    pass
+
+
+class TradeJournal(object):
+    """
+    Writer of a trade journal.
+
+    Trades are written to a file buffer and the file is flushed and fsynced
+    by group commit, so at most sync_every trades or sync_interval seconds of
+    trades can be lost. Trades left unsynced when writes stop are synced by a
+    timer thread once the interval passes.
+    """
+
+    def __init__(self, path, sync_every=DEFAULT_SYNC_EVERY,
+                 sync_interval=DEFAULT_SYNC_INTERVAL):
+        self._path = path
+        self._sync_every = sync_every
+        self._sync_interval = sync_interval
+        self._lock = threading.Lock()
+
+        if os.path.exists(path) and os.path.getsize(path):
+            size = _check_header(path)
+            self._file = open(path, 'r+b')
+            # Drop a partially written record left by a crash
+            self._file.truncate(
+                HEADER.size +
+                (size - HEADER.size) // RECORD.size * RECORD.size
+            )
+            self._file.seek(0, os.SEEK_END)
+        else:
+            self._file = open(path, 'wb')
+            self._file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+
+        self._unsynced = 0
+        self._synced_at = time.time()
+        self._timer = None
+        self._sync()
+
+    @property
+    def path(self):
+        return self._path
+
+    def append(self, symbol, timestamp, quantity, side, price):
+        with self._lock:
+            self._file.write(RECORD.pack(symbol, timestamp, quantity, side,
+                                         price))
+            self._written(1)
+
+    def extend(self, symbol, timestamps, quantities, sides, prices):
+        """
+        Write trades of a stock given as columns.
+        """
+        with self._lock:
+            self._file.write(''.join(
+                RECORD.pack(symbol, *trade)
+                for trade in zip(timestamps, quantities, sides, prices)
+            ))
+            self._written(len(timestamps))
+
+    def _written(self, count):
+        self._unsynced += count
+        elapsed = time.time() - self._synced_at
+        if (
+            self._unsynced >= self._sync_every or
+            elapsed >= self._sync_interval
+        ):
+            self._sync()
+        elif self._timer is None:
+            self._timer = threading.Timer(self._sync_interval - elapsed,
+                                          self._sync_on_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _sync_on_timer(self):
+        with self._lock:
+            self._timer = None
+            if self._unsynced and not self._file.closed:
+                self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._synced_at = time.time()
+
+    def sync(self):
+        with self._lock:
+            if self._unsynced:
+                self._sync()
+
+    def close(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._file.closed:
+                self._sync()
+                self._file.close()
+
+
+def _check_header(path):
+    size = os.path.getsize(path)
+    with open(path, 'rb') as journal_file:
+        header = journal_file.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise JournalError('{} is not a trade journal'.format(path))
+    magic, version, record_size = HEADER.unpack(header)
+    if magic != MAGIC or record_size != RECORD.size:
+        raise JournalError('{} is not a trade journal'.format(path))
+    if version != VERSION:
+        raise JournalError(
+            'Unsupported trade journal version {}'.format(version)
+        )
+    return size
+
+
+def _read_tail_numpy(journal_file, count, relevant_since):
+    """
+    Records from the end of the journal back to the first chunk which is
+    completely older than relevant_since.
+    """
+    chunks = []
+    stop = count
+    while stop > 0:
+        start = max(stop - REPLAY_CHUNK_SIZE, 0)
+        journal_file.seek(HEADER.size + start * RECORD.size)
+        chunk = numpy.frombuffer(
+            journal_file.read((stop - start) * RECORD.size), RECORD_DTYPE
+        )
+        chunks.append(chunk)
+        if chunk['timestamp'].max() < relevant_since:
+            break
+        stop = start
+    chunks.reverse()
+    return numpy.concatenate(chunks) if chunks else numpy.empty(
+        0, RECORD_DTYPE
+    )
+
+
+def _read_tail_python(journal_file, count, relevant_since):
+    """
+    Same as _read_tail_numpy, but records are unpacked into tuples.
+    """
+    chunks = []
+    stop = count
+    while stop > 0:
+        start = max(stop - REPLAY_CHUNK_SIZE, 0)
+        journal_file.seek(HEADER.size + start * RECORD.size)
+        data = journal_file.read((stop - start) * RECORD.size)
+        chunk = [
+            RECORD.unpack_from(data, offset)
+            for offset in xrange(0, len(data), RECORD.size)
+        ]
+        chunks.append(chunk)
+        if max(record[1] for record in chunk) < relevant_since:
+            break
+        stop = start
+    chunks.reverse()
+    return itertools.chain.from_iterable(chunks)
+
+
+def _replay_numpy(journal_file, count, stocks, now):
+    records = _read_tail_numpy(
+        journal_file, count,
+        min(now - stock.trades_retention_time for stock in stocks.values())
+    )
+
+    replayed = 0
+    for symbol, stock in stocks.iteritems():
+        records_of_stock = records[
+            (records['symbol'] == symbol) &
+            (records['timestamp'] >= now - stock.trades_retention_time)
+        ]
+        if not len(records_of_stock):
+            continue
+        stock.load_trades(
+            array.array('d', records_of_stock['timestamp'].tostring()),
+            array.array('l', records_of_stock['quantity'].astype(
+                numpy.dtype('l')
+            ).tostring()),
+            array.array('b', records_of_stock['side'].tostring()),
+            array.array('d', records_of_stock['price'].tostring())
+        )
+        replayed += len(records_of_stock)
+    return replayed
+
+
+def _replay_python(journal_file, count, stocks, now):
+    records = _read_tail_python(
+        journal_file, count,
+        min(now - stock.trades_retention_time for stock in stocks.values())
+    )
+
+    columns = {}
+    for symbol, timestamp, quantity, side, price in records:
+        symbol = symbol.rstrip('\0')
+        stock = stocks.get(symbol)
+        if stock is None or timestamp < now - stock.trades_retention_time:
+            continue
+        if symbol not in columns:
+            columns[symbol] = (array.array('d'), array.array('l'),
+                               array.array('b'), array.array('d'))
+        for column, value in zip(columns[symbol],
+                                 (timestamp, quantity, side, price)):
+            column.append(value)
+
+    replayed = 0
+    for symbol, stock_columns in columns.iteritems():
+        stocks[symbol].load_trades(*stock_columns)
+        replayed += len(stock_columns[0])
+    return replayed
+
+
+def replay(path, stock_manager, now=None):
+    """
+    Load trades of the journal which are still inside retention time of
+    their stocks at now, the time of the manager clock by default, into
+    stocks of the manager. Trades of unknown stocks are skipped. Returns the
+    number of loaded trades.
+
+    Trades of a stock are journaled in time order, except late trades of
+    stocks with lateness tolerance, and trades of different stocks are
+    expected to be journaled in about time order, so reading stops at the
+    first chunk of records from the end which is older than the longest
+    retention time.
+    """
+    if not os.path.exists(path):
+        return 0
+    size = _check_header(path)
+    count = (size - HEADER.size) // RECORD.size
+    stocks = dict(
+        (symbol, stock_manager.get_stock(symbol))
+        for symbol in stock_manager.symbols()
+    )
+    if not count or not stocks:
+        return 0
+
+    now = stock_manager.clock.now() if now is None else now
+    with open(path, 'rb') as journal_file:
+        if numpy is not None:
+            return _replay_numpy(journal_file, count, stocks, now)
+        return _replay_python(journal_file, count, stocks, now)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""
+Load generator for the trade ingestion server. Several connections send
+trades pipelined up to a number of unanswered requests, latency of a trade
+is the time from sending its line to getting its reply.
+"""
+import argparse
+import collections
+import random
+import socket
+import threading
+import time
+
+import server
+
+
+LoadResult = collections.namedtuple(
+    'LoadResult', ('trades', 'errors', 'seconds', 'throughput',
+                   'p50_latency', 'p99_latency')
+)
+
+
+def _connect(address):
+    if isinstance(address, basestring):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.connect(address)
+    return sock
+
+
+def _run_connection(address, symbols, trades, in_flight, latencies, errors):
+    sock = _connect(address)
+    replies = sock.makefile('rb')
+    sent_at = collections.deque()
+    try:
+        for _ in xrange(trades):
+            if len(sent_at) >= in_flight:
+                reply = replies.readline()
+                latencies.append(time.time() - sent_at.popleft())
+                if not reply.startswith('OK'):
+                    errors.append(reply.strip())
+            sent_at.append(time.time())
+            sock.sendall('{} {} {} {:.2f}\n'.format(
+                random.choice(symbols), random.randint(1, 1000),
+                random.choice(('buy', 'sell')), random.uniform(1.0, 100.0)
+            ))
+
+        while sent_at:
+            reply = replies.readline()
+            latencies.append(time.time() - sent_at.popleft())
+            if not reply.startswith('OK'):
+                errors.append(reply.strip())
+    finally:
+        replies.close()
+        sock.close()
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+
+def run_load(address, symbols, connections=4, trades=10000, in_flight=64):
+    """
+    Send trades of random symbols through several connections and measure
+    throughput and latency. trades is the number of trades per connection.
+    """
+    latencies = []
+    errors = []
+    threads = [
+        threading.Thread(target=_run_connection,
+                         args=(address, symbols, trades, in_flight,
+                               latencies, errors))
+        for _ in xrange(connections)
+    ]
+
+    started_at = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.time() - started_at
+
+    return LoadResult(
+        trades=len(latencies),
+        errors=len(errors),
+        seconds=seconds,
+        throughput=len(latencies) / seconds if seconds else 0.0,
+        p50_latency=_percentile(latencies, 50),
+        p99_latency=_percentile(latencies, 99)
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Load generator for the trade ingestion server'
+    )
+    server.add_address_arguments(parser)
+    parser.add_argument('--symbols', default='TEA,POP,ALE,GIN,JOE')
+    parser.add_argument('--connections', type=int, default=4)
+    parser.add_argument('--trades', type=int, default=10000,
+                        help='trades per connection')
+    parser.add_argument('--in-flight', type=int, default=64,
+                        help='unanswered trades per connection')
+    args = parser.parse_args(argv)
+
+    result = run_load(server.parse_address(args), args.symbols.split(','),
+                      args.connections, args.trades, args.in_flight)
+    print 'Trades: {} ({} rejected) in {:.3f}s'.format(
+        result.trades, result.errors, result.seconds
+    )
+    print 'Throughput: {:.0f} trades/s'.format(result.throughput)
+    print 'Latency p50: {:.3f}ms, p99: {:.3f}ms'.format(
+        result.p50_latency * 1000, result.p99_latency * 1000
+    )
+
+
+if __name__ == '__main__':
+    main()
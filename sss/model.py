@@ -1,9 +1,25 @@
+import array
+import bisect
 import collections
+import heapq
+import itertools
 import math
 import operator
 import re
+import threading
 import time
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import bars
+import clock
+import stats
+import subscriptions
+import window
+
 
 TYPE_COMMON = 'common'
 TYPE_PREFERRED = 'preferred'
@@ -12,9 +28,27 @@ STOCK_TYPES = (TYPE_COMMON, TYPE_PREFERRED)
 TRADE_BUY = 'buy'
 TRADE_SELL = 'sell'
 TRADE_TYPES = (TRADE_BUY, TRADE_SELL)
+TRADE_SIDES = {TRADE_SELL: 0, TRADE_BUY: 1}
+MAX_TRADE_QUANTITY = 2 ** 31 - 1
 
 DEFAULT_TRADE_DECAY_TIME = 15 * 60  # 15 minutes
 
+# Minimal number of updates of the running log-price sum after which All
+# Share Index is recalculated from scratch to get rid of accumulated error
+INDEX_RESYNC_MIN_UPDATES = 1024
+
+
+StockSnapshot = collections.namedtuple(
+    'StockSnapshot', ('symbol', 'stock_price', 'dividend_yield', 'pe_ratio')
+)
+
+_ReferenceData = collections.namedtuple(
+    '_ReferenceData', ('stock_type', 'last_dividend', 'fixed_dividend',
+                       'par_value', 'trades_cache_decay_time',
+                       'trades_retention_time', 'window_lengths',
+                       'bar_lengths', 'bar_history', 'lateness_tolerance')
+)
+
 
 class StockError(Exception):
     pass
@@ -24,31 +58,565 @@ class ValidationError(Exception):
     pass
 
 
+RejectedTrade = collections.namedtuple('RejectedTrade', ('index', 'error'))
+
+
+def _validate_trade(last_timestamp, timestamp, quantity, buy_sell, price):
+    errors = []
+
+    try:
+        timestamp = float(timestamp)
+        if not timestamp >= 0.0:
+            raise ValueError
+        if last_timestamp is not None and last_timestamp > timestamp:
+            raise ValueError
+    except (TypeError, ValueError):
+        errors.append(
+            'timestamp should be a non-negative number of second since '
+            'epoch. timestamp cannot be less than timestamp of last '
+            'recorded trade'
+        )
+
+    try:
+        quantity = int(quantity)
+        if quantity < 1 or quantity > MAX_TRADE_QUANTITY:
+            raise ValueError
+    except (TypeError, ValueError, OverflowError):
+        errors.append(
+            'quantity should be a positive integer number not greater '
+            'than {}'.format(MAX_TRADE_QUANTITY)
+        )
+
+    if buy_sell not in TRADE_TYPES:
+        errors.append(
+            'buy_sell should be one of ({})'.format(
+                ', '.join(TRADE_TYPES)
+            )
+        )
+
+    try:
+        price = float(price)
+        if not price > 0.0 or math.isinf(price):
+            raise ValueError
+    except (TypeError, ValueError):
+        errors.append('price should be a positive number')
+
+    if errors:
+        raise ValidationError('\n'.join(errors))
+
+    return timestamp, quantity, buy_sell, price
+
+
+def _is_late(minimal_timestamp, timestamp):
+    try:
+        return (minimal_timestamp is not None and
+                float(timestamp) < minimal_timestamp)
+    except (TypeError, ValueError):
+        return False
+
+
+def _validate_late_trade_columns(last_timestamp, lateness_tolerance,
+                                 timestamps, quantities, buy_sells, prices):
+    """
+    Validate trades given as columns, accepting trades late by not more than
+    lateness_tolerance seconds to the latest trade before them.
+
+    Returns columns of valid trades in time order, list of RejectedTrade,
+    number of valid late trades and number of trades rejected as too late.
+    """
+    valid = []
+    rejected = []
+    reordered = dropped_late = 0
+    latest_timestamp = last_timestamp
+    for index, trade in enumerate(
+        itertools.izip(timestamps, quantities, buy_sells, prices)
+    ):
+        minimal_timestamp = None
+        if latest_timestamp is not None:
+            minimal_timestamp = latest_timestamp - lateness_tolerance
+        try:
+            timestamp, quantity, buy_sell, price = _validate_trade(
+                minimal_timestamp, *trade
+            )
+        except ValidationError as e:
+            rejected.append(RejectedTrade(index, e.message))
+            if _is_late(minimal_timestamp, trade[0]):
+                dropped_late += 1
+            continue
+        valid.append((timestamp, quantity, TRADE_SIDES[buy_sell], price))
+        if latest_timestamp is None or timestamp >= latest_timestamp:
+            latest_timestamp = timestamp
+        else:
+            reordered += 1
+
+    # Sort is stable, so trades with the same timestamp keep their order
+    valid.sort(key=operator.itemgetter(0))
+    columns = tuple(
+        array.array(typecode, column)
+        for typecode, column in zip('dlbd', zip(*valid) or ([],) * 4)
+    )
+    return columns, rejected, reordered, dropped_late
+
+
+def _validate_trade_columns(last_timestamp, timestamps, quantities, buy_sells,
+                            prices):
+    """
+    Validate trades given as columns. Trades are checked in order, as if they
+    were recorded one by one.
+
+    Returns columns of valid trades as (timestamps, quantities, sides, prices)
+    arrays of the same types as used in trade window and list of
+    RejectedTrade with indexes of rejected trades in the given columns.
+    """
+    if numpy is not None:
+        try:
+            return _validate_trade_columns_numpy(
+                last_timestamp, timestamps, quantities, buy_sells, prices
+            )
+        except (TypeError, ValueError):
+            # Columns are not numeric, validate them one by one
+            pass
+
+    return _validate_trade_columns_python(
+        last_timestamp, timestamps, quantities, buy_sells, prices
+    )
+
+
+def _validate_trade_columns_python(last_timestamp, timestamps, quantities,
+                                   buy_sells, prices):
+    valid_timestamps = array.array('d')
+    valid_quantities = array.array('l')
+    valid_sides = array.array('b')
+    valid_prices = array.array('d')
+    rejected = []
+    minimal_timestamp = 0.0 if last_timestamp is None else last_timestamp
+
+    for index, (timestamp, quantity, buy_sell, price) in enumerate(
+        itertools.izip(timestamps, quantities, buy_sells, prices)
+    ):
+        try:
+            valid = (
+                float(timestamp) >= minimal_timestamp and
+                0 < int(quantity) <= MAX_TRADE_QUANTITY and
+                buy_sell in TRADE_SIDES and
+                float(price) > 0.0 and not math.isinf(float(price))
+            )
+        except (TypeError, ValueError, OverflowError):
+            valid = False
+
+        if not valid:
+            try:
+                _validate_trade(minimal_timestamp, timestamp, quantity,
+                                buy_sell, price)
+            except ValidationError as e:
+                rejected.append(RejectedTrade(index, e.message))
+                continue
+
+        minimal_timestamp = float(timestamp)
+        valid_timestamps.append(minimal_timestamp)
+        valid_quantities.append(int(quantity))
+        valid_sides.append(TRADE_SIDES[buy_sell])
+        valid_prices.append(float(price))
+
+    return (
+        (valid_timestamps, valid_quantities, valid_sides, valid_prices),
+        rejected
+    )
+
+
+def _validate_trade_columns_numpy(last_timestamp, timestamps, quantities,
+                                  buy_sells, prices):
+    timestamps = numpy.asarray(timestamps)
+    quantities = numpy.asarray(quantities)
+    prices = numpy.asarray(prices)
+    for column in (timestamps, quantities, prices):
+        if column.dtype.kind not in 'iuf':
+            raise TypeError('column is not numeric')
+    timestamps = timestamps.astype(numpy.float64)
+    prices = prices.astype(numpy.float64)
+    if quantities.dtype.kind == 'f':
+        # Same as int() conversion of single trade validation
+        quantities = numpy.trunc(quantities)
+    buy_sells = numpy.asarray(buy_sells, dtype=object)
+    if not (
+        len(timestamps) == len(quantities) == len(buy_sells) == len(prices)
+    ):
+        raise ValueError('columns should have the same length')
+
+    with numpy.errstate(invalid='ignore'):
+        is_buy = buy_sells == TRADE_BUY
+        valid = (
+            (quantities >= 1) & (quantities <= MAX_TRADE_QUANTITY) &
+            (is_buy | (buy_sells == TRADE_SELL)) &
+            (prices > 0.0) & numpy.isfinite(prices) &
+            (timestamps >= 0.0)
+        )
+        if last_timestamp is not None:
+            valid &= timestamps >= last_timestamp
+        # Timestamp of a trade valid by all other fields should not be less
+        # than timestamps of all preceding valid trades. Rejected trades
+        # don't raise the bar, as their timestamps are less than it already.
+        running_timestamps = numpy.where(valid, timestamps, -numpy.inf)
+        if len(running_timestamps):
+            running_max = numpy.maximum.accumulate(running_timestamps)
+            valid[1:] &= timestamps[1:] >= running_max[:-1]
+
+    rejected = []
+    valid_indexes = numpy.flatnonzero(valid)
+    for index in numpy.flatnonzero(~valid):
+        # Accepted timestamps are ordered, so the bar is the last one of them
+        position = numpy.searchsorted(valid_indexes, index)
+        if position:
+            minimal_timestamp = timestamps[valid_indexes[position - 1]]
+        else:
+            minimal_timestamp = last_timestamp
+        try:
+            _validate_trade(minimal_timestamp, timestamps[index],
+                            quantities[index], buy_sells[index], prices[index])
+        except ValidationError as e:
+            rejected.append(RejectedTrade(int(index), e.message))
+
+    quantity_type = 'i{}'.format(array.array('l').itemsize)
+    columns = (
+        (timestamps[valid], 'd', numpy.float64),
+        (quantities[valid], 'l', quantity_type),
+        (is_buy[valid], 'b', numpy.int8),
+        (prices[valid], 'd', numpy.float64)
+    )
+    return (
+        tuple(
+            array.array(typecode, column.astype(dtype).tostring())
+            for column, typecode, dtype in columns
+        ),
+        rejected
+    )
+
+
+def _numpy_column(column, dtype):
+    if isinstance(column, array.array):
+        # Typed arrays are viewed without converting every item
+        return numpy.frombuffer(column, column.typecode).astype(dtype,
+                                                                copy=False)
+    return numpy.asarray(column, dtype)
+
+
+def _trusted_trade_columns(last_timestamp, timestamps, quantities, buy_sells,
+                           prices):
+    """
+    Convert already typed and normalised trade columns to trade window
+    arrays, checking only that quantities are positive and timestamps are in
+    time order. Columns breaking that are validated in full, so rejected
+    trades are the same as of _validate_trade_columns.
+    """
+    if numpy is not None:
+        quantity_type = 'i{}'.format(array.array('l').itemsize)
+        timestamps_array = _numpy_column(timestamps, numpy.float64)
+        quantities_array = _numpy_column(quantities, quantity_type)
+        buy_sells_array = numpy.asarray(buy_sells, dtype=object)
+        is_buy = buy_sells_array == TRADE_BUY
+        valid = not len(timestamps_array) or (
+            quantities_array.min() >= 1 and
+            (numpy.diff(timestamps_array) >= 0.0).all() and
+            (is_buy | (buy_sells_array == TRADE_SELL)).all()
+        )
+        columns = (
+            array.array('d', timestamps_array.tostring()),
+            array.array('l', quantities_array.tostring()),
+            array.array('b', is_buy.astype(numpy.int8).tostring()),
+            array.array('d', _numpy_column(prices, numpy.float64).tostring())
+        )
+    else:
+        columns = (
+            array.array('d', timestamps),
+            array.array('l', quantities),
+            array.array('b', [TRADE_SIDES.get(buy_sell, -1)
+                              for buy_sell in buy_sells]),
+            array.array('d', prices)
+        )
+        valid = not len(columns[0]) or (
+            min(columns[1]) >= 1 and min(columns[2]) >= 0 and
+            all(itertools.imap(operator.le, columns[0],
+                               itertools.islice(columns[0], 1, None)))
+        )
+
+    if valid and len(columns[0]) and last_timestamp is not None:
+        valid = columns[0][0] >= last_timestamp
+    if not valid:
+        return _validate_trade_columns(last_timestamp, timestamps, quantities,
+                                       buy_sells, prices)
+    return columns, []
+
+
+def _numpy_rows(column, indexes):
+    if isinstance(column, array.array):
+        return numpy.frombuffer(column, column.typecode)[indexes]
+    return numpy.asarray(column)[indexes]
+
+
+def _split_late_trade_columns(convert, last_timestamp, lateness_tolerance,
+                              timestamps, quantities, buy_sells, prices):
+    """
+    Same as _validate_late_trade_columns, but trades not older than any
+    trade before them are converted at once by convert, either
+    _validate_trade_columns or _trusted_trade_columns, and only late trades
+    are validated one by one.
+
+    Without numpy, with not numeric timestamps or if a trade in time order is
+    rejected, which could change what trades after it are late, all trades
+    are validated one by one.
+    """
+    if numpy is not None:
+        try:
+            timestamps_array = _numpy_column(timestamps, numpy.float64)
+        except (TypeError, ValueError):
+            timestamps_array = None
+    if numpy is None or timestamps_array is None or (
+        timestamps_array.ndim != 1
+    ):
+        return _validate_late_trade_columns(
+            last_timestamp, lateness_tolerance, timestamps, quantities,
+            buy_sells, prices
+        )
+
+    # Latest timestamp before every trade
+    previous = numpy.empty_like(timestamps_array)
+    previous[:1] = -numpy.inf if last_timestamp is None else last_timestamp
+    numpy.fmax.accumulate(timestamps_array[:-1], out=previous[1:])
+    if last_timestamp is not None:
+        numpy.maximum(previous, last_timestamp, out=previous)
+    late = timestamps_array < previous
+    if not late.any():
+        columns, rejected = convert(last_timestamp, timestamps, quantities,
+                                    buy_sells, prices)
+        return columns, rejected, 0, 0
+
+    in_order = numpy.flatnonzero(~late)
+    columns, rejected = convert(
+        last_timestamp,
+        *[_numpy_rows(column, in_order)
+          for column in (timestamps, quantities, buy_sells, prices)]
+    )
+    if rejected:
+        return _validate_late_trade_columns(
+            last_timestamp, lateness_tolerance, timestamps, quantities,
+            buy_sells, prices
+        )
+
+    valid_indexes = []
+    valid = []
+    dropped_late = 0
+    for index in numpy.flatnonzero(late):
+        minimal_timestamp = previous[index] - lateness_tolerance
+        trade = (timestamps[index], quantities[index], buy_sells[index],
+                 prices[index])
+        try:
+            timestamp, quantity, buy_sell, price = _validate_trade(
+                minimal_timestamp, *trade
+            )
+        except ValidationError as e:
+            rejected.append(RejectedTrade(int(index), e.message))
+            if _is_late(minimal_timestamp, trade[0]):
+                dropped_late += 1
+            continue
+        valid_indexes.append(index)
+        valid.append((timestamp, quantity, TRADE_SIDES[buy_sell], price))
+    if not valid:
+        return columns, rejected, 0, dropped_late
+
+    # Late trades are merged in time order, trades with the same timestamp
+    # keep their order
+    indexes = numpy.concatenate([in_order, valid_indexes])
+    merged_columns = []
+    for column, late_values in zip(columns, zip(*valid)):
+        merged_columns.append(numpy.concatenate([
+            numpy.frombuffer(column, column.typecode),
+            numpy.array(late_values, column.typecode)
+        ]))
+    order = numpy.lexsort((indexes, merged_columns[0]))
+    columns = tuple(
+        array.array(column.typecode, merged_column[order].tostring())
+        for column, merged_column in zip(columns, merged_columns)
+    )
+    return columns, rejected, len(valid), dropped_late
+
+
+def _sorted_trade_columns(timestamps, quantities, sides, prices):
+    """
+    Trade columns sorted by timestamp, the same columns if they are sorted.
+    """
+    if all(itertools.imap(operator.le, timestamps,
+                          itertools.islice(timestamps, 1, None))):
+        return timestamps, quantities, sides, prices
+    order = sorted(xrange(len(timestamps)), key=timestamps.__getitem__)
+    return tuple(
+        array.array(column.typecode, [column[index] for index in order])
+        for column in (timestamps, quantities, sides, prices)
+    )
+
+
+def _stock_snapshot(symbol, stock_type, last_dividend, fixed_dividend,
+                    par_value, stock_price):
+    if stock_price == 0.0:
+        dividend_yield = 0.0
+    elif stock_type == TYPE_COMMON:
+        dividend_yield = last_dividend / stock_price
+    else:
+        dividend_yield = fixed_dividend * par_value / stock_price
+
+    if dividend_yield == 0.0:
+        pe_ratio = 0.0
+    else:
+        pe_ratio = stock_price / dividend_yield
+
+    return StockSnapshot(symbol, stock_price, dividend_yield, pe_ratio)
+
+
+class _NoLock(object):
+    """
+    Lock which does nothing, used when thread safety is not needed.
+    """
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_NO_LOCK = _NoLock()
+
+_WALL_CLOCK = clock.WALL_CLOCK
+
+# Trade window of stocks without trades. It is never changed, stocks replace
+# it with their own window on the first recorded trade.
+_NO_TRADES = window.TradeWindow()
+
+
+def _take(column, indexes):
+    if numpy is not None and isinstance(column, numpy.ndarray):
+        return column[indexes]
+    return [column[index] for index in indexes]
+
+
 class Stock(object):
+    """
+    Reference data and recorded trades of a stock.
+
+    Large universes have many stocks without trades, so stocks have no
+    instance dict, reference data is shared by stocks of a stock manager
+    having the same one, and trade and price windows are allocated on the
+    first recorded trade and released once all trades are evicted.
+    """
+
+    __slots__ = ('_symbol', '_reference', '_trades', '_price_windows',
+                 '_bars', '_listeners', '_journal', '_stats', '_clock',
+                 '_lock', '_trusted')
+
     _SYMBOL_PATTERN = re.compile(r'^[A-Z]{3}$')
 
     def __init__(self, symbol, stock_type, last_dividend, fixed_dividend,
-                 par_value, trades_cache_decay_time=DEFAULT_TRADE_DECAY_TIME):
+                 par_value, trades_cache_decay_time=DEFAULT_TRADE_DECAY_TIME,
+                 trades_retention_time=None, price_windows=(),
+                 bar_lengths=(), bar_history=bars.DEFAULT_BAR_HISTORY,
+                 lateness_tolerance=0.0, thread_safe=False, trusted=False,
+                 clock=None):
         symbol, stock_type, last_dividend, fixed_dividend, par_value = (
             self._validate(
                 symbol, stock_type, last_dividend, fixed_dividend, par_value
             )
         )
         self._symbol = symbol
-        self._stock_type = stock_type
-        self._last_dividend = last_dividend
-        self._fixed_dividend = fixed_dividend
-        self._par_value = par_value
-        self._trades_cache_decay_time = trades_cache_decay_time
+        reference = _ReferenceData(
+            stock_type, last_dividend, fixed_dividend, par_value,
+            trades_cache_decay_time,
+            # Trades are kept for arbitrary time range VWAP queries for at
+            # least as long as they are needed for the stock price and price
+            # windows
+            max([trades_cache_decay_time, trades_retention_time or 0] +
+                list(price_windows)),
+            tuple(sorted(set(price_windows) | {trades_cache_decay_time})),
+            tuple(sorted(set(bar_lengths))), bar_history,
+            float(lateness_tolerance)
+        )
+        self._reference = reference
+
+        self._trades = _NO_TRADES
+        self._price_windows = None
+        # Bar builders by bar length, allocated on the first recorded trade
+        self._bars = None
+        # Listeners tuple is replaced, not changed, so it can be iterated
+        # without a lock
+        self._listeners = ()
+        self._journal = None
+        self._stats = None
+        self._clock = clock or _WALL_CLOCK
+        self._lock = _NO_LOCK
+        if thread_safe:
+            self.enable_thread_safety()
+        self._trusted = trusted
+
+    def enable_thread_safety(self):
+        """
+        Guard trades of the stock with a lock, so trades can be recorded and
+        prices read from several threads. Listeners are called outside of the
+        lock.
+        """
+        if self._lock is _NO_LOCK:
+            self._lock = threading.Lock()
 
-        self._trades = collections.deque()
+    def enable_trusted_ingest(self):
+        """
+        Accept trades of an upstream which already normalised them: float
+        timestamps, int quantities, buy_sell of TRADE_TYPES and float prices.
+        Only positive quantities and time order of trades are checked, other
+        malformed trades are not rejected.
+        """
+        self._trusted = True
 
-    def _validate(self, symbol, stock_type, last_dividend, fixed_dividend,
+    @property
+    def trusted(self):
+        return self._trusted
+
+    def set_journal(self, journal):
+        """
+        Write every recorded trade to the journal before it is applied.
+        None stops journaling.
+        """
+        self._journal = journal
+
+    def set_stats(self, stock_stats):
+        """
+        Count trades and measure latencies of the stock in stats.Stats.
+        None disables instrumentation.
+        """
+        self._stats = stock_stats
+
+    def share_reference_data(self, references):
+        """
+        Use the equal tuple of reference data and settings from references,
+        a dict of them, or add the tuple of the stock to it.
+        """
+        self._reference = references.setdefault(self._reference,
+                                                self._reference)
+
+    @property
+    def clock(self):
+        return self._clock
+
+    def set_clock(self, stock_clock):
+        """
+        Take the current time for decay of trades from a clock of the clock
+        module. None sets the wall clock.
+        """
+        self._clock = stock_clock or _WALL_CLOCK
+
+    @classmethod
+    def _validate(cls, symbol, stock_type, last_dividend, fixed_dividend,
                   par_value):
         errors = []
 
         # Validate symbol
-        if self._SYMBOL_PATTERN.match(symbol) is None:
+        if cls._SYMBOL_PATTERN.match(symbol) is None:
             errors.append('"{}" is invalid symbol'.format(symbol))
 
         if stock_type not in STOCK_TYPES:
@@ -60,7 +628,8 @@ class Stock(object):
 
         try:
             last_dividend = float(last_dividend)
-            if last_dividend < 0.0:
+            if (last_dividend < 0.0 or math.isnan(last_dividend) or
+                    math.isinf(last_dividend)):
                 raise ValueError
         except ValueError:
             errors.append('last_dividend should be a non-negative number')
@@ -68,7 +637,7 @@ class Stock(object):
         try:
             if stock_type == TYPE_PREFERRED:
                 fixed_dividend = float(fixed_dividend)
-                if fixed_dividend < 0.0 or fixed_dividend > 100.0:
+                if not 0.0 <= fixed_dividend <= 100.0:
                     raise ValueError
             else:
                 fixed_dividend = None
@@ -79,7 +648,8 @@ class Stock(object):
 
         try:
             par_value = float(par_value)
-            if par_value < 0.0:
+            if (par_value < 0.0 or math.isnan(par_value) or
+                    math.isinf(par_value)):
                 raise ValueError
         except ValueError:
             errors.append('par_value should be a non-negative number')
@@ -89,138 +659,754 @@ class Stock(object):
 
         return symbol, stock_type, last_dividend, fixed_dividend, par_value
 
-    def _validate_trade(self, timestamp, quantity, buy_sell, price):
-        errors = []
-
-        try:
-            timestamp = float(timestamp)
-            if timestamp < 0.0:
-                raise ValueError
-            if self._trades and self._trades[-1][0] > timestamp:
-                raise ValueError
-        except ValueError:
-            errors.append(
-                'timestamp should be a non-negative number of second since '
-                'epoch. timestamp cannot be less than timestamp of last '
-                'recorded trade'
-            )
-
-        try:
-            quantity = int(quantity)
-            if quantity < 1:
-                raise ValueError
-        except ValueError:
-            errors.append('quantity should be a positive integer number')
-
-        if buy_sell not in TRADE_TYPES:
-            errors.append(
-                'buy_sell should be one of ({})'.format(
-                    ', '.join(TRADE_TYPES)
-                )
-            )
-
-        try:
-            price = float(price)
-            if price <= 0.0:
-                raise ValueError
-        except ValueError:
-            errors.append('price should be a positive number')
-
-        if errors:
-            raise ValidationError('\n'.join(errors))
-
-        return timestamp, quantity, buy_sell, price
+    def reference_data(self):
+        """
+        Arguments to create a stock with the same reference data and
+        settings, but without trades.
+        """
+        reference = self._reference
+        return {
+            'symbol': self._symbol,
+            'stock_type': reference.stock_type,
+            'last_dividend': reference.last_dividend,
+            'fixed_dividend': reference.fixed_dividend,
+            'par_value': reference.par_value,
+            'trades_cache_decay_time': reference.trades_cache_decay_time,
+            'trades_retention_time': reference.trades_retention_time,
+            'price_windows': reference.window_lengths,
+            'bar_lengths': reference.bar_lengths,
+            'bar_history': reference.bar_history,
+            'lateness_tolerance': reference.lateness_tolerance,
+        }
 
     @property
     def symbol(self):
         return self._symbol
 
+    @property
+    def trades_retention_time(self):
+        return self._reference.trades_retention_time
+
     @property
     def stock_type(self):
-        return self._stock_type
+        return self._reference.stock_type
 
     @property
     def last_dividend(self):
-        return self._last_dividend
+        return self._reference.last_dividend
 
     @property
     def fixed_dividend(self):
-        return self._fixed_dividend and self._fixed_dividend / 100.0
+        fixed_dividend = self._reference.fixed_dividend
+        return fixed_dividend and fixed_dividend / 100.0
 
     @property
     def fixed_dividend_percent(self):
-        return self._fixed_dividend
+        return self._reference.fixed_dividend
 
     @property
     def par_value(self):
-        return self._par_value
+        return self._reference.par_value
 
     @property
     def dividend_yield(self):
-        if self.stock_price == 0.0:
-            return 0.0
-        if self._stock_type == TYPE_COMMON:
-            return self.last_dividend / self.stock_price
-        else:
-            return self.fixed_dividend * self.par_value / self.stock_price
+        return self.snapshot().dividend_yield
 
     @property
     def pe_ratio(self):
-        dividend_yield = self.dividend_yield
-        if dividend_yield == 0.0:
-            return 0.0
-        return self.stock_price / self.dividend_yield
+        return self.snapshot().pe_ratio
+
+    def snapshot(self):
+        """
+        Calculate all stock metrics from a single stock price value, so they
+        are consistent with each other.
+        """
+        return _stock_snapshot(self._symbol, self._reference.stock_type,
+                               self.last_dividend, self.fixed_dividend,
+                               self.par_value, self.stock_price)
 
     @property
     def stock_price(self):
-        now = time.time()
-        relevant_since = now - self._trades_cache_decay_time
-        while self._trades and self._trades[0][0] < relevant_since:
-            self._trades.popleft()
+        stock_stats = self._stats
+        if stock_stats is not None:
+            started_at = time.time()
+        with self._lock:
+            self._advance(self._clock.now())
+            if self._price_windows is None:
+                stock_price = 0.0
+            else:
+                stock_price = self._price_windows[
+                    self._reference.trades_cache_decay_time
+                ].price
+        if stock_stats is not None:
+            stock_stats.observe('stock_price', time.time() - started_at)
+        return stock_price
 
-        if not self._trades:
-            return 0.0
+    @property
+    def trade_count(self):
+        """
+        Number of stored trades.
+        """
+        return len(self._trades)
 
-        _, trades = zip(*self._trades)
-        quantities, _, prices = zip(*trades)
-        total_price = sum(map(operator.mul, prices, quantities))
-        total_quantity = sum(quantities)
+    def window_prices(self):
+        """
+        Stock prices over all configured time windows, as a dict keyed by
+        window length in seconds.
+        """
+        with self._lock:
+            self._advance(self._clock.now())
+            if self._price_windows is None:
+                return dict.fromkeys(self._reference.window_lengths, 0.0)
+            return {
+                length: price_window.price
+                for length, price_window in self._price_windows.iteritems()
+            }
 
-        return total_price / total_quantity
+    def vwap(self, since, until=None):
+        """
+        Volume weighted average price of trades with timestamps in
+        [since, until], until=None means no upper bound. Only trades within
+        retention time are taken into account.
+        """
+        with self._lock:
+            self._advance(self._clock.now())
+            return self._trades.vwap_since(since, until)
 
-    def record_trade(self, timestamp, quantity, buy_sell, price):
-        timestamp, quantity, buy_sell, price = self._validate_trade(
-            timestamp, quantity, buy_sell, price
+    def _advance(self, now):
+        if self._trades is _NO_TRADES:
+            return
+        # Time windows are moved first, so they pass all trades to be dropped
+        for price_window in self._price_windows.itervalues():
+            price_window.advance(now)
+        evicted = self._trades.evict_before(
+            now - self._reference.trades_retention_time
         )
-        self._trades.append((timestamp, (quantity, buy_sell, price)))
+        if evicted:
+            if self._stats is not None:
+                self._stats.increment('trades_evicted', evicted)
+            if not len(self._trades):
+                # Time windows are over stored trades only, so their prices
+                # are zero and they are released too
+                self._trades = _NO_TRADES
+                self._price_windows = None
+
+    def _allocate_bars(self):
+        if self._bars is None:
+            self._bars = dict(
+                (length, bars.BarBuilder(length, self._reference.bar_history))
+                for length in self._reference.bar_lengths
+            )
+        return self._bars.itervalues()
+
+    def bars(self, length, count):
+        """
+        List of at most count latest bars.Bar of the given length in time
+        order. The last bar is of the latest bucket with trades and is not
+        complete yet.
+        """
+        if length not in self._reference.bar_lengths:
+            raise StockError('there are no bars of length {}'.format(length))
+        with self._lock:
+            if self._bars is None:
+                return []
+            return self._bars[length].last_bars(count)
+
+    def _allocate_trades(self):
+        """
+        Trade window to append trades to, allocated with time windows if
+        the stock has no trades.
+        """
+        if self._trades is _NO_TRADES:
+            self._trades = window.TradeWindow()
+            self._price_windows = dict(
+                (length, window.TimeWindow(self._trades, length))
+                for length in self._reference.window_lengths
+            )
+        return self._trades
+
+    @property
+    def next_eviction_time(self):
+        """
+        Time after which the oldest trade contributing to the stock price
+        decays and the stock price changes. None if there are no such trades.
+        """
+        decay_time = self._reference.trades_cache_decay_time
+        relevant_since = self._clock.now() - decay_time
+        with self._lock:
+            index = self._trades.bisect_left(relevant_since)
+            if index == len(self._trades):
+                return None
+            return self._trades.timestamp_at(index) + decay_time
+
+    def add_listener(self, listener):
+        """
+        Register a callable which is called with the stock every time a trade
+        is recorded.
+        """
+        self._listeners = self._listeners + (listener,)
+
+    def remove_listener(self, listener):
+        listeners = list(self._listeners)
+        listeners.remove(listener)
+        self._listeners = tuple(listeners)
+
+    def record_trade(self, timestamp, quantity, buy_sell, price):
+        """
+        Record a trade. A trade older than the last recorded one is rejected,
+        unless the stock has lateness_tolerance and the trade is late by not
+        more than it, then the trade is merged in time order.
+        """
+        stock_stats = self._stats
+        if stock_stats is not None:
+            started_at = time.time()
+        with self._lock:
+            last_timestamp = self._trades.last_timestamp
+            # Trusted trades are validated in full only if they break
+            # invariants, to get the same error
+            if not (
+                self._trusted and quantity >= 1 and
+                buy_sell in TRADE_SIDES and
+                (last_timestamp is None or timestamp >= last_timestamp)
+            ):
+                lateness_tolerance = self._reference.lateness_tolerance
+                minimal_timestamp = last_timestamp
+                if minimal_timestamp is not None:
+                    minimal_timestamp -= lateness_tolerance
+                try:
+                    timestamp, quantity, buy_sell, price = _validate_trade(
+                        minimal_timestamp, timestamp, quantity, buy_sell,
+                        price
+                    )
+                except ValidationError:
+                    if stock_stats is not None:
+                        stock_stats.increment('trades_rejected')
+                        if lateness_tolerance and _is_late(minimal_timestamp,
+                                                           timestamp):
+                            stock_stats.increment('trades_dropped_late')
+                    raise
+            side = TRADE_SIDES[buy_sell]
+            if self._journal is not None:
+                self._journal.append(self._symbol, timestamp, quantity, side,
+                                     price)
+            reordered = (last_timestamp is not None and
+                         timestamp < last_timestamp)
+            if reordered:
+                self._insert_trade(timestamp, quantity, side, price)
+            else:
+                self._allocate_trades().append(timestamp, quantity, side,
+                                               price)
+                self._clock.observe(timestamp)
+                if self._reference.bar_lengths:
+                    for bar_builder in self._allocate_bars():
+                        bar_builder.add(timestamp, quantity, price)
+        for listener in self._listeners:
+            listener(self)
+        if stock_stats is not None:
+            stock_stats.increment('trades_recorded')
+            if reordered:
+                stock_stats.increment('trades_reordered')
+            stock_stats.observe('record_trade', time.time() - started_at)
+
+    def _insert_trade(self, timestamp, quantity, side, price):
+        """
+        Merge a trade older than the last recorded one into trade, time and
+        bar windows.
+        """
+        trades = self._trades
+        sequence = trades.first_sequence + trades.insert(timestamp, quantity,
+                                                         side, price)
+        value = quantity * price
+        for price_window in self._price_windows.itervalues():
+            price_window.insert(sequence, value, quantity)
+        if self._reference.bar_lengths:
+            for bar_builder in self._allocate_bars():
+                bar_builder.insert(timestamp, quantity, price)
+
+    def record_trades(self, trades):
+        """
+        Record many (timestamp, quantity, buy_sell, price) trades at once.
+        Valid trades are recorded and a list of RejectedTrade is returned for
+        the rest.
+        """
+        trades = list(trades)
+        if not trades:
+            return []
+        return self.record_trade_columns(*zip(*trades))
+
+    def record_trade_columns(self, timestamps, quantities, buy_sells, prices):
+        """
+        Same as record_trades, but trades are given as columns.
+        """
+        lateness_tolerance = self._reference.lateness_tolerance
+        if self._trusted:
+            convert = _trusted_trade_columns
+        else:
+            convert = _validate_trade_columns
+        reordered = dropped_late = inserted = 0
+        with self._lock:
+            last_timestamp = self._trades.last_timestamp
+            if lateness_tolerance:
+                columns, rejected, reordered, dropped_late = (
+                    _split_late_trade_columns(
+                        convert, last_timestamp, lateness_tolerance,
+                        timestamps, quantities, buy_sells, prices
+                    )
+                )
+            else:
+                columns, rejected = convert(last_timestamp, timestamps,
+                                            quantities, buy_sells, prices)
+            count = len(columns[0])
+            if count:
+                if self._journal is not None:
+                    self._journal.extend(self._symbol, *columns)
+                if last_timestamp is not None and lateness_tolerance:
+                    # Valid trades are in time order, trades older than the
+                    # last recorded one go first
+                    inserted = bisect.bisect_left(columns[0], last_timestamp)
+                for index in xrange(inserted):
+                    self._insert_trade(*[column[index] for column in columns])
+                if inserted < count:
+                    if inserted:
+                        columns = [column[inserted:] for column in columns]
+                    self._allocate_trades().extend(*columns)
+                    self._clock.observe(columns[0][-1])
+                    if self._reference.bar_lengths:
+                        self._extend_bars(*columns)
+        if count:
+            for listener in self._listeners:
+                listener(self)
+        if self._stats is not None:
+            self._stats.increment('trades_recorded', count)
+            self._stats.increment('trades_rejected', len(rejected))
+            if lateness_tolerance:
+                self._stats.increment('trades_reordered', reordered)
+                self._stats.increment('trades_dropped_late', dropped_late)
+        return rejected
+
+    def _extend_bars(self, timestamps, quantities, sides, prices):
+        for bar_builder in self._allocate_bars():
+            bar_builder.extend(timestamps, quantities, prices)
+
+    def load_trades(self, timestamps, quantities, sides, prices):
+        """
+        Append already validated trades, e.g. replayed from a journal, given
+        as typed arrays of the same types as trade window columns. Trades
+        should be in time order and not older than the last recorded trade.
+        They are not written to the journal.
+        """
+        if not len(timestamps):
+            return
+        if self._reference.lateness_tolerance:
+            # Late trades are journaled in order of recording
+            timestamps, quantities, sides, prices = _sorted_trade_columns(
+                timestamps, quantities, sides, prices
+            )
+        with self._lock:
+            self._allocate_trades().extend(timestamps, quantities, sides,
+                                           prices)
+            self._clock.observe(timestamps[-1])
+            if self._reference.bar_lengths:
+                self._extend_bars(timestamps, quantities, sides, prices)
+        for listener in self._listeners:
+            listener(self)
 
 
 class StockManager(object):
-    def __init__(self):
+    """
+    Keeps the GBCE All Share Index up to date incrementally.
+
+    The index is the exponent of the mean of log-prices of stocks with
+    non-zero price. Stocks report recorded trades and a heap of eviction
+    times tells which stocks had their trades decayed, so only those stocks
+    are recalculated on read.
+
+    With thread_safe=True every added stock gets its own lock, so trades of
+    different stocks are recorded in parallel. Writers only hold a lock of
+    the dirty stocks set for a moment, readers of the index are serialized
+    by a separate lock.
+
+    With trusted=True every added stock accepts already normalised trades,
+    see Stock.enable_trusted_ingest.
+
+    The index and prices of all added stocks are calculated at the time of
+    the manager clock, see the clock module.
+
+    Changes of stock prices and of the index are notified to subscriptions
+    by publish, see the subscriptions module.
+    """
+
+    def __init__(self, thread_safe=False, journal=None, trusted=False,
+                 clock=None):
         self._stocks = {}
+        # Stocks with equal reference data and settings share a single tuple
+        # of them
+        self._reference_data = {}
+        self._thread_safe = thread_safe
+        self._trusted = trusted
+        self._clock = clock or _WALL_CLOCK
+        self._journal = journal
+        self._stats = None
+        if thread_safe:
+            self._lock = threading.Lock()
+            self._dirty_lock = threading.Lock()
+            self._publish_lock = threading.Lock()
+        else:
+            self._lock = self._dirty_lock = self._publish_lock = _NO_LOCK
+
+        self._log_prices = {}
+        self._log_prices_sum = 0.0
+        self._log_prices_updates = 0
+        self._dirty_symbols = set()
+        self._eviction_times = []
+        self._scheduled_evictions = {}
+
+        # Tuples of subscriptions keyed by symbol, None for the index
+        self._subscriptions = {}
+        # Prices of subscribed stocks changed since the last publish
+        self._changed_prices = {}
+        self._published_index = None
+        self._held_subscriptions = set()
 
     @property
     def all_share_index(self):
-        significant_stock_values = filter(
-            lambda v: v.stock_price, self._stocks.values()
-        )
-        if not significant_stock_values:
-            return 0.0
-
-        return math.pow(
-            reduce(
-                operator.mul,
-                map(operator.attrgetter('stock_price'),
-                    significant_stock_values)
-            ),
-            1.0 / len(significant_stock_values)
-        )
+        manager_stats = self._stats
+        if manager_stats is not None:
+            started_at = time.time()
+        log_prices_sum, count = self.all_share_index_terms()
+        index = math.exp(log_prices_sum / count) if count else 0.0
+        if manager_stats is not None:
+            manager_stats.observe('all_share_index',
+                                  time.time() - started_at)
+        return index
+
+    def all_share_index_terms(self):
+        """
+        Sum of log-prices of stocks with non-zero price and number of such
+        stocks at the time of the manager clock. Terms of several managers
+        can be added up to get the index over all their stocks.
+        """
+        with self._lock:
+            self._refresh_index(self._clock.now())
+            return self._log_prices_sum, len(self._log_prices)
+
+    def _refresh_index(self, now):
+        with self._dirty_lock:
+            dirty_symbols = self._dirty_symbols
+            self._dirty_symbols = set()
+
+        eviction_times = self._eviction_times
+        while eviction_times and eviction_times[0][0] <= now:
+            eviction_time, symbol = heapq.heappop(eviction_times)
+            if self._scheduled_evictions.get(symbol) == eviction_time:
+                del self._scheduled_evictions[symbol]
+                dirty_symbols.add(symbol)
+
+        if not dirty_symbols:
+            return
+
+        for symbol in dirty_symbols:
+            stock = self._stocks.get(symbol)
+            if stock is None:
+                self._update_log_price(symbol, 0.0)
+                continue
+
+            stock_price = stock.stock_price
+            self._update_log_price(symbol, stock_price)
+            self._schedule_eviction(symbol, stock.next_eviction_time)
+            if symbol in self._subscriptions:
+                self._changed_prices[symbol] = stock_price
+
+        if self._log_prices_updates >= max(len(self._log_prices),
+                                           INDEX_RESYNC_MIN_UPDATES):
+            self._log_prices_sum = math.fsum(self._log_prices.itervalues())
+            self._log_prices_updates = 0
+
+    def _update_log_price(self, symbol, stock_price):
+        previous_log_price = self._log_prices.pop(symbol, None)
+        if previous_log_price is not None:
+            self._log_prices_sum -= previous_log_price
+            self._log_prices_updates += 1
+
+        if stock_price:
+            log_price = math.log(stock_price)
+            self._log_prices[symbol] = log_price
+            self._log_prices_sum += log_price
+            self._log_prices_updates += 1
+
+        if not self._log_prices:
+            self._log_prices_sum = 0.0
+            self._log_prices_updates = 0
+
+    def _schedule_eviction(self, symbol, eviction_time):
+        if eviction_time is None:
+            self._scheduled_evictions.pop(symbol, None)
+            return
+
+        if self._scheduled_evictions.get(symbol) != eviction_time:
+            self._scheduled_evictions[symbol] = eviction_time
+            heapq.heappush(self._eviction_times, (eviction_time, symbol))
+
+    def _on_trade_recorded(self, stock):
+        if self._stocks.get(stock.symbol) is stock:
+            with self._dirty_lock:
+                self._dirty_symbols.add(stock.symbol)
+
+    def subscribe_price(self, symbol, target, threshold=0.0, relative=False,
+                        min_interval=0.0):
+        """
+        Notify changes of stock_price of the stock with the symbol to the
+        target. Returns subscriptions.Subscription, see it for arguments.
+        """
+        if symbol not in self._stocks:
+            raise StockError('Stock "{}" is not found'.format(symbol))
+        return self._subscribe(subscriptions.Subscription(
+            symbol, target, threshold, relative, min_interval
+        ))
+
+    def subscribe_index(self, target, threshold=0.0, relative=False,
+                        min_interval=0.0):
+        """
+        Notify changes of all_share_index to the target. Returns
+        subscriptions.Subscription, see it for arguments.
+        """
+        return self._subscribe(subscriptions.Subscription(
+            None, target, threshold, relative, min_interval
+        ))
+
+    def _subscribe(self, subscription):
+        symbol = subscription.symbol
+        with self._lock:
+            self._subscriptions[symbol] = (
+                self._subscriptions.get(symbol, ()) + (subscription,)
+            )
+            if symbol is None:
+                # The current index is notified by the next publish
+                self._published_index = None
+            else:
+                with self._dirty_lock:
+                    self._dirty_symbols.add(symbol)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        symbol = subscription.symbol
+        with self._publish_lock:
+            with self._lock:
+                remaining = tuple(
+                    other for other in self._subscriptions.get(symbol, ())
+                    if other is not subscription
+                )
+                if remaining:
+                    self._subscriptions[symbol] = remaining
+                else:
+                    self._subscriptions.pop(symbol, None)
+                    self._changed_prices.pop(symbol, None)
+            self._held_subscriptions.discard(subscription)
+
+    def publish(self):
+        """
+        Notify subscriptions of stock prices and the index changed since the
+        previous publish, and values held back by min_interval.
+
+        Trades only mark their stocks as changed, so whoever records trades
+        should publish after every batch or on a timer. Targets are called
+        without holding manager locks, so they can read prices and the index.
+
+        A target which raises does not stop notifications of the others.
+        Its value is offered again by the next publish and a list of
+        subscriptions.FailedNotification is returned.
+        """
+        with self._publish_lock:
+            with self._lock:
+                now = self._clock.now()
+                self._refresh_index(now)
+                changed_values = self._changed_prices
+                self._changed_prices = {}
+                if None in self._subscriptions:
+                    log_prices_sum = self._log_prices_sum
+                    count = len(self._log_prices)
+                    index = math.exp(log_prices_sum / count) if count else 0.0
+                    if index != self._published_index:
+                        self._published_index = index
+                        changed_values[None] = index
+                all_subscriptions = self._subscriptions
+
+            failed = []
+
+            def deliver(subscription, offer, *args):
+                try:
+                    held = offer(*args)
+                except Exception as e:
+                    failed.append(
+                        subscriptions.FailedNotification(subscription, e)
+                    )
+                    held = True
+                if held:
+                    self._held_subscriptions.add(subscription)
+
+            held_subscriptions = self._held_subscriptions
+            self._held_subscriptions = set()
+            for symbol, value in changed_values.iteritems():
+                for subscription in all_subscriptions.get(symbol, ()):
+                    held_subscriptions.discard(subscription)
+                    deliver(subscription, subscription.offer, value, now)
+            for subscription in held_subscriptions:
+                deliver(subscription, subscription.offer_held, now)
+        return failed
+
+    def bars(self, length, count, symbols=None):
+        """
+        Latest bars of stocks with the given symbols, all stocks if symbols
+        is None, as a dict of lists keyed by symbol. See Stock.bars.
+        """
+        if symbols is None:
+            symbols = self._stocks.keys()
+        return {
+            symbol: self._stocks[symbol].bars(length, count)
+            for symbol in symbols
+        }
+
+    def snapshot_all(self):
+        return {
+            symbol: stock.snapshot()
+            for symbol, stock in self._stocks.items()
+        }
+
+    def record_batch(self, trades):
+        """
+        Record many (symbol, timestamp, quantity, buy_sell, price) trades at
+        once. Valid trades are recorded and a list of RejectedTrade is returned
+        for the rest.
+        """
+        trades = list(trades)
+        if not trades:
+            return []
+        return self.record_batch_columns(*zip(*trades))
+
+    def record_batch_columns(self, symbols, timestamps, quantities, buy_sells,
+                             prices):
+        """
+        Same as record_batch, but trades are given as columns.
+        """
+        if numpy is not None:
+            columns = []
+            for column in (timestamps, quantities, prices):
+                column = numpy.asarray(column)
+                if column.dtype.kind not in 'iuf':
+                    break
+                columns.append(column)
+            else:
+                timestamps, quantities, prices = columns
+            buy_sells = numpy.asarray(buy_sells, dtype=object)
+
+        indexes_by_symbol = collections.defaultdict(list)
+        for index, symbol in enumerate(symbols):
+            indexes_by_symbol[symbol].append(index)
+
+        rejected = []
+        for symbol, indexes in indexes_by_symbol.iteritems():
+            stock = self._stocks.get(symbol)
+            if stock is None:
+                error = 'Stock "{}" is not found'.format(symbol)
+                rejected.extend(RejectedTrade(index, error)
+                                for index in indexes)
+                continue
+
+            stock_rejected = stock.record_trade_columns(
+                *[_take(column, indexes)
+                  for column in (timestamps, quantities, buy_sells, prices)]
+            )
+            rejected.extend(
+                RejectedTrade(indexes[trade.index], trade.error)
+                for trade in stock_rejected
+            )
+
+        rejected.sort()
+        return rejected
 
     def add_stock(self, stock):
         if not isinstance(stock, Stock):
             raise StockError('stock argument should be of Stock type')
 
-        self._stocks[stock.symbol] = stock
+        if self._thread_safe:
+            stock.enable_thread_safety()
+        if self._trusted:
+            stock.enable_trusted_ingest()
+        if self._journal is not None:
+            stock.set_journal(self._journal)
+        stock.set_stats(self._stats)
+        stock.set_clock(self._clock)
+
+        with self._lock:
+            stock.share_reference_data(self._reference_data)
+            previous_stock = self._stocks.get(stock.symbol)
+            if previous_stock is not None:
+                previous_stock.remove_listener(self._on_trade_recorded)
+
+            self._stocks[stock.symbol] = stock
+            stock.add_listener(self._on_trade_recorded)
+            with self._dirty_lock:
+                self._dirty_symbols.add(stock.symbol)
 
     def get_stock(self, symbol):
         return self._stocks[symbol]
+
+    def symbols(self):
+        return self._stocks.keys()
+
+    @property
+    def clock(self):
+        return self._clock
+
+    def set_clock(self, manager_clock):
+        """
+        Use the clock for the index and all stocks, including stocks added
+        later. None sets the wall clock.
+        """
+        with self._lock:
+            self._clock = manager_clock or _WALL_CLOCK
+            for stock in self._stocks.values():
+                stock.set_clock(self._clock)
+            # Scheduled evictions are of the previous clock time
+            with self._dirty_lock:
+                self._dirty_symbols.update(self._stocks)
+
+    def set_journal(self, journal):
+        """
+        Journal trades of all stocks, including stocks added later.
+        """
+        self._journal = journal
+        for stock in self._stocks.values():
+            stock.set_journal(journal)
+
+    @property
+    def stats(self):
+        return self._stats
+
+    def enable_stats(self):
+        """
+        Start collecting stats.Stats of all stocks, including stocks added
+        later, with counters and latencies starting from zero.
+        """
+        self._set_stats(stats.Stats())
+
+    def disable_stats(self):
+        self._set_stats(None)
+
+    def _set_stats(self, manager_stats):
+        self._stats = manager_stats
+        for stock in self._stocks.values():
+            stock.set_stats(manager_stats)
+
+    def stats_snapshot(self):
+        """
+        Counters, latencies and stored trade counts of stocks as a dict of
+        plain values, or None if stats are disabled.
+        """
+        if self._stats is None:
+            return None
+        snapshot = self._stats.snapshot()
+        snapshot['window_sizes'] = stats.window_sizes(
+            stock.trade_count for stock in self._stocks.values()
+        )
+        return snapshot
@@ -0,0 +1,283 @@
+"""
+Streaming replay of trades from CSV or JSON lines files, optionally gzipped.
+
+Trades go through a pipeline of generators, a chunk of trades at a time:
+read -> parse -> look up stocks -> route to stock manager -> emit index, so
+memory use depends on the chunk size only. Trades are validated once, by the
+stock manager.
+
+By default stock prices and the index are calculated at event time, the
+time of the latest replayed trade, so replaying historical files gives the
+same results as recording the trades when they happened.
+"""
+import argparse
+import collections
+import csv
+import gzip
+import itertools
+import json
+import sys
+import time
+
+import clock
+
+
+DEFAULT_CHUNK_SIZE = 4096
+FIELDS = ('symbol', 'timestamp', 'quantity', 'buy_sell', 'price')
+FORMATS = ('csv', 'jsonl')
+CLOCKS = ('event', 'wall')
+# Number of rejected trades to show
+MAX_SHOWN_ERRORS = 10
+
+
+class ReplayError(Exception):
+    pass
+
+
+class ReplayStats(object):
+    def __init__(self):
+        self.read = 0
+        self.recorded = 0
+        self.rejected = 0
+        self.errors = []
+        # Time spent inside every stage, including stages before it
+        self.stage_times = collections.OrderedDict()
+
+    def reject(self, line, error):
+        self.rejected += 1
+        if len(self.errors) < MAX_SHOWN_ERRORS:
+            self.errors.append((line, error))
+
+    def own_stage_times(self):
+        """
+        Time spent inside every stage without stages before it.
+        """
+        own_times = collections.OrderedDict()
+        previous = 0.0
+        for stage, seconds in self.stage_times.iteritems():
+            own_times[stage] = seconds - previous
+            previous = seconds
+        return own_times
+
+
+def _timed(stage, chunks, stats):
+    stats.stage_times.setdefault(stage, 0.0)
+
+    def timed_chunks():
+        iterator = iter(chunks)
+        while True:
+            started_at = time.time()
+            try:
+                chunk = next(iterator)
+            finally:
+                stats.stage_times[stage] += time.time() - started_at
+            yield chunk
+
+    return timed_chunks()
+
+
+def detect_format(path):
+    name = path[:-3] if path.endswith('.gz') else path
+    for file_format, extensions in (('csv', ('.csv',)),
+                                    ('jsonl', ('.jsonl', '.json'))):
+        if name.endswith(extensions):
+            return file_format
+    raise ReplayError('Cannot detect format of {}'.format(path))
+
+
+def read_lines(path, chunk_size):
+    """
+    Chunks of (line number, line) of the file.
+    """
+    with open(path, 'rb') as raw_file:
+        gzipped = raw_file.read(2) == '\x1f\x8b'
+    lines_file = gzip.open(path, 'rb') if gzipped else open(path, 'rb')
+    with lines_file:
+        lines = enumerate(lines_file, 1)
+        while True:
+            chunk = list(itertools.islice(lines, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+
+def parse_csv(chunks, stats):
+    """
+    Chunks of (line number, trade fields) of CSV lines. The first line is a
+    header naming the fields in any order.
+    """
+    columns = None
+    for chunk in chunks:
+        trades = []
+        chunk = [(line_number, line) for line_number, line in chunk
+                 if line.strip()]
+        rows = csv.reader(line for _, line in chunk)
+        for (line_number, _), row in itertools.izip(chunk, rows):
+            if columns is None:
+                try:
+                    columns = [row.index(field) for field in FIELDS]
+                except ValueError:
+                    raise ReplayError(
+                        'CSV header should name {} fields'.format(
+                            ', '.join(FIELDS)
+                        )
+                    )
+                continue
+            stats.read += 1
+            try:
+                trades.append((line_number, [row[column]
+                                             for column in columns]))
+            except IndexError:
+                stats.reject(line_number, 'missing fields')
+        yield trades
+
+
+def parse_jsonl(chunks, stats):
+    """
+    Chunks of (line number, trade fields) of JSON objects, one per line.
+    """
+    for chunk in chunks:
+        trades = []
+        for line_number, line in chunk:
+            if not line.strip():
+                continue
+            stats.read += 1
+            try:
+                trade = json.loads(line)
+                fields = [trade[field] for field in FIELDS]
+                # Symbols are looked up in a set and a dict of stocks
+                if not isinstance(fields[0], basestring):
+                    raise TypeError
+            except (ValueError, KeyError, TypeError):
+                stats.reject(line_number, 'invalid JSON trade')
+                continue
+            trades.append((line_number, fields))
+        yield trades
+
+
+def lookup(chunks, stock_manager, stats):
+    """
+    Line numbers and columns of trades of known stocks of every chunk.
+    """
+    known_symbols = set()
+    for chunk in chunks:
+        line_numbers = []
+        columns = ([], [], [], [], [])
+        for line_number, trade in chunk:
+            symbol = trade[0]
+            if symbol not in known_symbols:
+                try:
+                    stock_manager.get_stock(symbol)
+                except KeyError:
+                    stats.reject(line_number,
+                                 'Stock "{}" is not found'.format(symbol))
+                    continue
+                known_symbols.add(symbol)
+            line_numbers.append(line_number)
+            for column, value in zip(columns, trade):
+                column.append(value)
+        yield line_numbers, columns
+
+
+def route(chunks, stock_manager, stats):
+    """
+    Validate and record trades of every chunk, publish subscriptions of the
+    stock manager and pass on the number of recorded trades.
+    """
+    for line_numbers, columns in chunks:
+        rejected = stock_manager.record_batch_columns(*columns)
+        if hasattr(stock_manager, 'publish'):
+            stock_manager.publish()
+        for trade in rejected:
+            stats.reject(line_numbers[trade.index],
+                         trade.error.replace('\n', '; '))
+        recorded = len(line_numbers) - len(rejected)
+        stats.recorded += recorded
+        yield recorded
+
+
+def emit_index(chunks, stock_manager, every):
+    """
+    (number of recorded trades, all share index) after chunks which reach
+    the next multiple of the given number of recorded trades.
+    """
+    recorded = 0
+    next_emit = every
+    for count in chunks:
+        recorded += count
+        if recorded >= next_emit:
+            yield recorded, stock_manager.all_share_index
+            next_emit = (recorded // every + 1) * every
+
+
+def replay(path, stock_manager, file_format=None,
+           chunk_size=DEFAULT_CHUNK_SIZE, index_every=None, stats=None):
+    """
+    Replay trades of the file to the stock manager. Generates
+    (number of recorded trades, all share index) every index_every trades,
+    counters and stage timings are collected to stats.
+    """
+    if stats is None:
+        stats = ReplayStats()
+    file_format = file_format or detect_format(path)
+    parse = parse_csv if file_format == 'csv' else parse_jsonl
+
+    chunks = _timed('read', read_lines(path, chunk_size), stats)
+    chunks = _timed('parse', parse(chunks, stats), stats)
+    chunks = _timed('lookup', lookup(chunks, stock_manager, stats), stats)
+    chunks = _timed('route', route(chunks, stock_manager, stats), stats)
+    if index_every:
+        for emitted in _timed('index', emit_index(chunks, stock_manager,
+                                                  index_every), stats):
+            yield emitted
+    else:
+        for _ in chunks:
+            pass
+
+
+def main(argv, stock_manager, output=sys.stdout):
+    parser = argparse.ArgumentParser(
+        prog='sss replay',
+        description='Replay trades from CSV or JSON lines files'
+    )
+    parser.add_argument('paths', metavar='PATH', nargs='+')
+    parser.add_argument('--format', choices=FORMATS,
+                        help='file format, detected by extension by default')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--index-every', type=int, metavar='TRADES',
+                        help='print All Share Index every TRADES trades')
+    parser.add_argument('--clock', choices=CLOCKS, default='event',
+                        help='time of prices, the latest replayed trade '
+                        'time by default')
+    args = parser.parse_args(argv)
+
+    if args.clock == 'event':
+        stock_manager.set_clock(clock.EventClock())
+    else:
+        stock_manager.set_clock(clock.WALL_CLOCK)
+
+    stats = ReplayStats()
+    started_at = time.time()
+    try:
+        for path in args.paths:
+            for _, index in replay(path, stock_manager, args.format,
+                                   args.chunk_size, args.index_every, stats):
+                print >>output, 'trades {} index {!r}'.format(
+                    stats.recorded, index
+                )
+    except (IOError, ReplayError) as e:
+        print >>output, 'Replay failed: {}'.format(e)
+        return 1
+    seconds = time.time() - started_at
+
+    for line_number, error in stats.errors:
+        print >>output, 'Rejected (line {}): {}'.format(line_number, error)
+    print >>output, 'Read {} trades, recorded {}, rejected {}'.format(
+        stats.read, stats.recorded, stats.rejected
+    )
+    print >>output, 'Replayed in {:.3f}s, {:.0f} trades/s'.format(
+        seconds, stats.read / seconds if seconds else 0.0
+    )
+    for stage, stage_seconds in stats.own_stage_times().iteritems():
+        print >>output, '  {:<10}{:.3f}s'.format(stage, stage_seconds)
+    return 0
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+"""
+Trade ingestion server with a line protocol.
+
+Every request is a line, every request gets a reply line in order:
+
+    SYMBOL QUANTITY SIDE PRICE [TIMESTAMP]  ->  OK | ERR <message>
+    PRICE SYMBOL                            ->  PRICE SYMBOL <price>
+    INDEX                                   ->  INDEX <all share index>
+
+Trades without timestamp get the time of the stock manager clock when they
+are received. Subscriptions of the stock manager are published after every
+recorded batch.
+"""
+import argparse
+import asynchat
+import asyncore
+import os
+import socket
+
+from sss import build_stock_manager
+
+
+DEFAULT_PORT = 8700
+# Trades of all connections are recorded with one record_batch call once
+# this many are pending or when the event loop has nothing more to read
+DEFAULT_BATCH_SIZE = 4096
+# A connection is not read while this many replies wait to be sent to it
+MAX_QUEUED_REPLIES = 1024
+MAX_LINE_LENGTH = 1024
+
+
+def _parse_trade(parts, now):
+    """
+    Convert trade fields to numbers where possible, the rest is left for
+    validation to reject with a proper message. Trades without timestamp get
+    the given time.
+    """
+    symbol, quantity, buy_sell, price = parts[:4]
+    timestamp = parts[4] if len(parts) == 5 else now
+    fields = []
+    for value, convert in ((timestamp, float), (quantity, int),
+                           (price, float)):
+        try:
+            value = convert(value)
+        except ValueError:
+            pass
+        fields.append(value)
+    timestamp, quantity, price = fields
+    return symbol, timestamp, quantity, buy_sell.lower(), price
+
+
+class TradeConnection(asynchat.async_chat):
+    def __init__(self, server, sock, map=None):
+        asynchat.async_chat.__init__(self, sock, map)
+        self._server = server
+        self._line = []
+        self._line_length = 0
+        self._closing = False
+        self.set_terminator('\n')
+
+    def readable(self):
+        # Backpressure: stop reading from a client that doesn't read replies
+        return (not self._closing and
+                len(self.producer_fifo) < MAX_QUEUED_REPLIES)
+
+    def collect_incoming_data(self, data):
+        if self._closing:
+            return
+        self._line_length += len(data)
+        if self._line_length > MAX_LINE_LENGTH:
+            # Nothing more is read, the connection is closed once the
+            # error is sent
+            self._closing = True
+            self._line = []
+            self._line_length = 0
+            self.push('ERR line is too long\n')
+            self.close_when_done()
+            return
+        self._line.append(data)
+
+    def found_terminator(self):
+        if self._closing:
+            return
+        line = ''.join(self._line).strip()
+        self._line = []
+        self._line_length = 0
+        if line:
+            self._server.handle_request(self, line)
+
+    def reply(self, line):
+        self.push(line + '\n')
+
+    def handle_close(self):
+        self._server.forget_connection(self)
+        self.close()
+
+    def handle_error(self):
+        self._server.forget_connection(self)
+        self.close()
+
+
+class TradeServer(asyncore.dispatcher):
+    """
+    Accepts many feed connections and records their trades in batches.
+
+    address is a (host, port) tuple for TCP or a path for a UNIX socket.
+    Replies to trades are sent once their batch is recorded. Queries record
+    pending trades first, so they see all trades sent before them.
+    """
+
+    def __init__(self, stock_manager, address, batch_size=DEFAULT_BATCH_SIZE):
+        self._map = {}
+        asyncore.dispatcher.__init__(self, map=self._map)
+        self._stock_manager = stock_manager
+        self._batch_size = batch_size
+        self._pending = []
+        self._running = False
+
+        if isinstance(address, basestring):
+            if os.path.exists(address):
+                os.unlink(address)
+            self.create_socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.set_reuse_addr()
+        self.bind(address)
+        self.listen(128)
+
+    @property
+    def address(self):
+        return self.socket.getsockname()
+
+    def handle_accept(self):
+        accepted = self.accept()
+        if accepted is not None:
+            sock, _ = accepted
+            TradeConnection(self, sock, self._map)
+
+    def handle_request(self, connection, line):
+        parts = line.split()
+        command = parts[0].upper()
+        if command == 'INDEX' and len(parts) == 1:
+            self.flush()
+            connection.reply('INDEX {!r}'.format(
+                self._stock_manager.all_share_index
+            ))
+        elif command == 'PRICE' and len(parts) == 2:
+            self.flush()
+            try:
+                stock = self._stock_manager.get_stock(parts[1])
+            except KeyError:
+                connection.reply('ERR Stock "{}" is not found'.format(
+                    parts[1]
+                ))
+            else:
+                connection.reply('PRICE {} {!r}'.format(stock.symbol,
+                                                        stock.stock_price))
+        elif len(parts) in (4, 5):
+            trade = _parse_trade(parts, self._stock_manager.clock.now())
+            self._pending.append((connection, trade))
+            if len(self._pending) >= self._batch_size:
+                self.flush()
+        else:
+            self.flush()
+            connection.reply('ERR unknown request')
+
+    def forget_connection(self, connection):
+        # Replies can't be sent to a broken connection any more
+        self._pending = [
+            (pending_connection, trade)
+            for pending_connection, trade in self._pending
+            if pending_connection is not connection
+        ]
+
+    def flush(self):
+        """
+        Record pending trades and reply to their connections.
+        """
+        if not self._pending:
+            return
+        pending = self._pending
+        self._pending = []
+
+        rejected = dict(self._stock_manager.record_batch(
+            trade for _, trade in pending
+        ))
+        if hasattr(self._stock_manager, 'publish'):
+            self._stock_manager.publish()
+        for index, (connection, _) in enumerate(pending):
+            error = rejected.get(index)
+            if error is None:
+                connection.reply('OK')
+            else:
+                connection.reply('ERR ' + error.replace('\n', '; '))
+
+    def serve_forever(self, poll_interval=0.5):
+        self._running = True
+        while self._running and self._map:
+            asyncore.loop(poll_interval, map=self._map, count=1)
+            self.flush()
+
+    def shutdown(self):
+        """
+        Stop serve_forever. Can be called from another thread.
+        """
+        self._running = False
+
+    def close(self):
+        asyncore.dispatcher.close(self)
+        for dispatcher in self._map.values():
+            dispatcher.close()
+
+
+def parse_address(args):
+    if args.unix is not None:
+        return args.unix
+    return (args.host, args.port)
+
+
+def add_address_arguments(parser):
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--unix', metavar='PATH',
+                        help='listen on a UNIX socket instead of TCP')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Trade ingestion server')
+    add_address_arguments(parser)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    stock_manager = build_stock_manager()
+    server = TradeServer(stock_manager, parse_address(args), args.batch_size)
+    print 'Listening on', server.address
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == '__main__':
+    main()
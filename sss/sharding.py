@@ -0,0 +1,328 @@
+import collections
+import math
+import multiprocessing
+import sys
+import threading
+import zlib
+
+import clock
+import model
+
+
+DEFAULT_SHARDS = multiprocessing.cpu_count()
+
+
+def _shard_handlers(stock_manager):
+    def add_stock(reference_data):
+        stock_manager.add_stock(model.Stock(**reference_data))
+
+    def record_trade(symbol, timestamp, quantity, buy_sell, price):
+        stock_manager.get_stock(symbol).record_trade(timestamp, quantity,
+                                                     buy_sell, price)
+
+    def call_stock(symbol, name, args):
+        attribute = getattr(stock_manager.get_stock(symbol), name)
+        if args is None:
+            return attribute
+        return attribute(*args)
+
+    return {
+        'add_stock': add_stock,
+        'record_trade': record_trade,
+        'record_batch_columns': stock_manager.record_batch_columns,
+        'stock': call_stock,
+        'index_terms': stock_manager.all_share_index_terms,
+        'snapshot_all': stock_manager.snapshot_all,
+    }
+
+
+def _serve_shard(connection):
+    """
+    Worker loop of a shard. Requests are (method, args) tuples, None stops
+    the worker. Every request gets ('ok', result) or ('error', exception)
+    reply.
+    """
+    handlers = _shard_handlers(model.StockManager())
+    while True:
+        request = connection.recv()
+        if request is None:
+            break
+
+        method, args = request
+        try:
+            reply = ('ok', handlers[method](*args))
+        except Exception as e:
+            reply = ('error', e)
+        connection.send(reply)
+    connection.close()
+
+
+class _Shard(object):
+    """
+    Parent side of a shard worker process.
+    """
+
+    def __init__(self):
+        self._connection, worker_connection = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_serve_shard,
+                                                args=(worker_connection,))
+        self._process.daemon = True
+        self._process.start()
+        worker_connection.close()
+        # Request and its reply should not interleave with other threads
+        self._lock = threading.Lock()
+
+    def send(self, method, *args):
+        self._lock.acquire()
+        try:
+            self._connection.send((method, args))
+        except:
+            self._lock.release()
+            raise
+
+    def receive(self):
+        try:
+            status, result = self._connection.recv()
+        finally:
+            self._lock.release()
+        if status == 'error':
+            raise result
+        return result
+
+    def call(self, method, *args):
+        self.send(method, *args)
+        return self.receive()
+
+    def close(self):
+        with self._lock:
+            self._connection.send(None)
+            self._connection.close()
+        self._process.join()
+
+
+class ShardedStock(object):
+    """
+    Stand-in for a stock kept by a shard worker. Reference data is known
+    locally, trades and prices go to the worker.
+    """
+
+    def __init__(self, shard, reference_data):
+        self._shard = shard
+        self._reference_data = reference_data
+
+    def reference_data(self):
+        return dict(self._reference_data)
+
+    @property
+    def symbol(self):
+        return self._reference_data['symbol']
+
+    @property
+    def stock_type(self):
+        return self._reference_data['stock_type']
+
+    @property
+    def last_dividend(self):
+        return self._reference_data['last_dividend']
+
+    @property
+    def fixed_dividend(self):
+        fixed_dividend = self._reference_data['fixed_dividend']
+        return fixed_dividend and fixed_dividend / 100.0
+
+    @property
+    def par_value(self):
+        return self._reference_data['par_value']
+
+    @property
+    def clock(self):
+        return clock.WALL_CLOCK
+
+    def _call(self, name, *args):
+        return self._shard.call('stock', self.symbol, name, args)
+
+    def _get(self, name):
+        return self._shard.call('stock', self.symbol, name, None)
+
+    @property
+    def fixed_dividend_percent(self):
+        return self._reference_data['fixed_dividend']
+
+    @property
+    def dividend_yield(self):
+        return self.snapshot().dividend_yield
+
+    @property
+    def pe_ratio(self):
+        return self.snapshot().pe_ratio
+
+    @property
+    def stock_price(self):
+        return self._get('stock_price')
+
+    def snapshot(self):
+        return self._call('snapshot')
+
+    def window_prices(self):
+        return self._call('window_prices')
+
+    def vwap(self, since, until=None):
+        return self._call('vwap', since, until)
+
+    def record_trade(self, timestamp, quantity, buy_sell, price):
+        self._shard.call('record_trade', self.symbol, timestamp, quantity,
+                         buy_sell, price)
+
+    def record_trades(self, trades):
+        return self._call('record_trades', list(trades))
+
+    def record_trade_columns(self, timestamps, quantities, buy_sells, prices):
+        return self._call('record_trade_columns', timestamps, quantities,
+                          buy_sells, prices)
+
+
+class ShardedStockManager(object):
+    """
+    Stock manager which spreads stocks over worker processes, so trades of
+    different stocks are recorded on several cores.
+
+    Every stock is owned by one shard picked by a hash of its symbol. Batches
+    are split by shard and sent to all shards before waiting for any reply,
+    so shards process their parts in parallel. The All Share Index is
+    combined from sums of log-prices and counts of stocks of every shard.
+    Shards calculate prices at the wall clock time.
+
+    Workers are stopped by close, or at exit as daemon processes.
+    """
+
+    def __init__(self, shards=DEFAULT_SHARDS):
+        if shards < 1:
+            raise ValueError('at least one shard is required')
+        self._shards = [_Shard() for _ in xrange(shards)]
+        self._stocks = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        for shard in self._shards:
+            shard.close()
+
+    def _shard_index(self, symbol):
+        # Built-in hash of strings may differ between processes
+        return zlib.crc32(symbol) % len(self._shards)
+
+    def _call_all(self, requests):
+        """
+        Send (shard, method, args) requests before waiting for any reply, so
+        shards process them in parallel, and return replies in order.
+
+        Replies to all sent requests are received before the first error is
+        raised, so every shard is ready for the next request.
+        """
+        sent = []
+        error = None
+        try:
+            for shard, method, args in requests:
+                shard.send(method, *args)
+                sent.append(shard)
+        except Exception:
+            error = sys.exc_info()
+
+        replies = []
+        for shard in sent:
+            try:
+                replies.append(shard.receive())
+            except Exception:
+                replies.append(None)
+                if error is None:
+                    error = sys.exc_info()
+        if error is not None:
+            raise error[0], error[1], error[2]
+        return replies
+
+    @property
+    def all_share_index(self):
+        terms = self._call_all(
+            (shard, 'index_terms', ()) for shard in self._shards
+        )
+
+        count = sum(shard_count for _, shard_count in terms)
+        if not count:
+            return 0.0
+
+        log_prices_sum = math.fsum(shard_sum for shard_sum, _ in terms)
+        return math.exp(log_prices_sum / count)
+
+    def snapshot_all(self):
+        snapshots = {}
+        for shard_snapshots in self._call_all(
+            (shard, 'snapshot_all', ()) for shard in self._shards
+        ):
+            snapshots.update(shard_snapshots)
+        return snapshots
+
+    def record_batch(self, trades):
+        """
+        Record many (symbol, timestamp, quantity, buy_sell, price) trades at
+        once. Valid trades are recorded and a list of RejectedTrade is returned
+        for the rest.
+        """
+        trades = list(trades)
+        if not trades:
+            return []
+        return self.record_batch_columns(*zip(*trades))
+
+    def record_batch_columns(self, symbols, timestamps, quantities, buy_sells,
+                             prices):
+        """
+        Same as record_batch, but trades are given as columns.
+        """
+        indexes_by_shard = collections.defaultdict(list)
+        for index, symbol in enumerate(symbols):
+            indexes_by_shard[self._shard_index(symbol)].append(index)
+
+        indexes_by_shard = indexes_by_shard.items()
+        replies = self._call_all(
+            (self._shards[shard_index], 'record_batch_columns',
+             [model._take(column, indexes)
+              for column in (symbols, timestamps, quantities, buy_sells,
+                             prices)])
+            for shard_index, indexes in indexes_by_shard
+        )
+
+        rejected = []
+        for (_, indexes), shard_rejected in zip(indexes_by_shard, replies):
+            rejected.extend(
+                model.RejectedTrade(indexes[trade.index], trade.error)
+                for trade in shard_rejected
+            )
+
+        rejected.sort()
+        return rejected
+
+    def add_stock(self, stock):
+        """
+        Add a stock to its shard. Only reference data and settings of the
+        stock are sent, recorded trades stay with the given stock.
+        """
+        if not isinstance(stock, (model.Stock, ShardedStock)):
+            raise model.StockError('stock argument should be of Stock type')
+
+        reference_data = stock.reference_data()
+        shard = self._shards[self._shard_index(stock.symbol)]
+        shard.call('add_stock', reference_data)
+        self._stocks[stock.symbol] = ShardedStock(shard, reference_data)
+
+    def get_stock(self, symbol):
+        return self._stocks[symbol]
+
+    @property
+    def clock(self):
+        return clock.WALL_CLOCK
+
+    def symbols(self):
+        return self._stocks.keys()
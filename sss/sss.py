@@ -1,7 +1,12 @@
 #!/usr/bin/env python
 
+import argparse
+import sys
+
 import cli
+import journal
 import model
+import replay
 
 
 sample_stocks = [
@@ -43,9 +48,45 @@ sample_stocks = [
 ]
 
 
-if __name__ == '__main__':
+def build_stock_manager():
     stock_manager = model.StockManager()
     for stock_data in sample_stocks:
         stock_manager.add_stock(model.Stock(**stock_data))
+    return stock_manager
+
+
+def run_shell(argv):
+    parser = argparse.ArgumentParser(
+        description='Super Simple Stocks',
+        epilog='Run "%(prog)s replay --help" to replay trades from files.'
+    )
+    parser.add_argument(
+        '--journal', metavar='PATH',
+        help='journal recorded trades to the file and replay it on start'
+    )
+    parser.add_argument('--stats', action='store_true',
+                        help='collect statistics from the start')
+    args = parser.parse_args(argv)
+
+    stock_manager = build_stock_manager()
+    if args.stats:
+        stock_manager.enable_stats()
 
-    cli.SuperSimpleStocksShell(stock_manager)
+    trade_journal = None
+    if args.journal is not None:
+        replayed = journal.replay(args.journal, stock_manager)
+        print 'Replayed {} trades from {}'.format(replayed, args.journal)
+        trade_journal = journal.TradeJournal(args.journal)
+        stock_manager.set_journal(trade_journal)
+
+    try:
+        cli.SuperSimpleStocksShell(stock_manager)
+    finally:
+        if trade_journal is not None:
+            trade_journal.close()
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['replay']:
+        sys.exit(replay.main(sys.argv[2:], build_stock_manager()))
+    run_shell(sys.argv[1:])
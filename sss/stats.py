@@ -0,0 +1,151 @@
+"""
+Low-overhead counters and latency histograms of model hot paths.
+
+Stocks and stock managers keep a reference to Stats, which is None while
+instrumentation is disabled, so a disabled hot path costs one comparison.
+"""
+import collections
+import json
+import math
+import threading
+
+
+# Every power of two range of latencies is split into this many buckets, so
+# percentiles are within 1 / HISTOGRAM_SUBBUCKETS of the real value
+HISTOGRAM_SUBBUCKETS = 4
+
+HistogramSnapshot = collections.namedtuple(
+    'HistogramSnapshot', ('count', 'mean', 'p50', 'p90', 'p99', 'max')
+)
+
+
+class Histogram(object):
+    """
+    Histogram of positive values in logarithmic buckets.
+    """
+
+    def __init__(self):
+        self._buckets = collections.defaultdict(int)
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+
+    def observe(self, value):
+        if value > 0.0:
+            mantissa, exponent = math.frexp(value)
+            # mantissa is in [0.5, 1)
+            bucket = (exponent * HISTOGRAM_SUBBUCKETS +
+                      int((mantissa - 0.5) * 2 * HISTOGRAM_SUBBUCKETS))
+        else:
+            bucket = None
+        self._buckets[bucket] += 1
+        self._count += 1
+        self._sum += value
+        if value > self._max:
+            self._max = value
+
+    @staticmethod
+    def _upper_bound(bucket):
+        if bucket is None:
+            return 0.0
+        exponent, subbucket = divmod(bucket, HISTOGRAM_SUBBUCKETS)
+        return math.ldexp(
+            0.5 + (subbucket + 1) / (2.0 * HISTOGRAM_SUBBUCKETS), exponent
+        )
+
+    def percentile(self, percent):
+        """
+        Upper bound of the bucket holding the percentile, not more than the
+        maximal value.
+        """
+        if not self._count:
+            return 0.0
+        rank = self._count * percent / 100.0
+        seen = 0
+        buckets = sorted(self._buckets.iteritems(),
+                         key=lambda item: (item[0] is not None, item[0]))
+        for bucket, count in buckets:
+            seen += count
+            if seen >= rank:
+                return min(self._upper_bound(bucket), self._max)
+        return self._max
+
+    def snapshot(self):
+        return HistogramSnapshot(
+            count=self._count,
+            mean=self._sum / self._count if self._count else 0.0,
+            p50=self.percentile(50),
+            p90=self.percentile(90),
+            p99=self.percentile(99),
+            max=self._max
+        )
+
+
+class Stats(object):
+    """
+    Named counters and latency histograms shared by stocks of a manager.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = collections.defaultdict(int)
+        self._histograms = collections.defaultdict(Histogram)
+
+    def increment(self, counter, value=1):
+        with self._lock:
+            self._counters[counter] += value
+
+    def observe(self, histogram, seconds):
+        with self._lock:
+            self._histograms[histogram].observe(seconds)
+
+    def snapshot(self):
+        """
+        Counters and histogram summaries as a dict of plain values.
+        """
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'latencies': dict(
+                    (name, histogram.snapshot()._asdict())
+                    for name, histogram in self._histograms.iteritems()
+                ),
+            }
+
+
+def window_sizes(trade_counts):
+    """
+    Summary of numbers of stored trades of stocks.
+    """
+    trade_counts = list(trade_counts)
+    return {
+        'stocks': len(trade_counts),
+        'total': sum(trade_counts),
+        'max': max(trade_counts) if trade_counts else 0,
+        'mean': (float(sum(trade_counts)) / len(trade_counts)
+                 if trade_counts else 0.0),
+    }
+
+
+def export(snapshot, stats_file):
+    json.dump(snapshot, stats_file, indent=2, sort_keys=True)
+
+
+def format_snapshot(snapshot):
+    lines = []
+    for name, value in sorted(snapshot['counters'].iteritems()):
+        lines.append('{:<24}{}'.format(name, value))
+    if 'window_sizes' in snapshot:
+        lines.append('{:<24}{total} trades in {stocks} stocks, '
+                     'max {max}'.format('window_sizes',
+                                        **snapshot['window_sizes']))
+    for name, latency in sorted(snapshot['latencies'].iteritems()):
+        lines.append(
+            '{:<24}count {count}, mean {mean_us:.1f}us, p50 {p50_us:.1f}us, '
+            'p99 {p99_us:.1f}us, max {max_us:.1f}us'.format(
+                name, count=latency['count'],
+                mean_us=latency['mean'] * 1e6, p50_us=latency['p50'] * 1e6,
+                p99_us=latency['p99'] * 1e6, max_us=latency['max'] * 1e6
+            )
+        )
+    return '\n'.join(lines)
@@ -1,36 +1,397 @@
-from collections import deque
+import abc
+import bisect
+import collections
+import itertools
+
+
+DEFAULT_SEGMENT_SIZE = 4096
+
+# Relative cost of checking a record against a condition in Python and of
+# handling a record id during intersection of record id lists
+FILTER_COST = 4.0
+INTERSECT_COST = 1.0
+
+PlanStep = collections.namedtuple(
+    'PlanStep', ('operation', 'field', 'estimated_rows')
+)
 
 
 class Index(object):
-    pass
+    """
+    Maps values of a record field to ids of records in storage. Abstract
+    base of indexes, subclasses implement index, get, count and compact.
+
+    Ids of records dropped by retention are not removed right away. They are
+    skipped on lookups and cleaned up by compact.
+    """
+
+    __metaclass__ = abc.ABCMeta
+
+    def __init__(self, field):
+        self._field = field
+
+    @property
+    def field(self):
+        return self._field
+
+    @abc.abstractmethod
+    def index(self, value, record_id):
+        """
+        Add id of a record with the given value of the field.
+        """
+
+    @abc.abstractmethod
+    def get(self, condition, first_id=0):
+        """
+        Ids of records matching the condition, which are not less than
+        first_id, in ascending order.
+        """
+
+    @abc.abstractmethod
+    def count(self, condition):
+        """
+        Estimated number of records matching the condition. Dropped records
+        which are not cleaned up yet are counted too.
+        """
+
+    @abc.abstractmethod
+    def compact(self, first_id):
+        """
+        Remove ids of records less than first_id.
+        """
+
+    def supports(self, condition):
+        return not isinstance(condition, tuple)
 
 
 class OrderedIndex(Index):
-    pass
+    """
+    Sorted index, which answers both equality and range conditions in
+    O(log n). Range condition is a (low, high) tuple matching values in the
+    closed interval, None stands for an open end.
+    """
+
+    def __init__(self, field):
+        super(OrderedIndex, self).__init__(field)
+        self._keys = []
+        self._record_ids = []
+
+    def index(self, value, record_id):
+        # Records mostly come in order of indexed value (e.g. timestamps),
+        # so appending is the common case
+        if not self._keys or self._keys[-1] <= value:
+            self._keys.append(value)
+            self._record_ids.append(record_id)
+            return
+
+        insert_at = bisect.bisect_right(self._keys, value)
+        self._keys.insert(insert_at, value)
+        self._record_ids.insert(insert_at, record_id)
+
+    def _bounds(self, condition):
+        if isinstance(condition, tuple):
+            low, high = condition
+        else:
+            low = high = condition
+
+        start = 0 if low is None else bisect.bisect_left(self._keys, low)
+        stop = (
+            len(self._keys)
+            if high is None else
+            bisect.bisect_right(self._keys, high)
+        )
+        return start, max(start, stop)
+
+    def get(self, condition, first_id=0):
+        start, stop = self._bounds(condition)
+        return sorted(
+            record_id for record_id in self._record_ids[start:stop]
+            if record_id >= first_id
+        )
+
+    def count(self, condition):
+        start, stop = self._bounds(condition)
+        return stop - start
+
+    def compact(self, first_id):
+        entries = [
+            (key, record_id)
+            for key, record_id in itertools.izip(self._keys, self._record_ids)
+            if record_id >= first_id
+        ]
+        self._keys = [key for key, _ in entries]
+        self._record_ids = [record_id for _, record_id in entries]
+
+    def supports(self, condition):
+        return True
 
 
 class UnorderedIndex(Index):
-    pass
+    """
+    Hash index for equality conditions.
+    """
+
+    def __init__(self, field):
+        super(UnorderedIndex, self).__init__(field)
+        self._record_ids = collections.defaultdict(list)
+
+    def index(self, value, record_id):
+        self._record_ids[value].append(record_id)
+
+    def get(self, condition, first_id=0):
+        record_ids = self._record_ids.get(condition)
+        if not record_ids:
+            return []
+
+        # Ids are appended in ascending order, so dropped ones are in front
+        dropped = bisect.bisect_left(record_ids, first_id)
+        if dropped:
+            del record_ids[:dropped]
+            if not record_ids:
+                del self._record_ids[condition]
+        return list(record_ids)
+
+    def count(self, condition):
+        return len(self._record_ids.get(condition, ()))
+
+    def compact(self, first_id):
+        for value in self._record_ids.keys():
+            self.get(value, first_id)
+
+
+def _matches(value, condition):
+    if isinstance(condition, tuple):
+        low, high = condition
+        return (
+            (low is None or low <= value) and
+            (high is None or value <= high)
+        )
+    return value == condition
+
+
+def _intersect(record_ids, other_record_ids):
+    """
+    Intersect two ascending record id lists.
+    """
+    if len(other_record_ids) > 8 * len(record_ids):
+        # Look up every id in much longer list
+        intersection = []
+        for record_id in record_ids:
+            found_at = bisect.bisect_left(other_record_ids, record_id)
+            if (
+                found_at < len(other_record_ids) and
+                other_record_ids[found_at] == record_id
+            ):
+                intersection.append(record_id)
+        return intersection
+
+    if len(record_ids) > len(other_record_ids):
+        record_ids, other_record_ids = other_record_ids, record_ids
+    other_record_ids = set(other_record_ids)
+    return [
+        record_id for record_id in record_ids
+        if record_id in other_record_ids
+    ]
+
+
+class QueryPlan(object):
+    """
+    Steps of a query execution: the first index lookup, intersections with
+    other indexes and filters of the remaining conditions.
+    """
+
+    def __init__(self, steps):
+        self.steps = steps
+
+    def __str__(self):
+        lines = []
+        for step in self.steps:
+            if step.field is None:
+                lines.append('{} all records'.format(step.operation))
+            else:
+                lines.append('{} {} (~{} rows)'.format(
+                    step.operation, step.field, step.estimated_rows
+                ))
+        return '\n'.join(lines)
 
 
 class Storage(object):
-    def __init__(self):
-        self._data = deque()
+    """
+    In-memory record store. Records are dicts, queries are given as field
+    keyword arguments with a value to match or a (low, high) range.
+
+    Records are kept in fixed-size append-only segments and get stable ids in
+    order of insertion. Retention by number of records (max_records) or by
+    age (max_age, measured in values of time_field) drops whole oldest
+    segments, so at least the requested number of records or the records of
+    the requested age are always kept.
+    """
+
+    def __init__(self, segment_size=DEFAULT_SEGMENT_SIZE, max_records=None,
+                 time_field=None, max_age=None):
+        if max_age is not None and time_field is None:
+            raise ValueError('time_field is required for max_age retention')
+
+        self._segment_size = segment_size
+        self._max_records = max_records
+        self._time_field = time_field
+        self._max_age = max_age
+
+        self._segments = collections.deque()
+        # The latest value of time_field in every segment
+        self._segment_times = collections.deque()
+        self._first_id = 0
+        self._next_id = 0
+        self._dropped_since_compaction = 0
         self._indexes = {}
 
+    def __len__(self):
+        return self._next_id - self._first_id
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self._segments)
+
+    @property
+    def first_id(self):
+        return self._first_id
+
+    def record(self, record_id):
+        offset = record_id - self._first_id
+        if not 0 <= offset < len(self):
+            raise KeyError(record_id)
+        segment, offset = divmod(offset, self._segment_size)
+        return self._segments[segment][offset]
+
+    def _add_index(self, index):
+        for record_id, record in enumerate(self, self._first_id):
+            index.index(record[index.field], record_id)
+        self._indexes[index.field] = index
+
     def add_ordered_index(self, field):
-        self._indexes[field] = OrderedIndex()
+        self._add_index(OrderedIndex(field))
 
     def add_unordered_index(self, field):
-        self._indexes[field] = UnorderedIndex()
+        self._add_index(UnorderedIndex(field))
 
     def insert(self, record):
-        for field, index in self._indexes:
-            index.index(record[field], len(self._data))
-        self._data.append(record)
+        if (
+            not self._segments or
+            len(self._segments[-1]) == self._segment_size
+        ):
+            self._segments.append([])
+            self._segment_times.append(None)
 
-    def get(self, **kwargs):
+        record_id = self._next_id
+        self._next_id += 1
+        self._segments[-1].append(record)
+        for field, index in self._indexes.iteritems():
+            index.index(record[field], record_id)
+
+        if self._time_field is not None:
+            time = record[self._time_field]
+            latest_time = self._segment_times[-1]
+            if latest_time is None or latest_time < time:
+                self._segment_times[-1] = time
+        self._apply_retention()
+        return record_id
+
+    def _apply_retention(self):
+        if self._max_records is not None:
+            while (
+                len(self._segments) > 1 and
+                len(self) - len(self._segments[0]) >= self._max_records
+            ):
+                self._drop_segment()
+
+        if self._max_age is not None:
+            relevant_since = self._segment_times[-1] - self._max_age
+            while (
+                len(self._segments) > 1 and
+                self._segment_times[0] < relevant_since
+            ):
+                self._drop_segment()
+
+    def _drop_segment(self):
+        self._segments.popleft()
+        self._segment_times.popleft()
+        self._first_id += self._segment_size
+        self._dropped_since_compaction += self._segment_size
+
+        # Index entries of dropped records are skipped on lookups, clean
+        # them up once they outnumber live ones
+        if self._dropped_since_compaction > len(self):
+            self.compact()
+
+    def compact(self):
+        """
+        Remove index entries of records dropped by retention.
+        """
+        for index in self._indexes.itervalues():
+            index.compact(self._first_id)
+        self._dropped_since_compaction = 0
+
+    def explain(self, **kwargs):
+        """
+        Plan of the query, which get would execute for the same arguments.
+        """
         if not kwargs:
             raise ValueError('Query arguments missing')
-        for field, value in kwargs.iteritems():
-            pass
+
+        # Index counts are cheap, so conditions are sorted by selectivity
+        estimates = sorted(
+            (self._indexes[field].count(condition), field)
+            for field, condition in kwargs.iteritems()
+            if field in self._indexes and
+            self._indexes[field].supports(condition)
+        )
+        indexed_fields = set(field for _, field in estimates)
+        filtered = sorted(
+            field for field in kwargs if field not in indexed_fields
+        )
+
+        if not estimates:
+            steps = [PlanStep('scan', None, len(self))]
+        else:
+            rows, field = estimates[0]
+            steps = [PlanStep('index', field, rows)]
+            for index_rows, field in estimates[1:]:
+                # Intersecting costs reading all ids of the index, filtering
+                # costs checking every candidate left
+                if index_rows * INTERSECT_COST < rows * FILTER_COST:
+                    rows = min(rows, index_rows)
+                    steps.append(PlanStep('intersect', field, rows))
+                else:
+                    filtered.append(field)
+
+        steps.extend(PlanStep('filter', field, None) for field in filtered)
+        return QueryPlan(steps)
+
+    def get(self, **kwargs):
+        plan = self.explain(**kwargs)
+
+        record_ids = None
+        conditions = []
+        for step in plan.steps:
+            if step.operation == 'index':
+                record_ids = self._indexes[step.field].get(
+                    kwargs[step.field], self._first_id
+                )
+            elif step.operation == 'intersect':
+                record_ids = _intersect(
+                    record_ids,
+                    self._indexes[step.field].get(kwargs[step.field],
+                                                  self._first_id)
+                )
+            elif step.operation == 'filter':
+                conditions.append((step.field, kwargs[step.field]))
+
+        if record_ids is None:
+            candidates = self
+        else:
+            candidates = [self.record(record_id) for record_id in record_ids]
+
+        return [
+            record for record in candidates
+            if all(_matches(record[field], condition)
+                   for field, condition in conditions)
+        ]
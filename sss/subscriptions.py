@@ -0,0 +1,103 @@
+"""
+Change notifications of stock prices and the GBCE All Share Index.
+
+Recording a trade only marks its stock as changed. Prices are calculated and
+compared with thresholds of subscriptions when the stock manager publishes
+them, so a burst of trades between two publishes costs at most one
+notification per subscription, and subscriptions of stocks which did not
+change cost nothing.
+"""
+import collections
+
+
+# symbol is None for notifications of the index
+Notification = collections.namedtuple('Notification',
+                                      ('symbol', 'value', 'time'))
+
+# Exception raised by the target of a subscription
+FailedNotification = collections.namedtuple('FailedNotification',
+                                            ('subscription', 'error'))
+
+
+class Subscription(object):
+    """
+    Subscription to a stock price, or to the index if symbol is None.
+
+    target is a callable taking a Notification or a queue with put_nowait,
+    like Queue.Queue. It is called by the thread publishing notifications.
+
+    A value is notified if it differs from the last notified one by more
+    than threshold, or by more than threshold times the last notified value
+    if relative is True. The first value is always notified. A value is held
+    back until min_interval seconds of clock time passed since the last
+    notification, then the latest held value is notified by the next publish.
+    A value the target failed to take is held in the same way.
+    """
+
+    __slots__ = ('_symbol', '_notify', '_threshold', '_relative',
+                 '_min_interval', '_value', '_notified_at', '_held_value')
+
+    def __init__(self, symbol, target, threshold=0.0, relative=False,
+                 min_interval=0.0):
+        if threshold < 0.0:
+            raise ValueError('threshold should not be negative')
+        if min_interval < 0.0:
+            raise ValueError('min_interval should not be negative')
+        notify = getattr(target, 'put_nowait', target)
+        if not callable(notify):
+            raise TypeError('target should be callable or a queue')
+        self._symbol = symbol
+        self._notify = notify
+        self._threshold = float(threshold)
+        self._relative = relative
+        self._min_interval = float(min_interval)
+        self._value = None
+        self._notified_at = None
+        self._held_value = None
+
+    @property
+    def symbol(self):
+        return self._symbol
+
+    @property
+    def value(self):
+        """
+        Last notified value, None if there were no notifications yet.
+        """
+        return self._value
+
+    def offer(self, value, now):
+        """
+        Notify the value if it moved enough since the last notification.
+        Returns True if the value is held back by min_interval. Errors of
+        the target are raised and the value is held.
+        """
+        last_value = self._value
+        if last_value is not None:
+            threshold = self._threshold
+            if self._relative:
+                threshold *= abs(last_value)
+            if not abs(value - last_value) > threshold:
+                self._held_value = None
+                return False
+            if now - self._notified_at < self._min_interval:
+                self._held_value = value
+                return True
+
+        try:
+            self._notify(Notification(self._symbol, value, now))
+        except Exception:
+            self._held_value = value
+            raise
+        self._held_value = None
+        self._value = value
+        self._notified_at = now
+        return False
+
+    def offer_held(self, now):
+        """
+        Same as offer with the value held back by min_interval, if any.
+        """
+        if self._held_value is None:
+            return False
+        return self.offer(self._held_value, now)
@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+"""
+Fixed-width binary trade file for backfill and replay.
+
+Layout, all little-endian:
+
+    header        magic, format version, record size, symbol count,
+                  record count
+    records       timestamp (f8), symbol id (u4), quantity (i4), side (i1),
+                  padding, price (f8); 32 bytes, so fields are aligned
+    symbol table  symbol of every symbol id, 8 bytes each
+
+Symbol table goes after records, so a file is written in one pass. Files
+are read through mmap and, with numpy, records are viewed in place without
+copying them into Python objects.
+"""
+import argparse
+import array
+import collections
+import csv
+import mmap
+import os
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import model
+
+
+MAGIC = 'SSST'
+VERSION = 1
+HEADER = struct.Struct('<4sHHII')
+RECORD = struct.Struct('<dIib7xd')
+SYMBOL = struct.Struct('<8s')
+if numpy is not None:
+    RECORD_DTYPE = numpy.dtype({
+        'names': ['timestamp', 'symbol_id', 'quantity', 'side', 'price'],
+        'formats': ['<f8', '<u4', '<i4', 'i1', '<f8'],
+        'offsets': [0, 8, 12, 16, 24],
+        'itemsize': RECORD.size
+    })
+    # Sides of records as buy_sell values of the batch ingestion path
+    BUY_SELLS = numpy.array([model.TRADE_SELL, model.TRADE_BUY], dtype=object)
+
+SIDES = dict((side, buy_sell)
+             for buy_sell, side in model.TRADE_SIDES.iteritems())
+
+CSV_FIELDS = ('symbol', 'timestamp', 'quantity', 'buy_sell', 'price')
+
+# Number of records ingested at once
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+
+class TradeFileError(Exception):
+    pass
+
+
+def _invalid_record(index):
+    return TradeFileError(
+        'record {} has unknown symbol or side'.format(index)
+    )
+
+
+class TradeFileWriter(object):
+    def __init__(self, path):
+        self._file = open(path, 'wb')
+        self._file.write(HEADER.pack(MAGIC, VERSION, RECORD.size, 0, 0))
+        self._symbol_ids = {}
+        self._count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, symbol, timestamp, quantity, buy_sell, price):
+        try:
+            side = model.TRADE_SIDES[buy_sell]
+        except KeyError:
+            raise TradeFileError(
+                'buy_sell should be one of ({})'.format(
+                    ', '.join(model.TRADE_TYPES)
+                )
+            )
+        symbol_id = self._symbol_ids.get(symbol)
+        new_symbol = symbol_id is None
+        if new_symbol:
+            if len(symbol) > SYMBOL.size:
+                raise TradeFileError(
+                    'symbol "{}" is too long'.format(symbol)
+                )
+            symbol_id = len(self._symbol_ids)
+        # Symbol is registered only once the record is packed
+        record = RECORD.pack(timestamp, symbol_id, quantity, side, price)
+        if new_symbol:
+            self._symbol_ids[symbol] = symbol_id
+        self._file.write(record)
+        self._count += 1
+
+    def close(self):
+        if self._file.closed:
+            return
+        symbols = sorted(self._symbol_ids, key=self._symbol_ids.get)
+        self._file.write(''.join(SYMBOL.pack(symbol) for symbol in symbols))
+        self._file.seek(0)
+        self._file.write(HEADER.pack(MAGIC, VERSION, RECORD.size,
+                                     len(symbols), self._count))
+        self._file.close()
+
+
+class TradeFile(object):
+    """
+    Memory-mapped trade file. Views returned by records are valid until the
+    file is closed.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        if size < HEADER.size:
+            self._file.close()
+            raise TradeFileError('{} is not a trade file'.format(path))
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, record_size, symbol_count, self._count = (
+            HEADER.unpack_from(self._map)
+        )
+        symbols_offset = HEADER.size + self._count * RECORD.size
+        if (
+            magic != MAGIC or record_size != RECORD.size or
+            symbols_offset + symbol_count * SYMBOL.size > size
+        ):
+            self.close()
+            raise TradeFileError('{} is not a trade file'.format(path))
+        if version != VERSION:
+            self.close()
+            raise TradeFileError(
+                'Unsupported trade file version {}'.format(version)
+            )
+
+        self._symbols = [
+            SYMBOL.unpack_from(self._map, offset)[0].rstrip('\0')
+            for offset in xrange(symbols_offset,
+                                 symbols_offset + symbol_count * SYMBOL.size,
+                                 SYMBOL.size)
+        ]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def symbols(self):
+        return list(self._symbols)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def records(self, start=0, stop=None):
+        """
+        Numpy structured array viewing records in [start, stop) in place.
+        """
+        if numpy is None:
+            raise TradeFileError('numpy is required for record views')
+        start, stop, _ = slice(start, stop).indices(self._count)
+        return numpy.frombuffer(self._map, RECORD_DTYPE,
+                                max(stop - start, 0),
+                                HEADER.size + start * RECORD.size)
+
+    def __iter__(self):
+        """
+        (symbol, timestamp, quantity, buy_sell, price) of every record.
+        """
+        for index in xrange(self._count):
+            timestamp, symbol_id, quantity, side, price = RECORD.unpack_from(
+                self._map, HEADER.size + index * RECORD.size
+            )
+            if symbol_id >= len(self._symbols) or side not in SIDES:
+                raise _invalid_record(index)
+            yield (self._symbols[symbol_id], timestamp, quantity,
+                   SIDES[side], price)
+
+    def _chunks_numpy(self, chunk_size):
+        for start in xrange(0, self._count, chunk_size):
+            records = self.records(start, start + chunk_size)
+            symbol_ids = records['symbol_id']
+            sides = records['side']
+            invalid = numpy.flatnonzero(
+                (symbol_ids >= len(self._symbols)) | (sides < 0) | (sides > 1)
+            )
+            if len(invalid):
+                raise _invalid_record(start + invalid[0])
+            # Stable sort keeps trades of every stock in file order
+            order = numpy.argsort(symbol_ids, kind='mergesort')
+            sorted_ids = symbol_ids[order]
+            bounds = numpy.flatnonzero(numpy.diff(sorted_ids)) + 1
+            for indexes in numpy.split(order, bounds):
+                if not len(indexes):
+                    continue
+                yield (
+                    self._symbols[symbol_ids[indexes[0]]],
+                    start + indexes,
+                    (records['timestamp'][indexes],
+                     records['quantity'][indexes],
+                     BUY_SELLS[sides[indexes]],
+                     records['price'][indexes])
+                )
+
+    def _chunks_python(self, chunk_size):
+        rows = collections.defaultdict(list)
+        for index, record in enumerate(self):
+            rows[record[0]].append((index,) + record[1:])
+            if (index + 1) % chunk_size == 0 or index + 1 == self._count:
+                for symbol, symbol_rows in rows.iteritems():
+                    indexes, timestamps, quantities, buy_sells, prices = zip(
+                        *symbol_rows
+                    )
+                    yield (symbol, indexes,
+                           (array.array('d', timestamps), quantities,
+                            buy_sells, array.array('d', prices)))
+                rows.clear()
+
+    def load(self, stock_manager, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Record all trades of the file to stocks of the manager, a chunk of
+        records at a time, trades of every stock of a chunk in one batch.
+        Returns list of RejectedTrade with record indexes.
+        """
+        if numpy is not None:
+            chunks = self._chunks_numpy(chunk_size)
+        else:
+            chunks = self._chunks_python(chunk_size)
+
+        rejected = []
+        for symbol, indexes, columns in chunks:
+            try:
+                stock = stock_manager.get_stock(symbol)
+            except KeyError:
+                error = 'Stock "{}" is not found'.format(symbol)
+                rejected.extend(model.RejectedTrade(int(index), error)
+                                for index in indexes)
+                continue
+            rejected.extend(
+                model.RejectedTrade(int(indexes[trade.index]), trade.error)
+                for trade in stock.record_trade_columns(*columns)
+            )
+
+        rejected.sort()
+        return rejected
+
+
+def convert_csv(csv_path, path):
+    """
+    Convert CSV file with symbol, timestamp, quantity, buy_sell and price
+    columns named in the header to a trade file. Returns number of trades.
+    """
+    with open(csv_path, 'rb') as csv_file, TradeFileWriter(path) as writer:
+        reader = csv.DictReader(csv_file)
+        missing = set(CSV_FIELDS) - set(reader.fieldnames or ())
+        if missing:
+            raise TradeFileError(
+                'CSV file has no {} columns'.format(
+                    ', '.join(sorted(missing))
+                )
+            )
+
+        count = 0
+        for row in reader:
+            try:
+                writer.write(row['symbol'], float(row['timestamp']),
+                             int(row['quantity']), row['buy_sell'],
+                             float(row['price']))
+            except (TypeError, ValueError, struct.error,
+                    TradeFileError) as e:
+                raise TradeFileError('line {}: {}'.format(reader.line_num,
+                                                          e))
+            count += 1
+        return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Convert CSV trades to a binary trade file'
+    )
+    parser.add_argument('csv_path')
+    parser.add_argument('path')
+    args = parser.parse_args(argv)
+
+    print 'Converted {} trades'.format(convert_csv(args.csv_path, args.path))
+
+
+if __name__ == '__main__':
+    main()
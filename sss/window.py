@@ -0,0 +1,460 @@
+import array
+import math
+import operator
+
+
+MIN_CAPACITY = 16
+
+
+class TradeWindow(object):
+    """
+    Time ordered trades stored column-wise in a growable ring buffer.
+
+    Timestamps and prices are kept in `array('d')`, quantities in an integer
+    array and trade side in a byte array. Alongside them cumulative sums of
+    price * quantity and quantity are kept, so sums over any range of trades
+    are a difference of two values, and with binary search over timestamps
+    VWAP over any time range costs O(log n).
+    """
+
+    __slots__ = ('_timestamps', '_quantities', '_sides', '_prices',
+                 '_cumulative_values', '_cumulative_quantities', '_mask',
+                 '_head', '_size', '_first_sequence', '_base_value',
+                 '_base_quantity')
+
+    def __init__(self, capacity=MIN_CAPACITY):
+        capacity = self._round_capacity(capacity)
+        self._timestamps = array.array('d', [0.0]) * capacity
+        self._quantities = array.array('l', [0]) * capacity
+        self._sides = array.array('b', [0]) * capacity
+        self._prices = array.array('d', [0.0]) * capacity
+        # Sums over all trades up to and including the one at the position
+        self._cumulative_values = array.array('d', [0.0]) * capacity
+        self._cumulative_quantities = array.array('d', [0.0]) * capacity
+        self._mask = capacity - 1
+        self._head = 0
+        self._size = 0
+        self._first_sequence = 0
+
+        # Cumulative sums before the first stored trade
+        self._base_value = 0.0
+        self._base_quantity = 0.0
+
+    @staticmethod
+    def _round_capacity(capacity):
+        rounded = MIN_CAPACITY
+        while rounded < capacity:
+            rounded <<= 1
+        return rounded
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError('trade index out of range')
+        position = (self._head + index) & self._mask
+        return (
+            self._timestamps[position],
+            self._quantities[position],
+            self._sides[position],
+            self._prices[position]
+        )
+
+    @property
+    def capacity(self):
+        return self._mask + 1
+
+    @property
+    def first_timestamp(self):
+        if not self._size:
+            return None
+        return self._timestamps[self._head]
+
+    @property
+    def last_timestamp(self):
+        if not self._size:
+            return None
+        return self._timestamps[(self._head + self._size - 1) & self._mask]
+
+    @property
+    def first_sequence(self):
+        """
+        Sequence number of the first stored trade. Trades are numbered in
+        order of recording, starting from 0.
+        """
+        return self._first_sequence
+
+    @property
+    def vwap(self):
+        return self.vwap_between(0, self._size)
+
+    def timestamp_at(self, index):
+        return self._timestamps[(self._head + index) & self._mask]
+
+    def _cumulative_sums(self, index):
+        """
+        Sums over trades before the one with the given index.
+        """
+        if not index:
+            return self._base_value, self._base_quantity
+        position = (self._head + index - 1) & self._mask
+        return (
+            self._cumulative_values[position],
+            self._cumulative_quantities[position]
+        )
+
+    def vwap_between(self, start, stop):
+        """
+        VWAP of trades with indexes in [start, stop).
+        """
+        if start >= stop:
+            return 0.0
+        start_value, start_quantity = self._cumulative_sums(start)
+        stop_value, stop_quantity = self._cumulative_sums(stop)
+        return (stop_value - start_value) / (stop_quantity - start_quantity)
+
+    def vwap_since(self, since, until=None):
+        """
+        VWAP of trades with timestamps in [since, until]. until=None means
+        no upper bound.
+        """
+        start = self.bisect_left(since)
+        stop = self._size if until is None else self.bisect_right(until)
+        return self.vwap_between(start, stop)
+
+    def append(self, timestamp, quantity, side, price):
+        if self._size > self._mask:
+            self._resize(self.capacity << 1)
+
+        value, total_quantity = self._cumulative_sums(self._size)
+        position = (self._head + self._size) & self._mask
+        self._timestamps[position] = timestamp
+        self._quantities[position] = quantity
+        self._sides[position] = side
+        self._prices[position] = price
+        self._cumulative_values[position] = value + quantity * price
+        self._cumulative_quantities[position] = total_quantity + quantity
+        self._size += 1
+
+    def insert(self, timestamp, quantity, side, price):
+        """
+        Insert a trade in time order, after trades with the same timestamp.
+        Returns index of the trade.
+
+        Trades after it are moved and their cumulative sums recalculated, so
+        the cost is O(k) for k newer trades, which is small for trades late
+        by a short time.
+        """
+        index = self.bisect_right(timestamp)
+        if index == self._size:
+            self.append(timestamp, quantity, side, price)
+            return index
+
+        if self._size > self._mask:
+            self._resize(self.capacity << 1)
+        head = self._head
+        mask = self._mask
+        columns = (self._timestamps, self._quantities, self._sides,
+                   self._prices)
+        for moved in xrange(self._size, index, -1):
+            target = (head + moved) & mask
+            source = (head + moved - 1) & mask
+            for column in columns:
+                column[target] = column[source]
+        position = (head + index) & mask
+        self._timestamps[position] = timestamp
+        self._quantities[position] = quantity
+        self._sides[position] = side
+        self._prices[position] = price
+        self._size += 1
+        self._accumulate(index, self._size)
+        return index
+
+    def extend(self, timestamps, quantities, sides, prices):
+        """
+        Append trades given as typed arrays of the same types as columns.
+        """
+        count = len(timestamps)
+        if not count:
+            return
+        if self._size + count > self.capacity:
+            self._resize(self._round_capacity(self._size + count))
+
+        segments = self._segments(self._size, self._size + count)
+        offset = 0
+        for start, stop in segments:
+            chunk = slice(offset, offset + stop - start)
+            self._timestamps[start:stop] = timestamps[chunk]
+            self._quantities[start:stop] = quantities[chunk]
+            self._sides[start:stop] = sides[chunk]
+            self._prices[start:stop] = prices[chunk]
+            offset = chunk.stop
+
+        self._accumulate(self._size, self._size + count)
+        self._size += count
+
+    def _accumulate(self, start, stop):
+        """
+        Calculate cumulative sums for trades with indexes in [start, stop).
+        """
+        value, total_quantity = self._cumulative_sums(start)
+        cumulative_values = self._cumulative_values
+        cumulative_quantities = self._cumulative_quantities
+        quantities = self._quantities
+        prices = self._prices
+        for segment_start, segment_stop in self._segments(start, stop):
+            for position in xrange(segment_start, segment_stop):
+                quantity = quantities[position]
+                value += quantity * prices[position]
+                total_quantity += quantity
+                cumulative_values[position] = value
+                cumulative_quantities[position] = total_quantity
+
+    def evict_before(self, timestamp):
+        """
+        Drop all trades older than timestamp. Returns number of dropped trades.
+        """
+        if not self._size or self._timestamps[self._head] >= timestamp:
+            return 0
+
+        count = self.bisect_left(timestamp)
+        if count == self._size:
+            self.clear()
+            return count
+
+        self._base_value, self._base_quantity = self._cumulative_sums(count)
+        self._head = (self._head + count) & self._mask
+        self._size -= count
+        self._first_sequence += count
+
+        last_value, _ = self._cumulative_sums(self._size)
+        if not self._base_value <= last_value - self._base_value:
+            # Difference of cumulative sums loses precision once they are
+            # much greater than sums of stored trades, so recalculate them.
+            # That happens about once per window turnover, so amortized cost
+            # per trade stays constant.
+            self._base_value = self._base_quantity = 0.0
+            self._accumulate(0, self._size)
+
+        if self._size <= self.capacity >> 2 and self.capacity > MIN_CAPACITY:
+            self._resize(self._round_capacity(self._size << 1))
+
+        return count
+
+    def clear(self):
+        self._first_sequence += self._size
+        self._head = 0
+        self._size = 0
+        self._base_value = 0.0
+        self._base_quantity = 0.0
+        if self.capacity > MIN_CAPACITY:
+            self._resize(MIN_CAPACITY)
+
+    def bisect_left(self, timestamp, low=0, high=None):
+        """
+        Index of the first trade with timestamp not less than the given one.
+        """
+        timestamps = self._timestamps
+        head = self._head
+        mask = self._mask
+        if high is None:
+            high = self._size
+        while low < high:
+            middle = (low + high) >> 1
+            if timestamps[(head + middle) & mask] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def advance(self, sequence, since):
+        """
+        Sequence number of the first trade with timestamp not less than since,
+        searching forward from the trade with the given sequence number.
+
+        Moving a cursor forward this way costs O(log k) for k passed trades,
+        so cursors of several time windows can follow the current time over
+        the same trades.
+        """
+        index = min(max(sequence - self._first_sequence, 0), self._size)
+        if index and self.timestamp_at(index - 1) >= since:
+            # The cursor is ahead already, e.g. when time goes backwards
+            return self.bisect_left(since, 0, index) + self._first_sequence
+
+        # Exponential search for the upper bound, then binary search
+        step = 1
+        high = index
+        while high < self._size and self.timestamp_at(high) < since:
+            index = high + 1
+            high = index + step
+            step <<= 1
+        return (
+            self.bisect_left(since, index, min(high, self._size)) +
+            self._first_sequence
+        )
+
+    def add_sums(self, start, stop, value=0.0, quantity=0):
+        """
+        Add price * quantity and quantity of trades with sequence numbers in
+        [start, stop) to the given sums, one trade after another.
+        """
+        for first, last in self._segments(start - self._first_sequence,
+                                          stop - self._first_sequence):
+            quantities = self._quantities[first:last]
+            value = sum(map(operator.mul, self._prices[first:last],
+                            quantities), value)
+            quantity += sum(quantities)
+        return value, quantity
+
+    def exact_sums(self, start, stop):
+        """
+        Correctly rounded sums of price * quantity and quantity of trades with
+        sequence numbers in [start, stop).
+        """
+        values = []
+        quantity = 0
+        for first, last in self._segments(start - self._first_sequence,
+                                          stop - self._first_sequence):
+            quantities = self._quantities[first:last]
+            values.extend(map(operator.mul, self._prices[first:last],
+                              quantities))
+            quantity += sum(quantities)
+        return math.fsum(values), quantity
+
+    def bisect_right(self, timestamp):
+        """
+        Index of the first trade with timestamp greater than the given one.
+        """
+        timestamps = self._timestamps
+        head = self._head
+        mask = self._mask
+        low, high = 0, self._size
+        while low < high:
+            middle = (low + high) >> 1
+            if timestamp < timestamps[(head + middle) & mask]:
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+    def _segments(self, start, stop):
+        """
+        Physical (start, stop) ranges of the logical range of trades.
+        """
+        if start >= stop:
+            return []
+        capacity = self.capacity
+        first = (self._head + start) & self._mask
+        last = first + stop - start
+        if last <= capacity:
+            return [(first, last)]
+        return [(first, capacity), (0, last - capacity)]
+
+    def _resize(self, capacity):
+        segments = self._segments(0, self._size)
+        for name in ('_timestamps', '_quantities', '_sides', '_prices',
+                     '_cumulative_values', '_cumulative_quantities'):
+            column = getattr(self, name)
+            resized = column[:0]
+            for start, stop in segments:
+                resized.extend(column[start:stop])
+            resized.extend(column[:1] * (capacity - self._size))
+            setattr(self, name, resized)
+        self._mask = capacity - 1
+        self._head = 0
+
+
+class TimeWindow(object):
+    """
+    Running sums over trades of a trade window which are not older than
+    length seconds.
+
+    Trades are added to the sums and the window start moves forward over the
+    shared trade window lazily, when the window is advanced to the current
+    time, so several time windows cost nothing on trade recording.
+    """
+
+    __slots__ = ('_trades', '_length', '_start', '_stop', '_value',
+                 '_quantity', '_evicted_value')
+
+    def __init__(self, trades, length):
+        self._trades = trades
+        self._length = length
+        # Sums are over trades with sequence numbers in [start, stop)
+        self._start = self._stop = trades.first_sequence + len(trades)
+        self._value = 0.0
+        self._quantity = 0
+        self._evicted_value = 0.0
+
+    @property
+    def length(self):
+        return self._length
+
+    @property
+    def price(self):
+        if not self._quantity:
+            return 0.0
+        return self._value / self._quantity
+
+    def insert(self, sequence, value, quantity):
+        """
+        Account for a trade with price * quantity value inserted into the
+        trade window with the given sequence number, which moves later trades
+        one number up.
+        """
+        if sequence >= self._stop:
+            # Not summed yet, the next advance adds it
+            return
+        self._stop += 1
+        if sequence > self._start:
+            # Trades before it are inside the window, so it is too
+            self._value += value
+            self._quantity += quantity
+        else:
+            # Taken as older than the window, the next advance finds it by
+            # the time going backwards check if it is not
+            self._start += 1
+
+    def advance(self, now):
+        trades = self._trades
+        stop = trades.first_sequence + len(trades)
+        if self._start < trades.first_sequence:
+            # Trades were dropped before the window passed them
+            self._start = self._stop = trades.first_sequence
+            self._value = 0.0
+            self._quantity = 0
+            self._evicted_value = 0.0
+
+        if self._stop < stop:
+            self._value, self._quantity = trades.add_sums(
+                self._stop, stop, self._value, self._quantity
+            )
+            self._stop = stop
+
+        start = trades.advance(self._start, now - self._length)
+        if start == stop:
+            self._value = 0.0
+            self._quantity = 0
+            self._evicted_value = 0.0
+        elif start > self._start:
+            evicted_value, evicted_quantity = trades.exact_sums(self._start,
+                                                                start)
+            self._value -= evicted_value
+            self._quantity -= evicted_quantity
+            self._evicted_value += evicted_value
+            if not self._evicted_value <= self._value:
+                # Subtracting more than what is left loses precision of
+                # running sum, so recalculate it. That happens about once per
+                # window turnover, so amortized cost per trade stays constant.
+                # A running sum left NaN by an overflowed value is
+                # recalculated too.
+                self._value, self._quantity = trades.exact_sums(start, stop)
+                self._evicted_value = 0.0
+        elif start < self._start:
+            # Time went backwards
+            self._value, self._quantity = trades.exact_sums(start, stop)
+            self._evicted_value = 0.0
+        self._start = start
@@ -0,0 +1,8 @@
+from sss import clock
+
+import pytest
+
+
+@pytest.fixture
+def simulated_clock():
+    return clock.SimulatedClock(1000.0)
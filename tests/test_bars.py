@@ -0,0 +1,113 @@
+import collections
+import math
+
+from sss import bars
+from sss import model
+
+import hypothesis
+import hypothesis.strategies as hs
+import pytest
+
+
+def expected_bars(trades, length):
+    trades_by_start = collections.OrderedDict()
+    for timestamp, quantity, price in trades:
+        start = math.floor(timestamp / length) * length
+        trades_by_start.setdefault(start, []).append((quantity, price))
+
+    result = []
+    for start, bucket in trades_by_start.iteritems():
+        prices = [price for _, price in bucket]
+        volume = sum(quantity for quantity, _ in bucket)
+        result.append(bars.Bar(
+            start, prices[0], max(prices), min(prices), prices[-1], volume,
+            sum(quantity * price for quantity, price in bucket) / volume,
+            len(bucket)
+        ))
+    return result
+
+
+@hypothesis.given(
+    trades=hs.lists(hs.tuples(hs.floats(min_value=0.0, max_value=1e4),
+                              hs.integers(min_value=1, max_value=1000),
+                              hs.floats(min_value=0.01, max_value=1e6))),
+    length=hs.sampled_from(bars.DEFAULT_BAR_LENGTHS),
+    history=hs.integers(min_value=1, max_value=10),
+    count=hs.integers(min_value=0, max_value=20)
+)
+def test_bar_builder_matches_bars_of_trades(trades, length, history, count):
+    trades.sort(key=lambda trade: trade[0])
+    bar_builder = bars.BarBuilder(length, history)
+
+    for index, (timestamp, quantity, price) in enumerate(trades):
+        if index % 2:
+            bar_builder.add(timestamp, quantity, price)
+        else:
+            bar_builder.extend([timestamp], [quantity], [price])
+
+    expected = expected_bars(trades, length)[-(history + 1):]
+    assert len(expected) == len(bar_builder)
+    last_bars = bar_builder.last_bars(count)
+    expected = expected[-count:] if count else []
+    assert len(expected) == len(last_bars)
+    for expected_bar, bar in zip(expected, last_bars):
+        assert expected_bar[:6] == bar[:6]
+        assert expected_bar.vwap == pytest.approx(bar.vwap)
+        assert expected_bar.trade_count == bar.trade_count
+
+
+def test_bar_builder_rejects_invalid_settings():
+    with pytest.raises(ValueError):
+        bars.BarBuilder(0.0)
+    with pytest.raises(ValueError):
+        bars.BarBuilder(1.0, history=0)
+
+
+def test_stock_bars():
+    stock_manager = model.StockManager()
+    stock_manager.add_stock(model.Stock(
+        'TEA', model.TYPE_COMMON, 1.0, None, 100.0,
+        bar_lengths=(bars.BAR_1M, bars.BAR_1S), bar_history=2
+    ))
+    stock_manager.add_stock(model.Stock('POP', model.TYPE_COMMON, 1.0, None,
+                                        100.0, bar_lengths=(bars.BAR_1M,)))
+    tea = stock_manager.get_stock('TEA')
+
+    assert [] == tea.bars(bars.BAR_1M, 10)
+    tea.record_trade(60.5, 2, model.TRADE_BUY, 10.0)
+    tea.record_trades([(61.0, 1, model.TRADE_SELL, 40.0),
+                       (119.0, 1, model.TRADE_BUY, 5.0),
+                       (120.0, 3, model.TRADE_BUY, 20.0)])
+    stock_manager.record_batch([('TEA', 300.0, 1, model.TRADE_SELL, 7.0)])
+
+    assert [
+        bars.Bar(60.0, 10.0, 40.0, 5.0, 5.0, 4, 16.25, 3),
+        bars.Bar(120.0, 20.0, 20.0, 20.0, 20.0, 3, 20.0, 1),
+        bars.Bar(300.0, 7.0, 7.0, 7.0, 7.0, 1, 7.0, 1),
+    ] == tea.bars(bars.BAR_1M, 10)
+    assert [119.0, 120.0, 300.0] == [
+        bar.start for bar in tea.bars(bars.BAR_1S, 10)
+    ]
+    assert {'TEA': tea.bars(bars.BAR_1M, 2), 'POP': []} == (
+        stock_manager.bars(bars.BAR_1M, 2)
+    )
+    with pytest.raises(model.StockError):
+        tea.bars(bars.BAR_5M, 1)
+
+
+def test_bar_builder_merges_late_trades():
+    bar_builder = bars.BarBuilder(bars.BAR_1M)
+    bar_builder.add(30.0, 1, 10.0)
+    bar_builder.add(190.0, 1, 30.0)
+
+    assert bar_builder.insert(185.0, 1, 25.0)
+    assert bar_builder.insert(181.0, 1, 5.0)
+    assert bar_builder.insert(59.0, 2, 40.0)
+    assert bar_builder.insert(130.0, 1, 20.0)
+    assert bar_builder.insert(125.0, 3, 4.0)
+    assert not bar_builder.insert(70.0, 1, 5.0)
+    assert [
+        bars.Bar(0.0, 10.0, 40.0, 10.0, 10.0, 3, 30.0, 2),
+        bars.Bar(120.0, 20.0, 20.0, 4.0, 20.0, 4, 8.0, 2),
+        bars.Bar(180.0, 5.0, 30.0, 5.0, 30.0, 3, 20.0, 3),
+    ] == bar_builder.last_bars(10)
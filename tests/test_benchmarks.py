@@ -0,0 +1,32 @@
+from benchmarks import bench
+
+
+def test_compare_flags_regressions():
+    baseline = {'results': {'stock_price[10]': 1e-6, 'pe_ratio[10]': 2e-6,
+                            'removed': 1e-6}}
+    current = {'results': {'stock_price[10]': 1.5e-6, 'pe_ratio[10]': 2e-6,
+                           'added': 1e-6}}
+
+    assert [
+        bench.Comparison('stock_price[10]', 1e-6, 1.5e-6, 1.5, True),
+        bench.Comparison('pe_ratio[10]', 2e-6, 2e-6, 1.0, False),
+    ] == sorted(bench.compare(baseline, current), reverse=True)
+
+
+def test_run_selected_benchmark():
+    results = bench.run(quick=True, selected=['bench_record_trade'])['results']
+
+    assert [
+        'record_trade', 'record_trade_trusted', 'record_trade_columns[1000]',
+        'record_trade_columns_trusted[1000]'
+    ] == list(results)
+    assert all(value > 0.0 for value in results.values())
+
+
+def test_memory_benchmark_reports_bytes_per_stock():
+    results = bench.bench_memory(quick=True)
+
+    size = bench.QUICK_MEMORY_UNIVERSE_SIZE
+    idle = results['memory_idle_stock[{}]'.format(size)]
+    assert 0.0 < idle < results['memory_traded_stock[{}]'.format(size)]
+    assert idle == results['memory_evicted_stock[{}]'.format(size)]
@@ -0,0 +1,74 @@
+from sss import clock
+from sss import compact
+from sss import model
+
+import mock
+import pytest
+
+
+def test_wall_clock():
+    with mock.patch('time.time', return_value=123.0):
+        assert 123.0 == clock.WALL_CLOCK.now()
+        clock.WALL_CLOCK.observe(200.0)
+        assert 123.0 == clock.WALL_CLOCK.now()
+
+
+def test_simulated_clock():
+    simulated_clock = clock.SimulatedClock(10.0)
+    simulated_clock.observe(20.0)
+    assert 10.0 == simulated_clock.now()
+
+    simulated_clock.advance(5.0)
+    assert 15.0 == simulated_clock.now()
+    simulated_clock.set(1.0)
+    assert 1.0 == simulated_clock.now()
+
+
+def test_event_clock_follows_latest_trade():
+    event_clock = clock.EventClock()
+    assert 0.0 == event_clock.now()
+
+    event_clock.observe(20.0)
+    event_clock.observe(15.0)
+    assert 20.0 == event_clock.now()
+
+
+def test_stock_manager_at_event_time():
+    event_clock = clock.EventClock()
+    stock_manager = model.StockManager(clock=event_clock)
+    tea = model.Stock('TEA', model.TYPE_COMMON, 1.0, None, 100.0,
+                      trades_cache_decay_time=60.0)
+    pop = model.Stock('POP', model.TYPE_COMMON, 1.0, None, 100.0,
+                      trades_cache_decay_time=60.0)
+    for stock in (tea, pop):
+        stock_manager.add_stock(stock)
+        assert event_clock is stock.clock
+
+    tea.record_trade(1000.0, 1, model.TRADE_BUY, 4.0)
+    stock_manager.record_batch([('POP', 1010.0, 1, model.TRADE_BUY, 9.0)])
+    assert 1010.0 == event_clock.now()
+    assert 6.0 == pytest.approx(stock_manager.all_share_index)
+
+    pop.record_trade_columns([1070.0], [1], [model.TRADE_SELL], [16.0])
+    assert 0.0 == tea.stock_price
+    assert 12.5 == pytest.approx(stock_manager.all_share_index)
+
+    stock_manager.set_clock(None)
+    assert clock.WALL_CLOCK is tea.clock
+    with mock.patch('time.time', return_value=1075.0):
+        assert 16.0 == pytest.approx(stock_manager.all_share_index)
+
+
+def test_compact_manager_at_simulated_time():
+    simulated_clock = clock.SimulatedClock(100.0)
+    compact_manager = compact.CompactStockManager(10.0, simulated_clock)
+    compact_manager.add_stock(model.Stock('TEA', model.TYPE_COMMON, 1.0,
+                                          None, 100.0))
+    tea = compact_manager.get_stock('TEA')
+    assert simulated_clock is tea.clock
+
+    tea.record_trade(95.0, 1, model.TRADE_BUY, 2.0)
+    assert 2.0 == tea.stock_price
+    simulated_clock.advance(10.0)
+    assert 0.0 == tea.stock_price
+    assert 0.0 == compact_manager.all_share_index
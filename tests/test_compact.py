@@ -0,0 +1,105 @@
+from sss import compact
+from sss import model
+
+import hypothesis
+import hypothesis.strategies as hs
+import mock
+import pytest
+
+SYMBOLS = ('TEA', 'POP', 'ALE', 'GIN')
+
+trade_strategy = hs.tuples(
+    hs.sampled_from(SYMBOLS),
+    hs.floats(min_value=0.0, max_value=1000.0),
+    hs.integers(min_value=1, max_value=model.MAX_TRADE_QUANTITY),
+    hs.sampled_from(model.TRADE_TYPES),
+    hs.floats(min_value=0.01, max_value=1e6)
+)
+
+
+def build_managers(decay_time=100.0):
+    stock_manager = model.StockManager()
+    compact_manager = compact.CompactStockManager(decay_time)
+    for symbol in SYMBOLS:
+        stock_type = model.TYPE_PREFERRED if symbol == 'GIN' else (
+            model.TYPE_COMMON
+        )
+        stock = model.Stock(symbol, stock_type, 8, 2, 100,
+                            trades_cache_decay_time=decay_time)
+        stock_manager.add_stock(stock)
+        compact_manager.add_stock(stock)
+    return stock_manager, compact_manager
+
+
+@hypothesis.given(
+    steps=hs.lists(hs.tuples(hs.lists(trade_strategy, max_size=20),
+                             hs.floats(min_value=0.0, max_value=1100.0)),
+                   min_size=1)
+)
+def test_compact_manager_matches_stock_manager(steps):
+    stock_manager, compact_manager = build_managers()
+
+    for trades, now in steps:
+        with mock.patch('time.time', return_value=now):
+            assert (
+                stock_manager.record_batch(trades) ==
+                compact_manager.record_batch(trades)
+            )
+            assert (
+                stock_manager.all_share_index ==
+                pytest.approx(compact_manager.all_share_index)
+            )
+            assert (
+                stock_manager.all_share_index_terms() ==
+                pytest.approx(compact_manager.all_share_index_terms())
+            )
+            for symbol in SYMBOLS:
+                snapshot = stock_manager.get_stock(symbol).snapshot()
+                compact_snapshot = compact_manager.get_stock(
+                    symbol
+                ).snapshot()
+                assert symbol == compact_snapshot.symbol
+                assert (
+                    snapshot[1:] == pytest.approx(compact_snapshot[1:])
+                )
+
+
+def test_compact_stock_view():
+    _, compact_manager = build_managers(decay_time=10.0)
+    gin = compact_manager.get_stock('GIN')
+
+    with mock.patch('time.time', return_value=100.0):
+        gin.record_trade(85.0, 1, model.TRADE_BUY, 1.0)
+        gin.record_trade(95.0, 2, model.TRADE_SELL, 10.0)
+        assert [1] == [
+            trade.index for trade in gin.record_trades([
+                (96.0, 2, model.TRADE_BUY, 40.0),
+                (94.0, 1, model.TRADE_BUY, 1.0),
+            ])
+        ]
+        with pytest.raises(model.ValidationError):
+            gin.record_trade(90.0, 1, model.TRADE_BUY, 1.0)
+
+        assert 'GIN' == gin.symbol
+        assert model.TYPE_PREFERRED == gin.stock_type
+        assert 0.02 == gin.fixed_dividend
+        assert 25.0 == gin.stock_price
+        assert 2 == gin.trade_count
+        assert compact_manager.get_stock('GIN') == gin
+        assert compact_manager.get_stock('TEA').fixed_dividend is None
+        assert 25.0 == pytest.approx(compact_manager.all_share_index)
+    with pytest.raises(KeyError):
+        compact_manager.get_stock('JOE')
+
+
+def test_compact_manager_reuses_trade_slots():
+    _, compact_manager = build_managers(decay_time=10.0)
+    tea = compact_manager.get_stock('TEA')
+
+    for timestamp in range(1000):
+        with mock.patch('time.time', return_value=float(timestamp)):
+            tea.record_trade(float(timestamp), 1, model.TRADE_BUY, 2.0)
+            assert 2.0 == tea.stock_price
+
+    assert 11 == tea.trade_count
+    assert len(compact_manager._trade_timestamps) <= 12
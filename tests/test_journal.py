@@ -0,0 +1,129 @@
+import os
+import tempfile
+import time
+
+from sss import clock
+from sss import journal
+from sss import model
+
+import mock
+import pytest
+
+
+@pytest.fixture
+def journal_path():
+    return os.path.join(tempfile.mkdtemp(), 'trades.journal')
+
+
+@pytest.fixture(params=['python', 'numpy'])
+def replay_reader(request):
+    if request.param == 'python':
+        with mock.patch.object(journal, 'numpy', None):
+            yield
+    else:
+        pytest.importorskip('numpy')
+        yield
+
+
+def build_manager(**kwargs):
+    stock_manager = model.StockManager(**kwargs)
+    stock_manager.add_stock(model.Stock('TEA', model.TYPE_COMMON, 1, None,
+                                        100, trades_cache_decay_time=10))
+    stock_manager.add_stock(model.Stock('POP', model.TYPE_COMMON, 1, None,
+                                        100, trades_cache_decay_time=100))
+    return stock_manager
+
+
+def test_journal_replays_trades_inside_decay_window(journal_path,
+                                                    replay_reader):
+    trade_journal = journal.TradeJournal(journal_path, sync_every=3)
+    stock_manager = build_manager(journal=trade_journal)
+    with mock.patch('time.time', return_value=1000.0):
+        tea = stock_manager.get_stock('TEA')
+        pop = stock_manager.get_stock('POP')
+        tea.record_trade(900.0, 1, model.TRADE_BUY, 1.0)
+        pop.record_trade(950.0, 1, model.TRADE_BUY, 2.0)
+        tea.record_trade(995.0, 2, model.TRADE_SELL, 3.0)
+        pop.record_trades([(996.0, 1, model.TRADE_BUY, 4.0),
+                           (997.0, 1, model.TRADE_BUY, 0.0)])
+        stock_manager.record_batch([('TEA', 998.0, 2, model.TRADE_BUY, 5.0)])
+        trade_journal.close()
+
+        restored_manager = build_manager()
+        replayed = journal.replay(journal_path, restored_manager)
+
+        assert 4 == replayed
+        assert 4.0 == restored_manager.get_stock('TEA').stock_price
+        assert 3.0 == restored_manager.get_stock('POP').stock_price
+        assert (
+            stock_manager.all_share_index ==
+            restored_manager.all_share_index
+        )
+
+
+def test_journal_group_commit(journal_path):
+    trade_journal = journal.TradeJournal(journal_path, sync_every=2,
+                                         sync_interval=60.0)
+    with mock.patch('os.fsync') as fsync:
+        trade_journal.append('TEA', 1.0, 1, 1, 1.0)
+        assert not fsync.called
+        trade_journal.append('TEA', 2.0, 1, 1, 1.0)
+        assert 1 == fsync.call_count
+        trade_journal.append('TEA', 3.0, 1, 1, 1.0)
+        trade_journal.close()
+        assert 2 == fsync.call_count
+
+
+def test_journal_syncs_idle_trades(journal_path):
+    trade_journal = journal.TradeJournal(journal_path, sync_interval=0.05)
+    for index in xrange(10):
+        trade_journal.append('TEA', float(index), 1, 1, 1.0)
+
+    expected_size = journal.HEADER.size + 10 * journal.RECORD.size
+    deadline = time.time() + 5.0
+    while (os.path.getsize(journal_path) < expected_size and
+           time.time() < deadline):
+        time.sleep(0.01)
+    assert expected_size == os.path.getsize(journal_path)
+    trade_journal.close()
+
+
+def test_journal_replays_tail_at_manager_time(journal_path, replay_reader):
+    trade_journal = journal.TradeJournal(journal_path)
+    for timestamp in xrange(0, 1000, 10):
+        trade_journal.append('TEA', float(timestamp), 1, 1, timestamp / 10.0)
+    trade_journal.close()
+
+    stock_manager = build_manager(clock=clock.SimulatedClock(995.0))
+    with mock.patch.object(journal, 'REPLAY_CHUNK_SIZE', 3):
+        assert 1 == journal.replay(journal_path, stock_manager)
+    assert 99.0 == stock_manager.get_stock('TEA').stock_price
+
+
+def test_journal_drops_partial_record(journal_path, replay_reader):
+    trade_journal = journal.TradeJournal(journal_path)
+    trade_journal.append('TEA', 1.0, 1, 1, 2.0)
+    trade_journal.close()
+    with open(journal_path, 'ab') as journal_file:
+        journal_file.write('\1\2\3')
+
+    trade_journal = journal.TradeJournal(journal_path)
+    trade_journal.append('TEA', 2.0, 3, 1, 4.0)
+    trade_journal.close()
+
+    stock_manager = build_manager()
+    assert 2 == journal.replay(journal_path, stock_manager, now=2.0)
+    assert (
+        [(1.0, 1, 1, 2.0), (2.0, 3, 1, 4.0)] ==
+        list(stock_manager.get_stock('TEA')._trades)
+    )
+
+
+def test_journal_rejects_other_files(journal_path):
+    with open(journal_path, 'wb') as journal_file:
+        journal_file.write('not a journal')
+
+    with pytest.raises(journal.JournalError):
+        journal.TradeJournal(journal_path)
+    with pytest.raises(journal.JournalError):
+        journal.replay(journal_path, build_manager())
@@ -1,8 +1,11 @@
 import math
 import string
+import threading
 import time
 
+from sss import clock
 from sss import model
+from sss import stats
 
 import hypothesis
 import hypothesis.strategies as hs
@@ -21,6 +24,9 @@ par_value_strategy = hs.floats(min_value=0.0, allow_infinity=False)
 stock_price_strategy = hs.floats(min_value=0.0, allow_infinity=False)
 dividend_yield_strategy = hs.floats(min_value=0.0, allow_infinity=False)
 
+# Time of the simulated_clock fixture, used by stocks of stock_factory
+NOW = 1000.0
+
 # Trade data generation strategies
 timestamp_strategy = hs.floats(min_value=0.0, allow_infinity=False)
 old_timestamp_strategy = (
@@ -29,14 +35,11 @@ old_timestamp_strategy = (
     )
 )
 
-# Error margin for possible test duration
-ERROR_MARGIN = 4.0
 new_timestamp_strategy = (
-    lambda now, decay: hs.floats(
-        min_value=now - decay + ERROR_MARGIN, max_value=now
-    )
+    lambda now, decay: hs.floats(min_value=now - decay, max_value=now)
 )
-quantity_strategy = hs.integers(min_value=1)
+quantity_strategy = hs.integers(min_value=1,
+                                max_value=model.MAX_TRADE_QUANTITY)
 buy_sell_strategy = hs.one_of(
     hs.just(model.TRADE_BUY),
     hs.just(model.TRADE_SELL)
@@ -50,7 +53,7 @@ trade_data_strategy = hs.tuples(
 
 
 @pytest.fixture
-def stock_factory():
+def stock_factory(simulated_clock):
     def build_stock():
         return model.Stock(
             symbol_strategy.example(),
@@ -59,7 +62,8 @@ def stock_factory():
             stock_type_strategy.filter(lambda v: v > 0.01).example(),
             last_dividend_strategy.filter(lambda v: v > 0.01).example(),
             fixed_dividend_strategy.filter(lambda v: v > 0.01).example(),
-            par_value_strategy.filter(lambda v: v > 0.01).example()
+            par_value_strategy.filter(lambda v: v > 0.01).example(),
+            clock=simulated_clock
         )
     return build_stock
 
@@ -69,7 +73,7 @@ def trade_factory():
     def build_trade():
         return (
             new_timestamp_strategy(
-                time.time(), model.DEFAULT_TRADE_DECAY_TIME
+                NOW, model.DEFAULT_TRADE_DECAY_TIME
             ).example(),
             trade_data_strategy.example()
         )
@@ -157,6 +161,8 @@ def test_stock_creation_invalid_stock_type_fails(symbol, stock_type, last_divide
     stock_type=stock_type_strategy,
     last_dividend=hs.one_of(
         hs.floats(max_value=0.0).filter(lambda v: v < 0.0),
+        hs.just(float('nan')),
+        hs.just(float('inf')),
         hs.text(string.ascii_letters)
     ),
     fixed_dividend=fixed_dividend_strategy,
@@ -177,6 +183,7 @@ def test_stock_creation_invalid_last_dividend_fails(
     fixed_dividend=hs.one_of(
         hs.floats(max_value=0.0).filter(lambda v: v < 0.0),
         hs.floats(min_value=100.0).filter(lambda v: v > 100.0),
+        hs.just(float('nan')),
         hs.text(string.ascii_letters)
     ),
     par_value=par_value_strategy
@@ -196,6 +203,8 @@ def test_stock_creation_invalid_fixed_dividend_fails(
     fixed_dividend=fixed_dividend_strategy,
     par_value=hs.one_of(
         hs.floats(max_value=0.0).filter(lambda v: v < 0.0),
+        hs.just(float('nan')),
+        hs.just(float('inf')),
         hs.text(string.ascii_letters)
     )
 )
@@ -294,31 +303,57 @@ def test_preferred_stock_dividend_yield_success(
     last_dividend=last_dividend_strategy,
     fixed_dividend=fixed_dividend_strategy,
     par_value=par_value_strategy,
-    stock_price=stock_price_strategy,
-    dividend_yield=dividend_yield_strategy
+    stock_price=stock_price_strategy
 )
 def test_stock_pe_ratio_success(
-    symbol, stock_type, last_dividend, fixed_dividend, par_value, stock_price,
-    dividend_yield
+    symbol, stock_type, last_dividend, fixed_dividend, par_value, stock_price
 ):
+    dividend_yield = (
+        0.0
+        if not stock_price else
+        fixed_dividend / 100.0 * par_value / stock_price
+    )
     expected_pe_ratio = (
         0.0 if not dividend_yield else stock_price / dividend_yield
     )
-    with \
-            mock.patch.object(
-                model.Stock, 'stock_price', new_callable=mock.PropertyMock
-            ) as stock_price_mock, \
-            mock.patch.object(
-                model.Stock, 'dividend_yield', new_callable=mock.PropertyMock
-            ) as dividend_yield_mock:
+    with mock.patch.object(model.Stock, 'stock_price',
+                           new_callable=mock.PropertyMock) as stock_price_mock:
         stock_price_mock.return_value = stock_price
-        dividend_yield_mock.return_value = dividend_yield
         stock = model.Stock(symbol, stock_type, last_dividend, fixed_dividend,
                             par_value)
 
         assert expected_pe_ratio == stock.pe_ratio
 
 
+@hypothesis.given(
+    symbol=symbol_strategy,
+    stock_type=stock_type_strategy,
+    last_dividend=last_dividend_strategy,
+    fixed_dividend=fixed_dividend_strategy,
+    par_value=par_value_strategy,
+    stock_price=stock_price_strategy
+)
+def test_stock_snapshot_reads_price_once(
+    symbol, stock_type, last_dividend, fixed_dividend, par_value, stock_price
+):
+    with mock.patch.object(model.Stock, 'stock_price',
+                           new_callable=mock.PropertyMock) as stock_price_mock:
+        stock_price_mock.return_value = stock_price
+        stock = model.Stock(symbol, stock_type, last_dividend, fixed_dividend,
+                            par_value)
+        expected_dividend_yield = stock.dividend_yield
+        expected_pe_ratio = stock.pe_ratio
+        stock_price_mock.reset_mock()
+
+        snapshot = stock.snapshot()
+
+        assert 1 == stock_price_mock.call_count
+        assert symbol == snapshot.symbol
+        assert stock_price == snapshot.stock_price
+        assert expected_dividend_yield == snapshot.dividend_yield
+        assert expected_pe_ratio == snapshot.pe_ratio
+
+
 def test_stock_no_trades_zero_price(stock_factory):
     stock = stock_factory()
 
@@ -329,8 +364,7 @@ def test_stock_no_trades_zero_price(stock_factory):
 @hypothesis.given(
     trades=hs.lists(
         hs.tuples(
-            old_timestamp_strategy(time.time(),
-                                   model.DEFAULT_TRADE_DECAY_TIME),
+            old_timestamp_strategy(NOW, model.DEFAULT_TRADE_DECAY_TIME),
             trade_data_strategy
         ),
         min_size=1
@@ -339,9 +373,8 @@ def test_stock_no_trades_zero_price(stock_factory):
 def test_stock_too_old_trades_zero_price(stock_factory, trades):
     stock = stock_factory()
 
-    # This is going to be a bit ugly. Will need to think of better way to test
-    for trade in trades:
-        stock._trades.append(trade)
+    for timestamp, (quantity, buy_sell, price) in sorted(trades):
+        stock.record_trade(timestamp, quantity, buy_sell, price)
 
     expected_stock_price = 0.0
     expected_trades_left = 0
@@ -353,8 +386,7 @@ def test_stock_too_old_trades_zero_price(stock_factory, trades):
 @hypothesis.given(
     trades=hs.lists(
         hs.tuples(
-            new_timestamp_strategy(time.time(),
-                                   model.DEFAULT_TRADE_DECAY_TIME),
+            new_timestamp_strategy(NOW, model.DEFAULT_TRADE_DECAY_TIME),
             trade_data_strategy
         ),
         min_size=1
@@ -363,13 +395,12 @@ def test_stock_too_old_trades_zero_price(stock_factory, trades):
 def test_stock_new_trades_correct_price(stock_factory, trades):
     stock = stock_factory()
 
-    # This is going to be a bit ugly. Will need to think of better way to test
-    for trade in trades:
-        stock._trades.append(trade)
+    for timestamp, (quantity, buy_sell, price) in sorted(trades):
+        stock.record_trade(timestamp, quantity, buy_sell, price)
 
     total_price = 0.0
     total_quantity = 0
-    for _, (quantity, _, price) in trades:
+    for _, (quantity, _, price) in sorted(trades):
         total_price += quantity * price
         total_quantity += quantity
     expected_stock_price = total_price / total_quantity
@@ -377,6 +408,194 @@ def test_stock_new_trades_correct_price(stock_factory, trades):
     assert expected_stock_price == stock.stock_price
 
 
+@hypothesis.given(
+    old_trades=hs.lists(
+        hs.tuples(
+            old_timestamp_strategy(NOW, model.DEFAULT_TRADE_DECAY_TIME),
+            trade_data_strategy
+        ),
+        min_size=1
+    ),
+    new_trades=hs.lists(
+        hs.tuples(
+            new_timestamp_strategy(NOW, model.DEFAULT_TRADE_DECAY_TIME),
+            trade_data_strategy
+        ),
+        min_size=1
+    )
+)
+def test_stock_evicted_trades_excluded_from_price(stock_factory, old_trades,
+                                                  new_trades):
+    stock = stock_factory()
+
+    for timestamp, (quantity, buy_sell, price) in (
+        sorted(old_trades) + sorted(new_trades)
+    ):
+        stock.record_trade(timestamp, quantity, buy_sell, price)
+
+    total_price = math.fsum(
+        quantity * price for _, (quantity, _, price) in new_trades
+    )
+    total_quantity = sum(quantity for _, (quantity, _, _) in new_trades)
+    expected_stock_price = total_price / total_quantity
+
+    assert stock.stock_price == pytest.approx(expected_stock_price)
+    assert len(new_trades) == len(stock._trades)
+
+
+def test_stock_vwap_within_retention_time():
+    stock = model.Stock('TEA', model.TYPE_COMMON, 1.0, None, 100.0,
+                        trades_cache_decay_time=60.0,
+                        trades_retention_time=300.0)
+    now = 1e9
+    for minute, price in enumerate([1.0, 2.0, 3.0, 4.0, 5.0, 6.0]):
+        stock.record_trade(now + minute * 60.0, 1, model.TRADE_BUY, price)
+
+    with mock.patch('time.time', return_value=now + 330.0):
+        assert 6.0 == stock.stock_price
+        # Trade at now is out of retention time
+        assert (2.0 + 3.0 + 4.0 + 5.0 + 6.0) / 5 == stock.vwap(now)
+        assert (2.0 + 3.0) / 2 == stock.vwap(now, now + 150.0)
+        assert 0.0 == stock.vwap(now + 400.0)
+        assert 5 == len(stock._trades)
+
+
+def test_stock_window_prices():
+    stock = model.Stock('TEA', model.TYPE_COMMON, 1.0, None, 100.0,
+                        trades_cache_decay_time=120.0,
+                        price_windows=(60.0, 300.0))
+    now = 1e9
+    for minute, price in enumerate([1.0, 2.0, 3.0, 4.0, 5.0, 6.0]):
+        stock.record_trade(now + minute * 60.0, 1, model.TRADE_BUY, price)
+
+    with mock.patch('time.time', return_value=now + 330.0):
+        assert {
+            60.0: 6.0,
+            120.0: 5.5,
+            300.0: (2.0 + 3.0 + 4.0 + 5.0 + 6.0) / 5
+        } == stock.window_prices()
+        assert 5.5 == stock.stock_price
+
+    with mock.patch('time.time', return_value=now + 400.0):
+        assert {
+            60.0: 0.0,
+            120.0: 6.0,
+            300.0: (3.0 + 4.0 + 5.0 + 6.0) / 4
+        } == stock.window_prices()
+
+
+def test_stock_trade_window_allocated_while_trades_stored():
+    stock = model.Stock('TEA', model.TYPE_COMMON, 1.0, None, 100.0,
+                        trades_cache_decay_time=60.0, price_windows=(30.0,))
+    other_stock = model.Stock('POP', model.TYPE_COMMON, 1.0, None, 100.0,
+                              trades_cache_decay_time=60.0,
+                              price_windows=(30.0,))
+    assert stock._reference is not other_stock._reference
+    stock_manager = model.StockManager()
+    stock_manager.add_stock(stock)
+    stock_manager.add_stock(other_stock)
+    assert stock._reference is other_stock._reference
+    assert not hasattr(stock, '__dict__')
+    assert stock._trades is other_stock._trades
+    assert {30.0: 0.0, 60.0: 0.0} == stock.window_prices()
+
+    stock.record_trade(100.0, 1, model.TRADE_BUY, 2.0)
+    assert stock._trades is not other_stock._trades
+    assert 0 == len(other_stock._trades)
+
+    with mock.patch('time.time', return_value=150.0):
+        assert {30.0: 0.0, 60.0: 2.0} == stock.window_prices()
+    with mock.patch('time.time', return_value=200.0):
+        assert 0.0 == stock.stock_price
+        assert stock._trades is other_stock._trades
+        assert stock._price_windows is None
+        stock.record_trade(190.0, 2, model.TRADE_BUY, 3.0)
+        assert 3.0 == stock.stock_price
+        assert 0.0 == other_stock.stock_price
+
+
+late_trades_strategy = hs.lists(
+    hs.tuples(
+        hs.floats(min_value=0.0, max_value=5.0),
+        hs.floats(min_value=0.0, max_value=20.0),
+        hs.integers(min_value=1, max_value=100),
+        hs.floats(min_value=0.01, max_value=100.0)
+    )
+)
+
+
+@hypothesis.given(trades=late_trades_strategy, batch=hs.booleans())
+def test_stock_merges_late_trades(simulated_clock, trades, batch):
+    settings = dict(trades_cache_decay_time=30.0, price_windows=(10.0,),
+                    bar_lengths=(60.0,))
+    stock = model.Stock('TEA', model.TYPE_COMMON, 1.0, None, 100.0,
+                        lateness_tolerance=10.0, clock=simulated_clock,
+                        **settings)
+    expected_stock = model.Stock('TEA', model.TYPE_COMMON, 1.0, None, 100.0,
+                                 clock=simulated_clock, **settings)
+    stock_stats = stats.Stats()
+    stock.set_stats(stock_stats)
+
+    # Feed time moves forward and trades are late to it by up to 20 seconds
+    feed_times = []
+    late_trades = []
+    for step, lateness, quantity, price in trades:
+        feed_times.append((feed_times or [0.0])[-1] + step)
+        late_trades.append((max(feed_times[-1] - lateness, 0.0), quantity,
+                            model.TRADE_BUY, price))
+    if batch:
+        simulated_clock.set((feed_times or [0.0])[-1])
+        rejected = [trade.index for trade in stock.record_trades(late_trades)]
+    else:
+        rejected = []
+        for index, trade in enumerate(late_trades):
+            simulated_clock.set(feed_times[index])
+            try:
+                stock.record_trade(*trade)
+            except model.ValidationError:
+                rejected.append(index)
+            stock.window_prices()
+    accepted = []
+    latest = None
+    for index, trade in enumerate(late_trades):
+        if index in rejected:
+            assert trade[0] < latest - 10.0
+        else:
+            assert latest is None or trade[0] >= latest - 10.0
+            accepted.append(trade)
+            latest = max(latest, trade[0])
+    expected_stock.record_trades(sorted(accepted, key=lambda t: t[0]))
+
+    for now in (simulated_clock.now(), latest or 0.0, (latest or 0.0) + 15.0):
+        simulated_clock.set(now)
+        assert stock.stock_price == pytest.approx(expected_stock.stock_price)
+        assert stock.window_prices() == pytest.approx(
+            expected_stock.window_prices()
+        )
+        assert stock.vwap(0.0) == pytest.approx(expected_stock.vwap(0.0))
+        assert stock.trade_count == expected_stock.trade_count
+    assert [bar.volume for bar in stock.bars(60.0, 10)] == [
+        bar.volume for bar in expected_stock.bars(60.0, 10)
+    ]
+    counters = stock_stats.snapshot()['counters']
+    assert len(rejected) == counters.get('trades_dropped_late', 0)
+    assert len(accepted) == counters.get('trades_recorded', 0)
+
+
+def test_stock_trade_sums_resync(stock_factory):
+    stock = stock_factory()
+    old_timestamp = NOW - model.DEFAULT_TRADE_DECAY_TIME - 60.0
+    new_timestamp = NOW
+
+    stock.record_trade(old_timestamp, 1, model.TRADE_BUY, 1e20)
+    stock.record_trade(old_timestamp, 3, model.TRADE_SELL, 0.5)
+    stock.record_trade(new_timestamp, 1, model.TRADE_BUY, 0.1)
+    stock.record_trade(new_timestamp, 2, model.TRADE_BUY, 0.2)
+
+    expected_stock_price = (0.1 + 2 * 0.2) / 3
+    assert expected_stock_price == stock.stock_price
+
+
 @hypothesis.given(
     timestamp=timestamp_strategy,
     quantity=quantity_strategy,
@@ -390,13 +609,13 @@ def test_stock_record_trade_success(
 
     stock.record_trade(timestamp, quantity, buy_sell, trade_price)
 
-    actual_timestamp, (
-        actual_quantity, actual_buy_sell, actual_trade_price
-    ) = stock._trades[0]
+    actual_timestamp, actual_quantity, actual_side, actual_trade_price = (
+        stock._trades[0]
+    )
 
     assert timestamp == actual_timestamp
     assert quantity == actual_quantity
-    assert buy_sell == actual_buy_sell
+    assert model.TRADE_SIDES[buy_sell] == actual_side
     assert trade_price == actual_trade_price
 
 
@@ -422,6 +641,7 @@ def test_stock_record_invalid_timestamp_fails(
     timestamp=timestamp_strategy,
     quantity=hs.one_of(
         hs.integers(max_value=0),
+        hs.integers(min_value=model.MAX_TRADE_QUANTITY + 1),
         hs.text(string.ascii_letters)
     ),
     buy_sell=buy_sell_strategy,
@@ -461,6 +681,8 @@ def test_stock_record_invalid_buy_sell_fails(
     buy_sell=buy_sell_strategy,
     trade_price=hs.one_of(
         hs.floats(max_value=0.0).filter(lambda v: v < 0.0),
+        hs.just(float('nan')),
+        hs.just(float('inf')),
         hs.text(string.ascii_letters)
     )
 )
@@ -496,6 +718,23 @@ def test_stock_manager_add_get_stock_success(stock_factory):
     assert stock == actual_stock
 
 
+def test_stock_manager_snapshot_all_success(stock_factory, trade_factory,
+                                            simulated_clock):
+    stock_manager = model.StockManager(clock=simulated_clock)
+    stock1 = stock_factory()
+    stock2 = stock_factory()
+    for stock in (stock1, stock2):
+        stock_manager.add_stock(stock)
+    timestamp, (quantity, buy_sell, trade_price) = trade_factory()
+    stock1.record_trade(timestamp, quantity, buy_sell, trade_price)
+
+    snapshots = stock_manager.snapshot_all()
+
+    assert {
+        stock.symbol: stock.snapshot() for stock in (stock1, stock2)
+    } == snapshots
+
+
 def test_stock_manager_all_share_index_no_data_returns_zero(stock_factory):
     stock_manager = model.StockManager()
     stock = stock_factory()
@@ -505,8 +744,9 @@ def test_stock_manager_all_share_index_no_data_returns_zero(stock_factory):
     assert expected_all_share_index == stock_manager.all_share_index
 
 
-def test_stock_manager_all_share_index_success(stock_factory, trade_factory):
-    stock_manager = model.StockManager()
+def test_stock_manager_all_share_index_success(stock_factory, trade_factory,
+                                               simulated_clock):
+    stock_manager = model.StockManager(clock=simulated_clock)
     stock1 = stock_factory()
     stock2 = stock_factory()
     for stock in (stock1, stock2):
@@ -517,13 +757,16 @@ def test_stock_manager_all_share_index_success(stock_factory, trade_factory):
     expected_all_share_index = math.sqrt(
         stock1.stock_price * stock2.stock_price
     )
-    assert expected_all_share_index == stock_manager.all_share_index
+    assert (
+        stock_manager.all_share_index ==
+        pytest.approx(expected_all_share_index)
+    )
 
 
 def test_stock_manager_all_share_index_stocks_without_data_ignored(
-    stock_factory, trade_factory
+    stock_factory, trade_factory, simulated_clock
 ):
-    stock_manager = model.StockManager()
+    stock_manager = model.StockManager(clock=simulated_clock)
     stock1 = stock_factory()
     stock2 = stock_factory()
     for stock in (stock1, stock2):
@@ -532,4 +775,318 @@ def test_stock_manager_all_share_index_stocks_without_data_ignored(
     stock1.record_trade(timestamp, quantity, buy_sell, trade_price)
 
     expected_all_share_index = stock1.stock_price
-    assert expected_all_share_index == stock_manager.all_share_index
+    assert (
+        stock_manager.all_share_index ==
+        pytest.approx(expected_all_share_index)
+    )
+
+
+def test_stock_manager_all_share_index_large_prices(stock_factory,
+                                                    simulated_clock):
+    stock_manager = model.StockManager(clock=simulated_clock)
+    for _ in range(10):
+        stock = stock_factory()
+        stock_manager.add_stock(stock)
+        stock.record_trade(NOW, 1, model.TRADE_BUY, 1e300)
+
+    assert stock_manager.all_share_index == pytest.approx(1e300)
+
+
+def test_stock_manager_all_share_index_follows_trades_and_decay(
+    simulated_clock
+):
+    stock_manager = model.StockManager(clock=simulated_clock)
+    stock1 = model.Stock('TEA', model.TYPE_COMMON, 1.0, None, 100.0)
+    stock2 = model.Stock('POP', model.TYPE_COMMON, 1.0, None, 100.0)
+    for stock in (stock1, stock2):
+        stock_manager.add_stock(stock)
+
+    stock1.record_trade(NOW, 1, model.TRADE_BUY, 4.0)
+    stock2.record_trade(NOW + 60.0, 1, model.TRADE_BUY, 9.0)
+    simulated_clock.set(NOW + 60.0)
+    assert stock_manager.all_share_index == pytest.approx(6.0)
+
+    stock2.record_trade(NOW + 120.0, 1, model.TRADE_BUY, 49.0)
+    simulated_clock.advance(60.0)
+    assert stock_manager.all_share_index == pytest.approx(
+        math.sqrt(4.0 * 29.0)
+    )
+
+    simulated_clock.set(NOW + model.DEFAULT_TRADE_DECAY_TIME + 90.0)
+    assert stock_manager.all_share_index == pytest.approx(49.0)
+
+    simulated_clock.advance(model.DEFAULT_TRADE_DECAY_TIME)
+    assert 0.0 == stock_manager.all_share_index
+
+
+def test_stock_manager_all_share_index_recalculates_dirty_stocks_only():
+    stock_manager = model.StockManager()
+    stock1 = model.Stock('TEA', model.TYPE_COMMON, 1.0, None, 100.0)
+    stock2 = model.Stock('POP', model.TYPE_COMMON, 1.0, None, 100.0)
+    for stock in (stock1, stock2):
+        stock_manager.add_stock(stock)
+    now = time.time()
+    stock1.record_trade(now, 1, model.TRADE_BUY, 4.0)
+    stock2.record_trade(now, 1, model.TRADE_BUY, 9.0)
+    stock_manager.all_share_index
+
+    stock1.record_trade(now, 3, model.TRADE_BUY, 8.0)
+    with mock.patch.object(model.Stock, 'stock_price',
+                           new_callable=mock.PropertyMock) as stock_price_mock:
+        stock_price_mock.return_value = 7.0
+        assert stock_manager.all_share_index == pytest.approx(
+            math.sqrt(7.0 * 9.0)
+        )
+
+    assert 1 == stock_price_mock.call_count
+
+
+batch_row_strategy = hs.tuples(
+    hs.sampled_from(['TEA', 'POP', 'XXX']),
+    hs.one_of(hs.floats(min_value=-10.0, max_value=1e3),
+              hs.integers(min_value=0, max_value=1000)),
+    hs.one_of(hs.integers(min_value=-1, max_value=10),
+              hs.floats(min_value=0.0, max_value=10.0)),
+    hs.sampled_from([model.TRADE_BUY, model.TRADE_SELL, 'BUY']),
+    hs.floats(min_value=-1.0, max_value=1e6)
+)
+
+
+@pytest.fixture(params=['python', 'numpy'])
+def batch_validation(request):
+    if request.param == 'numpy':
+        if model.numpy is None:
+            pytest.skip('numpy is not installed')
+        yield request.param
+    else:
+        with mock.patch.object(model, 'numpy', None):
+            yield request.param
+
+
+@hypothesis.given(rows=hs.lists(batch_row_strategy))
+def test_stock_manager_record_batch_same_as_record_trade(batch_validation,
+                                                         rows):
+    batch_manager = model.StockManager()
+    sequential_manager = model.StockManager()
+    for stock_manager in (batch_manager, sequential_manager):
+        for symbol in ('TEA', 'POP'):
+            stock_manager.add_stock(
+                model.Stock(symbol, model.TYPE_COMMON, 1.0, None, 100.0)
+            )
+
+    expected_rejected = []
+    for index, (symbol, timestamp, quantity, buy_sell, price) in enumerate(
+        rows
+    ):
+        try:
+            sequential_manager.get_stock(symbol).record_trade(
+                timestamp, quantity, buy_sell, price
+            )
+        except (KeyError, model.ValidationError):
+            expected_rejected.append(index)
+
+    with mock.patch('time.time', return_value=1e3):
+        rejected = batch_manager.record_batch(rows)
+
+        assert expected_rejected == [trade.index for trade in rejected]
+        for symbol in ('TEA', 'POP'):
+            expected_stock = sequential_manager.get_stock(symbol)
+            stock = batch_manager.get_stock(symbol)
+            assert len(expected_stock._trades) == len(stock._trades)
+            assert (
+                stock.stock_price == pytest.approx(expected_stock.stock_price)
+            )
+
+
+def test_stock_manager_record_batch_columns_reports_errors(batch_validation):
+    stock_manager = model.StockManager()
+    stock = model.Stock('TEA', model.TYPE_COMMON, 1.0, None, 100.0)
+    stock_manager.add_stock(stock)
+
+    rejected = stock_manager.record_batch_columns(
+        ['TEA', 'TEA', 'ABC', 'TEA', 'TEA', 'TEA'],
+        [10.0, 20.0, 20.0, 5.0, 25.0, 30.0],
+        [1, 0, 1, 2, 1, 3],
+        [model.TRADE_BUY, model.TRADE_SELL, model.TRADE_BUY, model.TRADE_BUY,
+         model.TRADE_BUY, model.TRADE_SELL],
+        [1.0, 2.0, 3.0, 4.0, float('inf'), 5.0]
+    )
+
+    assert [1, 2, 3, 4] == [trade.index for trade in rejected]
+    assert 'quantity' in rejected[0].error
+    assert 'ABC' in rejected[1].error
+    assert 'timestamp' in rejected[2].error
+    assert 'price' in rejected[3].error
+    assert [(10.0, 1, 1, 1.0), (30.0, 3, 0, 5.0)] == [
+        stock._trades[index] for index in range(len(stock._trades))
+    ]
+
+
+typed_trade_strategy = hs.tuples(
+    hs.sampled_from(['TEA', 'POP']),
+    hs.floats(min_value=0.0, max_value=1e3),
+    hs.integers(min_value=-1, max_value=10),
+    hs.sampled_from([model.TRADE_BUY, model.TRADE_SELL, 'BUY']),
+    hs.floats(min_value=0.01, max_value=1e6)
+)
+
+
+@hypothesis.given(rows=hs.lists(typed_trade_strategy))
+def test_stock_manager_trusted_same_as_validating(batch_validation, rows):
+    trusted_manager = model.StockManager(trusted=True)
+    validating_manager = model.StockManager()
+    for stock_manager in (trusted_manager, validating_manager):
+        for symbol in ('TEA', 'POP'):
+            stock_manager.add_stock(
+                model.Stock(symbol, model.TYPE_COMMON, 1.0, None, 100.0)
+            )
+    assert trusted_manager.get_stock('TEA').trusted
+
+    with mock.patch('time.time', return_value=1e3):
+        assert (
+            validating_manager.record_batch(rows) ==
+            trusted_manager.record_batch(rows)
+        )
+        for symbol, timestamp, quantity, buy_sell, price in rows:
+            errors = []
+            for stock_manager in (trusted_manager, validating_manager):
+                try:
+                    stock_manager.get_stock(symbol).record_trade(
+                        timestamp, quantity, buy_sell, price
+                    )
+                except model.ValidationError as e:
+                    errors.append(e.message)
+            assert len(errors) in (0, 2)
+            assert len(set(errors)) <= 1
+
+        for symbol in ('TEA', 'POP'):
+            expected_stock = validating_manager.get_stock(symbol)
+            stock = trusted_manager.get_stock(symbol)
+            assert len(expected_stock._trades) == len(stock._trades)
+            assert expected_stock.stock_price == stock.stock_price
+
+
+def test_stock_record_trades_notifies_listeners_once(stock_factory):
+    stock = stock_factory()
+    listener = mock.Mock()
+    stock.add_listener(listener)
+
+    rejected = stock.record_trades([
+        (1.0, 1, model.TRADE_BUY, 1.0),
+        (2.0, 2, model.TRADE_SELL, 2.0)
+    ])
+
+    assert [] == rejected
+    listener.assert_called_once_with(stock)
+
+
+def test_stock_manager_thread_safe_stress():
+    stock_manager = model.StockManager(thread_safe=True)
+    symbols = ['TEA', 'POP', 'ALE', 'GIN']
+    for symbol in symbols:
+        stock_manager.add_stock(
+            model.Stock(symbol, model.TYPE_COMMON, 1.0, None, 100.0)
+        )
+    timestamp = time.time()
+    trades_per_writer = 2000
+    errors = []
+    writing = threading.Event()
+    writing.set()
+
+    def write(writer):
+        try:
+            for number in range(trades_per_writer):
+                symbol = symbols[(writer + number) % len(symbols)]
+                stock_manager.get_stock(symbol).record_trade(
+                    timestamp, 1 + number % 3, model.TRADE_BUY,
+                    1.0 + writer
+                )
+        except Exception as e:
+            errors.append(e)
+
+    def read():
+        try:
+            while writing.is_set():
+                stock_manager.all_share_index
+                stock_manager.get_stock('TEA').snapshot()
+        except Exception as e:
+            errors.append(e)
+
+    writers = [threading.Thread(target=write, args=(writer,))
+               for writer in range(8)]
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for thread in readers + writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    writing.clear()
+    for thread in readers:
+        thread.join()
+
+    assert [] == errors
+    expected_prices = {}
+    for symbol in symbols:
+        total_price = total_quantity = 0
+        for writer in range(8):
+            for number in range(trades_per_writer):
+                if symbols[(writer + number) % len(symbols)] == symbol:
+                    total_price += (1 + number % 3) * (1.0 + writer)
+                    total_quantity += 1 + number % 3
+        expected_prices[symbol] = total_price / total_quantity
+        assert (
+            stock_manager.get_stock(symbol).stock_price ==
+            pytest.approx(expected_prices[symbol])
+        )
+        assert len(stock_manager.get_stock(symbol)._trades) == (
+            8 * trades_per_writer / len(symbols)
+        )
+    assert stock_manager.all_share_index == pytest.approx(
+        math.exp(sum(math.log(price) for price in expected_prices.values()) /
+                 len(symbols))
+    )
+
+
+@hypothesis.given(
+    rows=hs.lists(hs.tuples(
+        hs.floats(min_value=0.0, max_value=5.0),
+        hs.floats(min_value=0.0, max_value=20.0),
+        hs.integers(min_value=0, max_value=10),
+        hs.sampled_from([model.TRADE_BUY, model.TRADE_SELL, 'hold']),
+        hs.floats(min_value=0.01, max_value=100.0)
+    )),
+    trusted=hs.booleans()
+)
+def test_stock_late_batch_same_as_record_trade(batch_validation, rows,
+                                               trusted):
+    batch_stock, sequential_stock = [
+        model.Stock('TEA', model.TYPE_COMMON, 1.0, None, 100.0,
+                    lateness_tolerance=10.0, trusted=trusted,
+                    clock=clock.SimulatedClock(0.0))
+        for _ in range(2)
+    ]
+    batch_stats, sequential_stats = stats.Stats(), stats.Stats()
+    batch_stock.set_stats(batch_stats)
+    sequential_stock.set_stats(sequential_stats)
+    for stock in (batch_stock, sequential_stock):
+        stock.record_trade(50.0, 1, model.TRADE_BUY, 1.0)
+
+    feed_time = 50.0
+    trades = []
+    for step, lateness, quantity, buy_sell, price in rows:
+        feed_time += step
+        trades.append((feed_time - lateness, quantity, buy_sell, price))
+    expected_rejected = []
+    for index, trade in enumerate(trades):
+        try:
+            sequential_stock.record_trade(*trade)
+        except model.ValidationError:
+            expected_rejected.append(index)
+
+    rejected = batch_stock.record_trades(trades)
+    assert expected_rejected == [trade.index for trade in rejected]
+    assert list(sequential_stock._trades) == list(batch_stock._trades)
+    assert [
+        dict((name, count) for name, count in counters.iteritems() if count)
+        for counters in (sequential_stats.snapshot()['counters'],
+                         batch_stats.snapshot()['counters'])
+    ] == [sequential_stats.snapshot()['counters']] * 2
@@ -0,0 +1,153 @@
+import gzip
+import json
+import StringIO
+
+from sss import model
+from sss import replay
+
+import mock
+import pytest
+
+
+@pytest.fixture
+def stock_manager():
+    stock_manager = model.StockManager()
+    for symbol in ('TEA', 'POP'):
+        stock_manager.add_stock(
+            model.Stock(symbol, model.TYPE_COMMON, 1, None, 100)
+        )
+    return stock_manager
+
+
+TRADES = [
+    ('TEA', 10.0, 2, 'buy', 10.0),
+    ('POP', 11.0, 1, 'sell', 4.0),
+    ('TEA', 12.0, 1, 'sell', 40.0),
+    ('TEA', 9.0, 1, 'buy', 1.0),
+    ('ALE', 13.0, 1, 'buy', 1.0),
+    ('POP', 14.0, 3, 'buy', 0.0),
+]
+
+
+def write_csv(path, trades, opener=open):
+    with opener(path, 'wb') as csv_file:
+        csv_file.write('price,symbol,timestamp,quantity,buy_sell\n')
+        for symbol, timestamp, quantity, buy_sell, price in trades:
+            csv_file.write('{},{},{},{},{}\n'.format(
+                price, symbol, timestamp, quantity, buy_sell
+            ))
+
+
+def write_jsonl(path, trades, opener=open):
+    with opener(path, 'wb') as jsonl_file:
+        for trade in trades:
+            jsonl_file.write(json.dumps(dict(zip(replay.FIELDS, trade))))
+            jsonl_file.write('\n')
+
+
+@pytest.mark.parametrize('name, writer, opener', [
+    ('trades.csv', write_csv, open),
+    ('trades.csv.gz', write_csv, gzip.open),
+    ('trades.jsonl', write_jsonl, open),
+    ('trades.jsonl.gz', write_jsonl, gzip.open),
+])
+def test_replay_records_valid_trades(tmpdir, stock_manager, name, writer,
+                                     opener):
+    path = str(tmpdir.join(name))
+    writer(path, TRADES, opener)
+    stats = replay.ReplayStats()
+    notifications = []
+    stock_manager.subscribe_price('TEA', notifications.append)
+
+    with mock.patch('time.time', return_value=20.0):
+        emitted = list(replay.replay(path, stock_manager, chunk_size=2,
+                                     index_every=3, stats=stats))
+
+        assert [10.0, 20.0] == [
+            notification.value for notification in notifications
+        ]
+        assert 20.0 == stock_manager.get_stock('TEA').stock_price
+        assert 4.0 == stock_manager.get_stock('POP').stock_price
+    assert [3] == [recorded for recorded, _ in emitted]
+    assert 6 == stats.read
+    assert 3 == stats.recorded
+    assert 3 == stats.rejected
+    header_lines = 1 if '.csv' in name else 0
+    assert [4 + header_lines, 5 + header_lines, 6 + header_lines] == sorted(
+        line for line, _ in stats.errors
+    )
+    assert ['read', 'parse', 'lookup', 'route', 'index'] == list(
+        stats.own_stage_times()
+    )
+
+
+def test_replay_validates_against_recorded_trades(tmpdir):
+    stock_manager = model.StockManager()
+    stock_manager.add_stock(model.Stock('TEA', model.TYPE_COMMON, 1, None,
+                                        100, lateness_tolerance=5.0))
+    tea = stock_manager.get_stock('TEA')
+    tea.record_trade(10.0, 1, model.TRADE_BUY, 1.0)
+    path = str(tmpdir.join('trades.csv'))
+    write_csv(path, [('TEA', 12.0, 1, 'buy', 2.0),
+                     ('TEA', 8.0, 1, 'buy', 3.0),
+                     ('TEA', 4.0, 1, 'buy', 4.0)])
+    stats = replay.ReplayStats()
+
+    with mock.patch('time.time', return_value=20.0):
+        list(replay.replay(path, stock_manager, stats=stats))
+    assert 2 == stats.recorded
+    assert [4] == [line for line, _ in stats.errors]
+    assert [8.0, 10.0, 12.0] == [trade[0] for trade in tea._trades]
+
+
+def test_replay_skips_blank_lines_and_rejects_bad_symbols(tmpdir,
+                                                          stock_manager):
+    csv_path = str(tmpdir.join('trades.csv'))
+    with open(csv_path, 'wb') as csv_file:
+        csv_file.write('symbol,timestamp,quantity,buy_sell,price\n'
+                       'TEA,10.0,1,buy,4.0\n'
+                       '\n'
+                       'TEA,11.0,1,buy,5.0\n')
+    jsonl_path = str(tmpdir.join('trades.jsonl'))
+    write_jsonl(jsonl_path, [(['TEA'], 12.0, 1, 'buy', 6.0),
+                             ('TEA', 13.0, 1, 'buy', 7.0)])
+    stats = replay.ReplayStats()
+
+    with mock.patch('time.time', return_value=20.0):
+        for path in (csv_path, jsonl_path):
+            list(replay.replay(path, stock_manager, stats=stats))
+    assert 4 == stats.read
+    assert 3 == stats.recorded
+    assert [(1, 'invalid JSON trade')] == stats.errors
+
+
+def test_replay_main_reports_throughput(tmpdir, stock_manager):
+    path = str(tmpdir.join('trades.csv'))
+    write_csv(path, TRADES)
+    output = StringIO.StringIO()
+
+    assert 0 == replay.main([path], stock_manager, output)
+
+    lines = output.getvalue().splitlines()
+    assert 'Read 6 trades, recorded 3, rejected 3' in lines
+    assert any(line.strip().startswith('lookup') for line in lines)
+
+
+def test_replay_main_emits_index_at_event_time(tmpdir, stock_manager):
+    path = str(tmpdir.join('trades.csv'))
+    write_csv(path, [('TEA', 10.0, 1, 'buy', 4.0),
+                     ('POP', 11.0, 1, 'buy', 9.0)])
+    output = StringIO.StringIO()
+
+    assert 0 == replay.main([path, '--index-every', '2'], stock_manager,
+                            output)
+
+    assert 'trades 2 index 6.0' in output.getvalue().splitlines()
+
+
+def test_replay_main_fails_on_unknown_format(tmpdir, stock_manager):
+    output = StringIO.StringIO()
+
+    assert 1 == replay.main([str(tmpdir.join('trades.txt'))],
+                            stock_manager, output)
+    assert output.getvalue().startswith('Replay failed')
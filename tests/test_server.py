@@ -0,0 +1,126 @@
+import Queue
+import math
+import os
+import socket
+import tempfile
+import threading
+import time
+
+from sss import loadgen
+from sss import model
+from sss import server
+
+import pytest
+
+
+@pytest.fixture
+def stock_manager():
+    stock_manager = model.StockManager()
+    for symbol in ('TEA', 'POP'):
+        stock_manager.add_stock(
+            model.Stock(symbol, model.TYPE_COMMON, 1, None, 100)
+        )
+    return stock_manager
+
+
+@pytest.fixture(params=['tcp', 'unix'])
+def trade_server(request, stock_manager):
+    if request.param == 'tcp':
+        address = ('127.0.0.1', 0)
+    else:
+        address = os.path.join(tempfile.mkdtemp(), 'sss.sock')
+    trade_server = server.TradeServer(stock_manager, address, batch_size=16)
+    thread = threading.Thread(target=trade_server.serve_forever,
+                              args=(0.01,))
+    thread.start()
+    yield trade_server
+    trade_server.shutdown()
+    thread.join()
+    trade_server.close()
+
+
+def request(address, lines):
+    if isinstance(address, basestring):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.connect(address)
+    sock.sendall(''.join(line + '\n' for line in lines))
+    replies = sock.makefile('rb')
+    try:
+        return [replies.readline().rstrip('\n') for _ in lines]
+    finally:
+        replies.close()
+        sock.close()
+
+
+def test_server_records_trades_and_answers_queries(trade_server):
+    now = time.time()
+    replies = request(trade_server.address, [
+        'TEA 2 buy 10.0 {}'.format(now),
+        'TEA 1 SELL 40 {}'.format(now),
+        'TEA 1 buy 1.0 {}'.format(now - 1),
+        'ALE 1 buy 1.0',
+        'POP 1 buy 5.0',
+        'POP x buy 5.0',
+        'PRICE TEA',
+        'PRICE ALE',
+        'INDEX',
+        'HELLO',
+    ])
+
+    assert ['OK', 'OK'] == replies[:2]
+    assert replies[2].startswith('ERR timestamp')
+    assert 'ERR Stock "ALE" is not found' == replies[3]
+    assert 'OK' == replies[4]
+    assert replies[5].startswith('ERR quantity')
+    assert 'PRICE TEA 20.0' == replies[6]
+    assert 'ERR Stock "ALE" is not found' == replies[7]
+    command, index = replies[8].split()
+    assert 'INDEX' == command
+    assert math.sqrt(20.0 * 5.0) == pytest.approx(float(index))
+    assert 'ERR unknown request' == replies[9]
+
+
+def test_server_publishes_recorded_trades(trade_server, stock_manager):
+    notifications = Queue.Queue()
+    stock_manager.subscribe_price('TEA', notifications)
+    now = time.time()
+
+    assert ['OK', 'OK'] == request(trade_server.address, [
+        'TEA 2 buy 10.0 {}'.format(now),
+        'POP 1 buy 5.0 {}'.format(now),
+    ])
+    # Notifications are published before replies to the batch are sent
+    assert ('TEA', 10.0) == notifications.get_nowait()[:2]
+
+
+def test_server_closes_connection_on_long_line(trade_server):
+    if isinstance(trade_server.address, basestring):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.connect(trade_server.address)
+    replies = sock.makefile('rb')
+    try:
+        # Both the start of the long line and the next line are valid
+        sock.sendall('TEA 1 buy 4.0'.ljust(server.MAX_LINE_LENGTH))
+        time.sleep(0.05)
+        sock.sendall(' \nPOP 1 buy 1.0\n')
+
+        assert ['ERR line is too long\n', ''] == [
+            replies.readline() for _ in range(2)
+        ]
+    finally:
+        replies.close()
+        sock.close()
+    assert 0.0 == trade_server._stock_manager.all_share_index
+
+
+def test_load_generator(trade_server):
+    result = loadgen.run_load(trade_server.address, ['TEA', 'POP'],
+                              connections=3, trades=200, in_flight=8)
+
+    assert 600 == result.trades
+    assert 0 == result.errors
+    assert 0.0 < result.p50_latency <= result.p99_latency
@@ -0,0 +1,117 @@
+import time
+
+from sss import clock
+from sss import model
+from sss import sharding
+
+import pytest
+
+
+@pytest.fixture
+def sharded_manager():
+    stock_manager = sharding.ShardedStockManager(shards=3)
+    yield stock_manager
+    stock_manager.close()
+
+
+class BrokenPrice(object):
+    """
+    Price which fails validation in a shard worker with an unexpected error.
+    """
+
+    def __float__(self):
+        raise RuntimeError('broken price')
+
+    def __lt__(self, other):
+        raise RuntimeError('broken price')
+
+    __le__ = __gt__ = __ge__ = __lt__
+
+
+def add_stocks(stock_manager, symbols):
+    for symbol in symbols:
+        stock_manager.add_stock(
+            model.Stock(symbol, model.TYPE_COMMON, 1, None, 100)
+        )
+
+
+def test_sharded_manager_matches_single_process(sharded_manager):
+    stock_manager = model.StockManager()
+    symbols = ['TEA', 'POP', 'ALE', 'JOE', 'BAR', 'RUM']
+    add_stocks(stock_manager, symbols)
+    add_stocks(sharded_manager, symbols)
+    for manager in (stock_manager, sharded_manager):
+        manager.add_stock(
+            model.Stock('GIN', model.TYPE_PREFERRED, 8, 2, 100)
+        )
+    symbols.append('GIN')
+    now = time.time()
+    trades = [
+        (symbol, now - 10 + index, index + 1, model.TRADE_BUY,
+         1.0 + index * len(symbol))
+        for index, symbol in enumerate(symbols * 3)
+    ]
+    trades.append(('TEA', now - 100, 1, model.TRADE_BUY, 1.0))
+    trades.append(('XXX', now, 1, model.TRADE_BUY, 1.0))
+
+    assert (
+        stock_manager.record_batch(trades) ==
+        sharded_manager.record_batch(trades)
+    )
+    assert (
+        stock_manager.all_share_index ==
+        pytest.approx(sharded_manager.all_share_index)
+    )
+    assert stock_manager.snapshot_all() == sharded_manager.snapshot_all()
+    for symbol in symbols:
+        stock = stock_manager.get_stock(symbol)
+        sharded_stock = sharded_manager.get_stock(symbol)
+        assert stock.fixed_dividend == sharded_stock.fixed_dividend
+        assert stock.fixed_dividend_percent == (
+            sharded_stock.fixed_dividend_percent
+        )
+        assert stock.dividend_yield == sharded_stock.dividend_yield
+
+
+def test_sharded_stock_records_trades(sharded_manager):
+    add_stocks(sharded_manager, ['TEA', 'POP'])
+    stock = sharded_manager.get_stock('POP')
+    now = time.time()
+
+    stock.record_trade(now, 2, model.TRADE_SELL, 10.0)
+    stock.record_trade(now, 1, model.TRADE_BUY, 40.0)
+    with pytest.raises(model.ValidationError):
+        stock.record_trade(now - 1, 1, model.TRADE_BUY, 1.0)
+
+    assert 'POP' == stock.symbol
+    assert clock.WALL_CLOCK is stock.clock
+    assert clock.WALL_CLOCK is sharded_manager.clock
+    assert 20.0 == stock.stock_price
+    assert 0.05 == stock.dividend_yield
+    assert 20.0 == pytest.approx(sharded_manager.all_share_index)
+    with pytest.raises(KeyError):
+        sharded_manager.get_stock('ALE')
+
+
+def test_sharded_manager_without_trades(sharded_manager):
+    add_stocks(sharded_manager, ['TEA'])
+
+    assert 0.0 == sharded_manager.all_share_index
+
+
+def test_sharded_manager_recovers_from_worker_errors(sharded_manager):
+    symbols = ['TEA', 'POP', 'ALE', 'GIN', 'JOE']
+    add_stocks(sharded_manager, symbols)
+    now = time.time()
+
+    with pytest.raises(RuntimeError):
+        sharded_manager.record_batch([
+            (symbol, now, 1, model.TRADE_BUY, BrokenPrice())
+            for symbol in symbols
+        ])
+    # Every shard got its reply read, so later requests are not stuck
+    assert [] == sharded_manager.record_batch([
+        ('TEA', now, 1, model.TRADE_BUY, 4.0)
+    ])
+    assert 4.0 == pytest.approx(sharded_manager.all_share_index)
+    assert 5 == len(sharded_manager.snapshot_all())
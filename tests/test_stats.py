@@ -0,0 +1,74 @@
+import json
+import StringIO
+
+from sss import model
+from sss import stats
+
+import mock
+import pytest
+
+
+def test_histogram_percentiles():
+    histogram = stats.Histogram()
+    for value in range(1, 101):
+        histogram.observe(value / 1e6)
+
+    snapshot = histogram.snapshot()
+
+    assert 100 == snapshot.count
+    assert 50.5e-6 == pytest.approx(snapshot.mean)
+    assert 50e-6 <= snapshot.p50 <= 50e-6 * 1.25
+    assert 99e-6 <= snapshot.p99 <= 100e-6
+    assert 100e-6 == snapshot.max
+
+
+def test_histogram_empty_and_zero():
+    histogram = stats.Histogram()
+    assert 0.0 == histogram.percentile(99)
+
+    histogram.observe(0.0)
+    assert 0.0 == histogram.percentile(99)
+
+
+def test_stock_manager_stats():
+    stock_manager = model.StockManager()
+    stock_manager.add_stock(model.Stock('TEA', model.TYPE_COMMON, 1, None,
+                                        100, trades_cache_decay_time=10))
+    assert stock_manager.stats_snapshot() is None
+
+    stock_manager.enable_stats()
+    stock_manager.add_stock(model.Stock('POP', model.TYPE_COMMON, 1, None,
+                                        100, trades_cache_decay_time=10))
+    tea = stock_manager.get_stock('TEA')
+    pop = stock_manager.get_stock('POP')
+    with mock.patch('time.time', return_value=100.0):
+        tea.record_trade(85.0, 1, model.TRADE_BUY, 1.0)
+        tea.record_trade(95.0, 1, model.TRADE_BUY, 1.0)
+        with pytest.raises(model.ValidationError):
+            tea.record_trade(90.0, 1, model.TRADE_BUY, 1.0)
+        pop.record_trades([(95.0, 1, model.TRADE_BUY, 1.0),
+                           (96.0, 1, model.TRADE_BUY, -1.0)])
+        stock_manager.all_share_index
+
+        snapshot = stock_manager.stats_snapshot()
+
+    assert {
+        'trades_recorded': 3,
+        'trades_rejected': 2,
+        'trades_evicted': 1,
+    } == snapshot['counters']
+    assert {'stocks': 2, 'total': 2, 'max': 1, 'mean': 1.0} == (
+        snapshot['window_sizes']
+    )
+    assert 2 == snapshot['latencies']['record_trade']['count']
+    assert 2 == snapshot['latencies']['stock_price']['count']
+    assert 1 == snapshot['latencies']['all_share_index']['count']
+
+    exported = StringIO.StringIO()
+    stats.export(snapshot, exported)
+    assert snapshot['counters'] == json.loads(exported.getvalue())['counters']
+    assert 'trades_recorded' in stats.format_snapshot(snapshot)
+
+    stock_manager.disable_stats()
+    tea.record_trade(96.0, 1, model.TRADE_BUY, 1.0)
+    assert stock_manager.stats_snapshot() is None
@@ -0,0 +1,200 @@
+from sss import storage
+
+import hypothesis
+import hypothesis.strategies as hs
+import pytest
+
+record_strategy = hs.fixed_dictionaries({
+    'symbol': hs.sampled_from(['TEA', 'POP', 'ALE']),
+    'timestamp': hs.integers(min_value=0, max_value=100),
+    'buy_sell': hs.sampled_from(['buy', 'sell']),
+    'price': hs.floats(min_value=0.01, max_value=100.0)
+})
+range_strategy = hs.tuples(
+    hs.one_of(hs.none(), hs.integers(min_value=0, max_value=100)),
+    hs.one_of(hs.none(), hs.integers(min_value=0, max_value=100))
+)
+
+
+def build_storage(records):
+    trade_storage = storage.Storage()
+    trade_storage.add_unordered_index('symbol')
+    trade_storage.add_ordered_index('timestamp')
+    for record in records:
+        trade_storage.insert(record)
+    return trade_storage
+
+
+def test_index_is_abstract():
+    with pytest.raises(TypeError):
+        storage.Index('symbol')
+
+
+def test_storage_get_without_arguments_fails():
+    with pytest.raises(ValueError):
+        storage.Storage().get()
+
+
+@hypothesis.given(
+    records=hs.lists(record_strategy),
+    symbol=hs.sampled_from(['TEA', 'POP', 'ALE', 'GIN'])
+)
+def test_storage_get_by_unordered_index(records, symbol):
+    trade_storage = build_storage(records)
+
+    expected_records = [
+        record for record in records if record['symbol'] == symbol
+    ]
+    assert expected_records == trade_storage.get(symbol=symbol)
+
+
+@hypothesis.given(records=hs.lists(record_strategy),
+                  timestamp_range=range_strategy)
+def test_storage_get_by_ordered_index_range(records, timestamp_range):
+    trade_storage = build_storage(records)
+    low, high = timestamp_range
+
+    expected_records = [
+        record for record in records
+        if (low is None or low <= record['timestamp']) and
+        (high is None or record['timestamp'] <= high)
+    ]
+    assert expected_records == trade_storage.get(timestamp=timestamp_range)
+
+
+@hypothesis.given(
+    records=hs.lists(record_strategy),
+    symbol=hs.sampled_from(['TEA', 'POP']),
+    timestamp_range=range_strategy,
+    buy_sell=hs.sampled_from(['buy', 'sell'])
+)
+def test_storage_get_by_several_fields(records, symbol, timestamp_range,
+                                       buy_sell):
+    trade_storage = build_storage(records)
+    low, high = timestamp_range
+
+    expected_records = [
+        record for record in records
+        if record['symbol'] == symbol and
+        record['buy_sell'] == buy_sell and
+        (low is None or low <= record['timestamp']) and
+        (high is None or record['timestamp'] <= high)
+    ]
+    assert expected_records == trade_storage.get(
+        symbol=symbol, timestamp=timestamp_range, buy_sell=buy_sell
+    )
+
+
+def test_storage_index_added_after_insert():
+    trade_storage = storage.Storage()
+    records = [{'symbol': 'TEA', 'timestamp': 2},
+               {'symbol': 'POP', 'timestamp': 1}]
+    for record in records:
+        trade_storage.insert(record)
+
+    trade_storage.add_ordered_index('timestamp')
+
+    assert [records[1]] == trade_storage.get(timestamp=(None, 1))
+
+
+def test_storage_explain_starts_from_most_selective_index():
+    trade_storage = storage.Storage()
+    trade_storage.add_unordered_index('symbol')
+    trade_storage.add_unordered_index('buy_sell')
+    trade_storage.add_ordered_index('timestamp')
+    for timestamp in range(1000):
+        trade_storage.insert({
+            'symbol': 'TEA' if timestamp % 100 else 'POP',
+            'buy_sell': 'buy' if timestamp % 2 else 'sell',
+            'timestamp': timestamp,
+            'price': 1.0
+        })
+
+    plan = trade_storage.explain(symbol='POP', timestamp=(0, 30),
+                                 buy_sell='sell', price=1.0)
+
+    assert [
+        storage.PlanStep('index', 'symbol', 10),
+        storage.PlanStep('intersect', 'timestamp', 10),
+        storage.PlanStep('filter', 'price', None),
+        storage.PlanStep('filter', 'buy_sell', None),
+    ] == plan.steps
+    assert 'index symbol (~10 rows)' == str(plan).split('\n')[0]
+    assert [0] == [
+        record['timestamp'] for record in trade_storage.get(
+            symbol='POP', timestamp=(0, 30), buy_sell='sell', price=1.0
+        )
+    ]
+
+
+def test_storage_explain_scans_without_indexes():
+    trade_storage = storage.Storage()
+    trade_storage.insert({'symbol': 'TEA'})
+
+    plan = trade_storage.explain(symbol='TEA')
+
+    assert [
+        storage.PlanStep('scan', None, 1),
+        storage.PlanStep('filter', 'symbol', None),
+    ] == plan.steps
+
+
+@hypothesis.given(
+    records=hs.lists(record_strategy),
+    segment_size=hs.integers(min_value=1, max_value=8),
+    max_records=hs.integers(min_value=1, max_value=20),
+    symbol=hs.sampled_from(['TEA', 'POP']),
+    timestamp_range=range_strategy
+)
+def test_storage_count_retention(records, segment_size, max_records, symbol,
+                                 timestamp_range):
+    trade_storage = storage.Storage(segment_size=segment_size,
+                                    max_records=max_records)
+    trade_storage.add_unordered_index('symbol')
+    trade_storage.add_ordered_index('timestamp')
+    record_ids = [trade_storage.insert(record) for record in records]
+
+    assert range(len(records)) == record_ids
+    assert min(len(records), max_records) <= len(trade_storage)
+    assert len(trade_storage) < max_records + segment_size
+    kept_records = records[trade_storage.first_id:]
+    assert kept_records == list(trade_storage)
+    assert [
+        record for record in kept_records if record['symbol'] == symbol
+    ] == trade_storage.get(symbol=symbol)
+    low, high = timestamp_range
+    assert [
+        record for record in kept_records
+        if (low is None or low <= record['timestamp']) and
+        (high is None or record['timestamp'] <= high)
+    ] == trade_storage.get(timestamp=timestamp_range)
+
+
+def test_storage_age_retention_drops_whole_segments():
+    trade_storage = storage.Storage(segment_size=10, time_field='timestamp',
+                                    max_age=50)
+    trade_storage.add_ordered_index('timestamp')
+    for timestamp in range(100):
+        trade_storage.insert({'timestamp': timestamp})
+
+    # Segment with timestamps 40-49 is still relevant for timestamp 99
+    assert 40 == trade_storage.first_id
+    assert {'timestamp': 40} == trade_storage.record(40)
+    with pytest.raises(KeyError):
+        trade_storage.record(39)
+    assert [{'timestamp': 40}] == trade_storage.get(timestamp=(None, 40))
+
+
+def test_storage_compact_cleans_index_entries():
+    trade_storage = storage.Storage(segment_size=10, max_records=10)
+    trade_storage.add_unordered_index('symbol')
+    trade_storage.add_ordered_index('timestamp')
+    for timestamp in range(25):
+        trade_storage.insert({'symbol': 'TEA', 'timestamp': timestamp})
+
+    trade_storage.compact()
+
+    assert 15 == trade_storage.explain(symbol='TEA').steps[0].estimated_rows
+    assert 15 == trade_storage.explain(
+        timestamp=(None, None)
+    ).steps[0].estimated_rows
@@ -0,0 +1,162 @@
+import Queue
+
+from sss import model
+from sss import subscriptions
+
+import pytest
+
+
+@pytest.fixture
+def stock_manager(simulated_clock):
+    stock_manager = model.StockManager(thread_safe=True,
+                                       clock=simulated_clock)
+    for symbol in ('TEA', 'POP'):
+        stock_manager.add_stock(model.Stock(
+            symbol, model.TYPE_COMMON, 1.0, None, 100.0,
+            trades_cache_decay_time=60.0
+        ))
+    return stock_manager
+
+
+def test_subscription_thresholds():
+    notifications = []
+    subscription = subscriptions.Subscription('TEA', notifications.append,
+                                              threshold=1.0)
+    for value in (10.0, 10.5, 11.0, 11.5, 9.0):
+        subscription.offer(value, 0.0)
+    assert [10.0, 11.5, 9.0] == [
+        notification.value for notification in notifications
+    ]
+    assert 9.0 == subscription.value
+
+    notifications = []
+    subscription = subscriptions.Subscription(None, notifications.append,
+                                              threshold=0.1, relative=True)
+    for value in (0.0, 100.0, 105.0, 111.0, 101.0):
+        subscription.offer(value, 0.0)
+    assert [0.0, 100.0, 111.0] == [
+        notification.value for notification in notifications
+    ]
+
+
+def test_subscription_min_interval():
+    notifications = []
+    subscription = subscriptions.Subscription('TEA', notifications.append,
+                                              min_interval=10.0)
+    assert not subscription.offer(1.0, 0.0)
+    assert subscription.offer(2.0, 5.0)
+    assert subscription.offer(3.0, 6.0)
+    assert subscription.offer_held(9.0)
+    assert not subscription.offer_held(10.0)
+    assert not subscription.offer_held(11.0)
+    # Values back within threshold of the last notified one are dropped
+    assert subscription.offer(4.0, 12.0)
+    assert not subscription.offer(3.0, 13.0)
+    assert not subscription.offer_held(30.0)
+    assert [
+        subscriptions.Notification('TEA', 1.0, 0.0),
+        subscriptions.Notification('TEA', 3.0, 10.0),
+    ] == notifications
+
+
+def test_subscription_rejects_invalid_arguments():
+    with pytest.raises(ValueError):
+        subscriptions.Subscription('TEA', len, threshold=-1.0)
+    with pytest.raises(ValueError):
+        subscriptions.Subscription('TEA', len, min_interval=-1.0)
+    with pytest.raises(TypeError):
+        subscriptions.Subscription('TEA', None)
+
+
+def test_stock_manager_coalesces_trades(stock_manager, simulated_clock):
+    tea_notifications = []
+    index_queue = Queue.Queue()
+    stock_manager.subscribe_price('TEA', tea_notifications.append)
+    stock_manager.subscribe_index(index_queue)
+    with pytest.raises(model.StockError):
+        stock_manager.subscribe_price('ALE', tea_notifications.append)
+
+    stock_manager.publish()
+    assert [subscriptions.Notification('TEA', 0.0, 1000.0)] == (
+        tea_notifications
+    )
+    assert subscriptions.Notification(None, 0.0, 1000.0) == (
+        index_queue.get_nowait()
+    )
+
+    tea = stock_manager.get_stock('TEA')
+    for price in (1.0, 2.0, 3.0, 4.0):
+        tea.record_trade(990.0, 1, model.TRADE_BUY, price)
+    stock_manager.get_stock('POP').record_trade(995.0, 1, model.TRADE_BUY,
+                                                10.0)
+    stock_manager.publish()
+    assert 2.5 == tea_notifications[-1].value
+    assert 5.0 == pytest.approx(index_queue.get_nowait().value)
+
+    # Trades of other stocks and publishes without changes notify nothing
+    stock_manager.publish()
+    stock_manager.get_stock('POP').record_trade(999.0, 1, model.TRADE_BUY,
+                                                10.0)
+    stock_manager.publish()
+    assert 2 == len(tea_notifications)
+    assert index_queue.empty()
+
+    # Evicted trades are notified by the first publish after eviction
+    simulated_clock.advance(51.0)
+    stock_manager.publish()
+    assert subscriptions.Notification('TEA', 0.0, 1051.0) == (
+        tea_notifications[-1]
+    )
+    assert 10.0 == pytest.approx(index_queue.get_nowait().value)
+
+
+def test_stock_manager_publishes_held_values(stock_manager, simulated_clock):
+    notifications = []
+    subscription = stock_manager.subscribe_price(
+        'TEA', notifications.append, threshold=0.5, min_interval=10.0
+    )
+    tea = stock_manager.get_stock('TEA')
+    tea.record_trade(1000.0, 1, model.TRADE_BUY, 4.0)
+    stock_manager.publish()
+
+    tea.record_trade(1001.0, 1, model.TRADE_BUY, 8.0)
+    simulated_clock.advance(5.0)
+    stock_manager.publish()
+    assert [4.0] == [notification.value for notification in notifications]
+
+    simulated_clock.advance(5.0)
+    stock_manager.publish()
+    assert [4.0, 6.0] == [
+        notification.value for notification in notifications
+    ]
+
+    stock_manager.unsubscribe(subscription)
+    tea.record_trade(1010.0, 1, model.TRADE_BUY, 100.0)
+    simulated_clock.advance(10.0)
+    stock_manager.publish()
+    assert 2 == len(notifications)
+
+
+def test_stock_manager_notifies_past_failing_targets(stock_manager):
+    first = []
+    full_queue = Queue.Queue(maxsize=1)
+    last = []
+    stock_manager.subscribe_price('TEA', first.append)
+    failing = stock_manager.subscribe_price('TEA', full_queue)
+    stock_manager.subscribe_price('TEA', last.append)
+    tea = stock_manager.get_stock('TEA')
+    tea.record_trade(1000.0, 1, model.TRADE_BUY, 5.0)
+    assert [] == stock_manager.publish()
+
+    tea.record_trade(1000.0, 2, model.TRADE_BUY, 6.5)
+    failed = stock_manager.publish()
+    assert [failing] == [notification.subscription for notification in failed]
+    assert isinstance(failed[0].error, Queue.Full)
+    assert [5.0, 6.0] == [notification.value for notification in first]
+    assert [5.0, 6.0] == [notification.value for notification in last]
+
+    # The value the target failed to take is offered again
+    assert 5.0 == full_queue.get_nowait().value
+    assert [] == stock_manager.publish()
+    assert 6.0 == full_queue.get_nowait().value
+    assert 2 == len(first)
@@ -0,0 +1,118 @@
+
+from sss import model
+from sss import tradefile
+
+import mock
+import pytest
+
+
+@pytest.fixture(params=['python', 'numpy'])
+def file_reader(request):
+    if request.param == 'python':
+        with mock.patch.object(tradefile, 'numpy', None):
+            yield
+    else:
+        pytest.importorskip('numpy')
+        yield
+
+
+def write_csv(path, lines):
+    with open(path, 'wb') as csv_file:
+        csv_file.write('\n'.join(lines) + '\n')
+
+
+def test_trade_file_converted_from_csv_loads_trades(tmpdir, file_reader):
+    csv_path = str(tmpdir.join('trades.csv'))
+    path = str(tmpdir.join('trades.bin'))
+    write_csv(csv_path, [
+        'timestamp,symbol,quantity,buy_sell,price',
+        '10.0,TEA,2,buy,10.0',
+        '11.0,POP,1,sell,3.0',
+        '12.0,TEA,1,sell,40.0',
+        '9.0,TEA,1,buy,1.0',
+        '13.0,ALE,1,buy,1.0',
+        '14.0,POP,3,buy,5.0',
+    ])
+    stock_manager = model.StockManager()
+    for symbol in ('TEA', 'POP'):
+        stock_manager.add_stock(
+            model.Stock(symbol, model.TYPE_COMMON, 1, None, 100)
+        )
+
+    assert 6 == tradefile.convert_csv(csv_path, path)
+    with tradefile.TradeFile(path) as trade_file:
+        assert 6 == len(trade_file)
+        assert ['TEA', 'POP', 'ALE'] == trade_file.symbols
+        assert ('POP', 11.0, 1, 'sell', 3.0) == list(trade_file)[1]
+        with mock.patch('time.time', return_value=20.0):
+            rejected = trade_file.load(stock_manager, chunk_size=4)
+
+            assert [3, 4] == [trade.index for trade in rejected]
+            assert rejected[0].error.startswith('timestamp')
+            assert 'Stock "ALE" is not found' == rejected[1].error
+            assert 20.0 == stock_manager.get_stock('TEA').stock_price
+            assert 4.5 == stock_manager.get_stock('POP').stock_price
+
+
+def test_trade_file_records_are_viewed_in_place(tmpdir):
+    pytest.importorskip('numpy')
+    path = str(tmpdir.join('trades.bin'))
+    with tradefile.TradeFileWriter(path) as writer:
+        for timestamp in range(100):
+            writer.write('TEA', float(timestamp), timestamp + 1, 'buy', 1.5)
+
+    with tradefile.TradeFile(path) as trade_file:
+        records = trade_file.records(90)
+
+        assert 10 == len(records)
+        assert not records.flags.owndata
+        assert 90.0 == records['timestamp'][0]
+        assert 100 == records['quantity'][-1]
+        del records
+
+
+def test_trade_file_convert_reports_bad_line(tmpdir):
+    csv_path = str(tmpdir.join('trades.csv'))
+    write_csv(csv_path, [
+        'symbol,timestamp,quantity,buy_sell,price',
+        'TEA,1.0,1,buy,1.0',
+        'TEA,2.0,1,hold,1.0',
+    ])
+
+    with pytest.raises(tradefile.TradeFileError) as error:
+        tradefile.convert_csv(csv_path, str(tmpdir.join('trades.bin')))
+    assert error.value.message.startswith('line 3: buy_sell')
+
+
+def test_trade_file_rejects_other_files(tmpdir):
+    path = str(tmpdir.join('trades.bin'))
+    with open(path, 'wb') as other_file:
+        other_file.write('not a trade file at all')
+
+    with pytest.raises(tradefile.TradeFileError):
+        tradefile.TradeFile(path)
+
+
+@pytest.mark.parametrize('side', [-1, 2])
+def test_trade_file_rejects_invalid_sides(tmpdir, file_reader, side):
+    path = str(tmpdir.join('trades.bin'))
+    with tradefile.TradeFileWriter(path) as writer:
+        writer.write('TEA', 1.0, 1, 'buy', 1.0)
+        with pytest.raises(tradefile.TradeFileError):
+            writer.write('POP', 2.0, 1, 'hold', 1.0)
+        writer.write('TEA', 3.0, 1, 'sell', 1.0)
+    with open(path, 'r+b') as trade_file:
+        trade_file.seek(tradefile.HEADER.size + tradefile.RECORD.size + 16)
+        trade_file.write(chr(side & 0xff))
+    stock_manager = model.StockManager()
+    stock_manager.add_stock(model.Stock('TEA', model.TYPE_COMMON, 1, None,
+                                        100))
+
+    with tradefile.TradeFile(path) as trade_file:
+        assert ['TEA'] == trade_file.symbols
+        with pytest.raises(tradefile.TradeFileError) as error:
+            list(trade_file)
+        assert 'record 1' in error.value.message
+        with pytest.raises(tradefile.TradeFileError) as error:
+            trade_file.load(stock_manager)
+        assert 'record 1' in error.value.message
@@ -0,0 +1,177 @@
+import math
+
+from sss import window
+
+import hypothesis
+import hypothesis.strategies as hs
+import pytest
+
+trade_strategy = hs.tuples(
+    hs.floats(min_value=0.0, max_value=1e6),
+    hs.integers(min_value=1, max_value=2 ** 31 - 1),
+    hs.integers(min_value=0, max_value=1),
+    hs.floats(min_value=0.01, max_value=1e12)
+)
+# Each step appends a batch of trades and then evicts everything older than
+# a timestamp
+steps_strategy = hs.lists(
+    hs.tuples(
+        hs.lists(trade_strategy, max_size=40),
+        hs.floats(min_value=0.0, max_value=1e6)
+    ),
+    min_size=1
+)
+
+
+def expected_vwap(trades):
+    if not trades:
+        return 0.0
+    total_price = math.fsum(quantity * price
+                            for _, quantity, _, price in trades)
+    total_quantity = sum(quantity for _, quantity, _, _ in trades)
+    return total_price / total_quantity
+
+
+def test_trade_window_empty():
+    trade_window = window.TradeWindow()
+
+    assert 0 == len(trade_window)
+    assert 0.0 == trade_window.vwap
+    assert trade_window.last_timestamp is None
+    assert 0 == trade_window.evict_before(1e9)
+
+
+def test_trade_window_getitem_out_of_range_fails():
+    trade_window = window.TradeWindow()
+    trade_window.append(1.0, 1, 1, 1.0)
+
+    with pytest.raises(IndexError):
+        trade_window[1]
+
+
+@hypothesis.given(steps=steps_strategy)
+def test_trade_window_matches_reference(steps):
+    trade_window = window.TradeWindow()
+    reference = []
+    last_timestamp = 0.0
+
+    for trades, relevant_since in steps:
+        for timestamp, quantity, side, price in sorted(trades):
+            timestamp = max(timestamp, last_timestamp)
+            last_timestamp = timestamp
+            trade_window.append(timestamp, quantity, side, price)
+            reference.append((timestamp, quantity, side, price))
+
+        expected_evicted = len(
+            [trade for trade in reference if trade[0] < relevant_since]
+        )
+        reference = [trade for trade in reference
+                     if trade[0] >= relevant_since]
+
+        assert expected_evicted == trade_window.evict_before(relevant_since)
+        assert len(reference) == len(trade_window)
+        assert reference == [trade_window[i]
+                             for i in range(len(trade_window))]
+        assert expected_vwap(reference) == pytest.approx(trade_window.vwap)
+        assert trade_window.capacity >= len(trade_window)
+
+
+def test_trade_window_grows_and_shrinks():
+    trade_window = window.TradeWindow()
+
+    for timestamp in range(1000):
+        trade_window.append(float(timestamp), 1, 1, float(timestamp))
+    assert 1024 == trade_window.capacity
+
+    trade_window.evict_before(990.0)
+    assert 10 == len(trade_window)
+    assert 32 == trade_window.capacity
+    assert 990.0 == trade_window[0][0]
+    assert 999.0 == trade_window.last_timestamp
+    assert (990.0 + 999.0) / 2 == trade_window.vwap
+
+
+@hypothesis.given(
+    trades=hs.lists(trade_strategy),
+    relevant_since=hs.floats(min_value=0.0, max_value=1e6),
+    since=hs.floats(min_value=0.0, max_value=1e6),
+    until=hs.one_of(hs.none(), hs.floats(min_value=0.0, max_value=1e6))
+)
+def test_trade_window_vwap_since(trades, relevant_since, since, until):
+    trade_window = window.TradeWindow()
+    trades = sorted(trades)
+    for trade in trades:
+        trade_window.append(*trade)
+    trade_window.evict_before(relevant_since)
+
+    expected_trades = [
+        trade for trade in trades
+        if trade[0] >= relevant_since and trade[0] >= since and
+        (until is None or trade[0] <= until)
+    ]
+    # Sums over a range are differences of cumulative sums, so their error is
+    # relative to sums over all stored trades
+    stored_trades = [trade for trade in trades if trade[0] >= relevant_since]
+    tolerance = 1e-9 * sum(quantity * price
+                           for _, quantity, _, price in stored_trades)
+    if expected_trades:
+        tolerance /= sum(quantity for _, quantity, _, _ in expected_trades)
+    assert (
+        trade_window.vwap_since(since, until) ==
+        pytest.approx(expected_vwap(expected_trades), abs=tolerance)
+    )
+
+
+@hypothesis.given(
+    trades=hs.lists(trade_strategy),
+    moments=hs.lists(hs.tuples(
+        hs.integers(min_value=0, max_value=10),
+        hs.floats(min_value=0.0, max_value=1e6)
+    ))
+)
+def test_time_window_price(trades, moments):
+    trades = sorted(trades)
+    trade_window = window.TradeWindow()
+    time_window = window.TimeWindow(trade_window, 1e5)
+    recorded = 0
+
+    for count, now in moments:
+        for trade in trades[recorded:recorded + count]:
+            trade_window.append(*trade)
+        recorded += count
+
+        time_window.advance(now)
+
+        expected_trades = [trade for trade in trades[:recorded]
+                           if trade[0] >= now - 1e5]
+        assert (
+            time_window.price ==
+            pytest.approx(expected_vwap(expected_trades))
+        )
+
+
+def test_time_window_passes_dropped_trades():
+    trade_window = window.TradeWindow()
+    time_window = window.TimeWindow(trade_window, 10.0)
+    for timestamp in range(100):
+        trade_window.append(float(timestamp), 1, 1, float(timestamp))
+
+    time_window.advance(50.0)
+    trade_window.evict_before(60.0)
+    time_window.advance(55.0)
+
+    assert (60.0 + 99.0) / 2 == time_window.price
+
+
+def test_windows_recover_from_overflowed_trade():
+    trade_window = window.TradeWindow()
+    time_window = window.TimeWindow(trade_window, 10.0)
+    trade_window.append(0.0, 10, 1, 1e308)
+    trade_window.append(20.0, 1, 1, 2.0)
+    trade_window.append(21.0, 1, 1, 4.0)
+
+    time_window.advance(25.0)
+    trade_window.evict_before(15.0)
+
+    assert 3.0 == time_window.price
+    assert 3.0 == trade_window.vwap